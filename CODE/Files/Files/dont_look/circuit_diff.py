@@ -0,0 +1,253 @@
+# ============================
+# Structural comparison of two stim circuits
+#
+# Instead of rendering both circuits and comparing pixels, both circuits are
+#  walked instruction by instruction (REPEAT blocks are iterated lazily,
+#  never flattened into a new circuit) and put in a canonical form:
+#
+#   - operations are grouped in layers separated by TICKs; inside a layer,
+#     consecutive instructions acting on disjoint qubits commute and are
+#     merged and sorted by (gate, arguments, targets), so "H 0 1" and
+#     "H 1\nH 0" agree, and gate aliases (CNOT/CX) agree;
+#   - a measurement is named by its qubits (or Pauli product) and how many
+#     times they were measured before, so detectors, observables and
+#     classically controlled gates refer to measurements independently of
+#     the order of the targets of a measurement layer;
+#   - detectors are compared in order, with their absolute coordinates
+#     (SHIFT_COORDS applied) and the set of measurements they compare.
+#
+# first_difference(circuit1, circuit2) returns None for equivalent circuits,
+#  otherwise a message naming the first differing layer or detector and
+#  where it is, so hundreds of variants can be checked without any display:
+#
+#   message = first_difference(my_circuit, stim.Circuit(surface_code_circuit_string(3, 3, 0.001)))
+
+import stim
+
+# noise channels whose meaning depends on the instruction before them
+ORDERED_GATES = {"E", "ELSE_CORRELATED_ERROR"}
+# instructions that are not operations on qubits
+ANNOTATIONS = {"DETECTOR", "OBSERVABLE_INCLUDE", "QUBIT_COORDS", "SHIFT_COORDS", "MPAD"}
+
+def walk(circuit, location=()):
+    # Yields (location, instruction) for every instruction of `circuit`, going
+    #  through REPEAT blocks iteration by iteration. A location is a tuple of
+    #  (instruction index, iteration) pairs, iteration None outside REPEATs.
+    for i, instruction in enumerate(circuit):
+        if isinstance(instruction, stim.CircuitRepeatBlock):
+            body = instruction.body_copy()
+            for iteration in range(instruction.repeat_count):
+                yield from walk(body, location + ((i, iteration),))
+        else:
+            yield location + ((i, None),), instruction
+
+def format_location(location):
+    parts = []
+    for i, iteration in location:
+        parts.append(f"instruction {i}" if iteration is None else f"REPEAT at {i}, iteration {iteration}")
+    return " > ".join(parts)
+
+def target_key(target):
+    # (prefix, value) of a qubit or Pauli target, e.g. ("X", 3) or ("!", 5).
+    if target.is_x_target:
+        prefix = "X"
+    elif target.is_y_target:
+        prefix = "Y"
+    elif target.is_z_target:
+        prefix = "Z"
+    elif target.is_sweep_bit_target:
+        prefix = "sweep"
+    else:
+        prefix = ""
+    if target.is_inverted_result_target:
+        prefix = "!" + prefix
+    return (prefix, target.value)
+
+def format_target(key):
+    prefix, value = key
+    if prefix.startswith("rec "):
+        return f"rec({prefix[4:]}#{value})"
+    return f"{prefix}{value}"
+
+
+class CanonicalWalker:
+    # Walks a circuit once, keeping the measurement record (as measurement
+    #  names), the coordinate shift and the qubits touched by the current
+    #  block of commuting instructions.
+
+    def __init__(self, circuit):
+        self.circuit = circuit
+        self.record = [] # measurement names, in record order
+        self.counts = {} # measurements so far per measured group
+        self.shift = []
+
+    def measurement(self, group):
+        # Name of a new measurement of `group`: ("rec <group>", occurrence).
+        name = " ".join(format_target((prefix.lstrip("!"), value)) for prefix, value in group)
+        occurrence = self.counts.get(name, 0)
+        self.counts[name] = occurrence + 1
+        return ("rec " + name, occurrence)
+
+    def recorded(self, target):
+        return self.record[len(self.record) + target.value]
+
+    def group_keys(self, instruction, symmetric):
+        groups = []
+        for group in instruction.target_groups():
+            keys = tuple(self.recorded(t) if t.is_measurement_record_target else target_key(t) for t in group)
+            groups.append(tuple(sorted(keys)) if symmetric else keys)
+        return groups
+
+    def layers(self):
+        # Yields (tick, location, entries) per layer; entries is a tuple of
+        #  blocks, each a sorted tuple of (gate, arguments, target groups).
+        tick, start, blocks = 0, None, []
+        block, touched = {}, set()
+
+        def close_block():
+            nonlocal block, touched
+            if block:
+                blocks.append(tuple(sorted((name, args, tuple(sorted(groups)))
+                                           for (name, args), groups in block.items())))
+            block, touched = {}, set()
+
+        for location, instruction in walk(self.circuit):
+            name = instruction.name
+            if name == "TICK":
+                close_block()
+                yield tick, start, tuple(blocks)
+                tick, start, blocks = tick + 1, None, []
+                continue
+            if name in ANNOTATIONS:
+                if instruction.num_measurements: # MPAD
+                    self.record += [self.measurement(group) for group in self.group_keys(instruction, False)]
+                continue
+            gate = stim.gate_data(name)
+            start = start or location
+            groups = self.group_keys(instruction, gate.is_symmetric_gate)
+            if instruction.num_measurements:
+                self.record += [self.measurement(group) for group in groups]
+            qubits = {t.value for t in instruction.targets_copy() if not t.is_measurement_record_target
+                      and not t.is_combiner and not t.is_sweep_bit_target}
+            if qubits & touched or gate.name in ORDERED_GATES:
+                close_block()
+            key = (gate.name, tuple(instruction.gate_args_copy()))
+            block.setdefault(key, []).extend(groups)
+            touched |= qubits
+            if gate.name in ORDERED_GATES:
+                close_block()
+        close_block()
+        if blocks:
+            yield tick, start, tuple(blocks)
+
+    def annotations(self):
+        # Yields ("detector", index, location, coordinates, measurements) in
+        #  order, then ("observables", ...) and ("qubit coordinates", ...) once.
+        observables = {}
+        qubit_coords = {}
+        index = 0
+        for location, instruction in walk(self.circuit):
+            name = instruction.name
+            if name == "SHIFT_COORDS":
+                args = instruction.gate_args_copy()
+                self.shift += [0.0] * (len(args) - len(self.shift))
+                self.shift = [s + a for s, a in zip(self.shift, args + [0.0] * len(self.shift))]
+            elif name == "QUBIT_COORDS":
+                for t in instruction.targets_copy():
+                    qubit_coords[t.value] = tuple(instruction.gate_args_copy())
+            elif name in ("DETECTOR", "OBSERVABLE_INCLUDE"):
+                measurements = set()
+                for t in instruction.targets_copy():
+                    if t.is_measurement_record_target:
+                        measurements ^= {self.recorded(t)}
+                if name == "DETECTOR":
+                    args = instruction.gate_args_copy()
+                    coords = tuple(a + (self.shift[k] if k < len(self.shift) else 0.0)
+                                   for k, a in enumerate(args))
+                    yield "detector", index, location, coords, tuple(sorted(measurements))
+                    index += 1
+                else:
+                    k = int(instruction.gate_args_copy()[0])
+                    observables[k] = observables.get(k, set()) ^ measurements
+            elif instruction.num_measurements:
+                gate = stim.gate_data(name)
+                self.record += [self.measurement(group)
+                                for group in self.group_keys(instruction, gate.is_symmetric_gate)]
+        yield "observables", None, None, None, {k: tuple(sorted(v)) for k, v in observables.items()}
+        yield "qubit coordinates", None, None, None, qubit_coords
+
+
+def format_groups(name, args, groups, limit=8):
+    gate = name + ("(" + ", ".join(map(str, args)) + ")" if args else "")
+    # Pauli products are joined with "*", pairs of a two-qubit gate with " "
+    shown = [("*" if group[0][0].lstrip("!") in ("X", "Y", "Z") else " ").join(map(format_target, group))
+             for group in groups[:limit]]
+    return f"{gate} {', '.join(shown)}{', ...' if len(groups) > limit else ''}"
+
+def entry_difference(a, b):
+    # The target groups of a block that the other block lacks, per gate.
+    a = {(name, args): list(groups) for name, args, groups in a}
+    b = {(name, args): list(groups) for name, args, groups in b}
+    lines = []
+    for key in a:
+        extra = list(a[key])
+        for group in b.get(key, []):
+            if group in extra:
+                extra.remove(group)
+        if extra:
+            lines.append(format_groups(*key, extra))
+    return "; ".join(lines) or "-"
+
+def layer_difference(tick, left, right):
+    (_, left_start, left_blocks), (_, right_start, right_blocks) = left, right
+    for k in range(max(len(left_blocks), len(right_blocks))):
+        a = left_blocks[k] if k < len(left_blocks) else ()
+        b = right_blocks[k] if k < len(right_blocks) else ()
+        if a != b:
+            return (f"layer after {tick} TICKs differs (starting at {format_location(left_start or ())} vs "
+                    f"{format_location(right_start or ())}):\n"
+                    f"  first circuit only:  {entry_difference(a, b)}\n"
+                    f"  second circuit only: {entry_difference(b, a)}")
+    return None
+
+def format_annotation(mapping):
+    # Observables ({index: measurements}) or qubit coordinates ({qubit: coords}).
+    return "; ".join(f"{k}: " + (", ".join(map(format_target, v)) if v and isinstance(v[0], tuple) else str(v))
+                     for k, v in sorted(mapping.items()))
+
+def first_difference(circuit1, circuit2, without_noise=False):
+    # None if the circuits are equivalent up to the normalizations above,
+    #  otherwise a message describing the first difference.
+    if without_noise:
+        circuit1, circuit2 = circuit1.without_noise(), circuit2.without_noise()
+    missing = object()
+
+    layers1, layers2 = CanonicalWalker(circuit1).layers(), CanonicalWalker(circuit2).layers()
+    while True:
+        left, right = next(layers1, missing), next(layers2, missing)
+        if left is missing and right is missing:
+            break
+        if left is missing or right is missing:
+            tick = (right if left is missing else left)[0]
+            which = "first" if left is missing else "second"
+            return f"the {which} circuit has no layer after {tick} TICKs, the other one goes on"
+        if left[2] != right[2]:
+            return layer_difference(left[0], left, right)
+
+    annotations1, annotations2 = CanonicalWalker(circuit1).annotations(), CanonicalWalker(circuit2).annotations()
+    for left, right in zip(annotations1, annotations2):
+        if left[0] != right[0]:
+            detector = left if left[0] == "detector" else right
+            which = "first" if detector is left else "second"
+            return f"only the {which} circuit has detector D{detector[1]} ({format_location(detector[2])})"
+        if left[3:] == right[3:]:
+            continue
+        if left[0] != "detector":
+            return (f"{left[0]} differ:\n  first circuit:  {format_annotation(left[4])}\n"
+                    f"  second circuit: {format_annotation(right[4])}")
+        measurements1 = ", ".join(map(format_target, left[4]))
+        measurements2 = ", ".join(map(format_target, right[4]))
+        return (f"detector D{left[1]} differs ({format_location(left[2])} vs {format_location(right[2])}):\n"
+                f"  first circuit:  coords {left[3]}, {measurements1}\n"
+                f"  second circuit: coords {right[3]}, {measurements2}")
+    return None
@@ -0,0 +1,295 @@
+# ============================
+# Adaptive shot allocation over a (distance, p) sweep
+#
+# sweep.py gives every grid point the same max_shots/max_errors budget, so
+#  most shots go to points that hardly move the quantities a sweep is run
+#  for. Here the points share one fit of the usual below-threshold ansatz
+#  for the per-round logical error rate eps (sinter's
+#  shot_error_rate_to_piece_error_rate of the failure rate),
+#
+#   log eps(d, p) = c0 + t (c1 log p + c2),     t = (d+1)/2,
+#
+#  by weighted least squares (weights from the binomial variance of every
+#  point's failure count). Three targets follow from the coefficients, all
+#  as logarithms, so their standard errors are relative errors:
+#
+#   - threshold:  log p_th = -c2/c1              (where Lambda = 1)
+#   - lambda:     log Lambda(p_ref) = -(c1 log p_ref + c2),
+#                 Lambda = eps(d)/eps(d+2)
+#   - per_round:  log eps(d_ref, p_ref)
+#
+#  (p_ref defaults to the smallest p of the grid, d_ref to the largest
+#  distance.) Their variances are g^T (X^T W X)^-1 g for the gradients g.
+#
+# After every finished batch the scheduler re-plans. First every point is
+#  sampled (fewest shots first) until it has `min_errors` failures or
+#  `pilot_shots` shots, so that no part of the grid is left to
+#  extrapolation. Then the next batch goes to the point whose extra
+#  shots shrink sum_targets (z sigma / width)^2 the most per unit of cost
+#  (shots times detectors); a point not fitted yet counts with the failure
+#  rate the fit predicts for it. Shots in flight count as already taken.
+#  The sweep stops once every target's confidence half-width is at most
+#  `width`, or when no point can take more shots.
+#
+# Batches, the checkpoint file and the worker cache are sweep.py's, so an
+#  adaptive sweep resumes from (and can extend) a fixed-budget one.
+#
+# Run from the CODE directory:
+#   python -m Surface_Code_Google.adaptive_sweep --distances 3 5 7 --ps 0.002 0.003 0.004 0.005 \
+#       --checkpoint adaptive.jsonl --width 0.05
+
+import argparse
+import collections
+import concurrent.futures
+import os
+
+import numpy as np
+import scipy.stats
+
+from .sweep import DEFAULT_BATCH_SIZE, append_checkpoint, load_checkpoint, point_key, run_batch, sweep_grid
+
+TARGETS = ("threshold", "lambda", "per_round")
+
+
+def per_round_error_rate(rate, rounds):
+    # sinter.shot_error_rate_to_piece_error_rate for a memory experiment.
+    return (1 - (1 - 2*rate)**(1/rounds)) / 2
+
+def design_rows(d, p):
+    # Rows [1, t log p, t] of the fit's design matrix.
+    d, p = np.atleast_1d(d).astype(float), np.atleast_1d(p).astype(float)
+    t = (d + 1) / 2
+    return np.column_stack([np.ones(len(d)), t*np.log(p), t])
+
+def log_rate_variance(errors, shots, rounds):
+    # Variance of log eps from the binomial variance of the failure rate.
+    rate = errors / shots
+    with np.errstate(divide="ignore", invalid="ignore"):
+        eps = per_round_error_rate(rate, rounds)
+        slope = (1 - 2*rate)**(1/rounds - 1) / rounds
+        return (slope / eps)**2 * rate * (1 - rate) / shots
+
+
+class ThresholdFit:
+    # Weighted least-squares fit of the ansatz above to (d, p, errors, shots,
+    #  rounds) rows, with the targets and their standard errors.
+
+    def __init__(self, rows, p_ref, d_ref):
+        rows = np.asarray(rows, dtype=float).reshape(-1, 5)
+        d, p, errors, shots, rounds = rows.T
+        self.design = design_rows(d, p)
+        self.y = np.log(per_round_error_rate(errors / shots, rounds))
+        self.variances = log_rate_variance(errors, shots, rounds)
+        self.p_ref, self.d_ref = p_ref, d_ref
+        self.covariance = self.coefficient_covariance(self.design, self.variances)
+        weights = 1 / self.variances
+        if self.covariance is None:
+            self.coefficients = None
+        else:
+            self.coefficients = self.covariance @ (self.design.T @ (weights * self.y))
+
+    def coefficient_covariance(self, design, variances):
+        # (X^T W X)^-1, or None when the points do not determine the fit.
+        if len(variances) < 3:
+            return None
+        normal = design.T @ (design / variances[:, None])
+        if np.linalg.cond(normal) > 1e12:
+            return None
+        return np.linalg.inv(normal)
+
+    def values(self):
+        # The targets, as logarithms.
+        c0, c1, c2 = self.coefficients
+        t_ref = (self.d_ref + 1) / 2
+        return {"threshold": -c2 / c1, "lambda": -(c1*np.log(self.p_ref) + c2),
+                "per_round": c0 + t_ref*(c1*np.log(self.p_ref) + c2)}
+
+    def gradients(self):
+        c0, c1, c2 = self.coefficients
+        t_ref = (self.d_ref + 1) / 2
+        return {"threshold": np.array([0, c2/c1**2, -1/c1]), "lambda": np.array([0, -np.log(self.p_ref), -1]),
+                "per_round": np.array([1, t_ref*np.log(self.p_ref), t_ref])}
+
+    def predicted_rate(self, d, p, rounds):
+        # Failure rate per shot the fit predicts at (d, p, rounds).
+        eps = np.exp(design_rows(d, p) @ self.coefficients)
+        return (1 - (1 - 2*np.minimum(eps, 0.5))**rounds) / 2
+
+    def std_errors(self, variances=None, extra=None):
+        # Standard error of every target, for the current point variances or
+        #  for `variances` (e.g. after hypothetical extra shots), optionally
+        #  with `extra` = (design rows, variances) of points not fitted yet.
+        design = self.design
+        if variances is None:
+            variances = self.variances
+        if extra is not None:
+            design, variances = np.vstack([design, extra[0]]), np.r_[variances, extra[1]]
+        covariance = (self.covariance if extra is None and variances is self.variances
+                      else self.coefficient_covariance(design, variances))
+        if covariance is None or self.coefficients is None:
+            return {name: np.inf for name in TARGETS}
+        return {name: float(np.sqrt(g @ covariance @ g)) for name, g in self.gradients().items()}
+
+
+class AdaptiveScheduler:
+    # Chooses the next batch of a sweep from the totals so far.
+
+    def __init__(self, points, targets=TARGETS, width=0.05, confidence=0.95, min_errors=10,
+                 max_shots=10**8, pilot_shots=10**6, batch_size=DEFAULT_BATCH_SIZE, p_ref=None, d_ref=None):
+        self.points = points
+        self.targets = tuple(targets)
+        self.width = width
+        self.z = scipy.stats.norm.ppf(0.5 + confidence/2)
+        self.min_errors = min_errors
+        self.max_shots = max_shots
+        self.pilot_shots = pilot_shots
+        self.batch_size = batch_size
+        self.p_ref = min(point["p"] for point in points) if p_ref is None else p_ref
+        self.d_ref = max(point["distance"] for point in points) if d_ref is None else d_ref
+
+    def cost(self, point):
+        # Relative cost of one shot: about the number of detectors.
+        return point["distance"]**2 * point["rounds"]
+
+    def fitted(self, totals):
+        # (indices, fit) of the points with enough failures to be fitted.
+        indices, rows = [], []
+        for i, point in enumerate(self.points):
+            counts = totals.get(point_key(point))
+            if counts is None or counts.any_errors < self.min_errors or counts.any_rate >= 0.5:
+                continue
+            indices.append(i)
+            rows.append((point["distance"], point["p"], counts.any_errors, counts.shots, point["rounds"]))
+        return indices, ThresholdFit(rows, self.p_ref, self.d_ref)
+
+    def objective(self, std_errors):
+        return sum((self.z * std_errors[name] / self.width)**2 for name in self.targets)
+
+    def done(self, fit):
+        errors = fit.std_errors()
+        return all(self.z * errors[name] <= self.width for name in self.targets)
+
+    def next_batch(self, totals, in_flight):
+        # (point, shots) of the next batch, or None when the targets are met
+        #  or no point can take more shots.
+        def shots_of(point):
+            counts = totals.get(point_key(point))
+            return (counts.shots if counts is not None else 0) + in_flight[point_key(point)]
+        room = [point for point in self.points if shots_of(point) < self.max_shots]
+        if not room:
+            return None
+
+        indices, fit = self.fitted(totals)
+        fitted_keys = {point_key(self.points[i]) for i in indices}
+        unfitted = [point for point in room if point_key(point) not in fitted_keys
+                    and (totals.get(point_key(point)) is None
+                         or totals[point_key(point)].any_errors < self.min_errors)]
+        # pilot: points without enough failures, fewest shots first
+        pilot = [point for point in unfitted if shots_of(point) < self.pilot_shots]
+        if pilot:
+            point = min(pilot, key=shots_of)
+            return point, min(self.batch_size, self.max_shots - shots_of(point))
+        if fit.coefficients is None or self.done(fit):
+            return None
+
+        # current variances, with the shots in flight counted as taken
+        taken = np.array([totals[point_key(self.points[i])].shots for i in indices], dtype=float)
+        flying = np.array([in_flight[point_key(self.points[i])] for i in indices], dtype=float)
+        variances = fit.variances * taken / (taken + flying)
+        current = self.objective(fit.std_errors(variances))
+        best, best_gain = None, 0.0
+        for point in [self.points[i] for i in indices] + unfitted:
+            shots = min(self.batch_size, self.max_shots - shots_of(point))
+            if shots <= 0:
+                continue
+            if point_key(point) in fitted_keys:
+                j = indices.index(self.points.index(point))
+                trial = variances.copy()
+                trial[j] *= (taken[j] + flying[j]) / (taken[j] + flying[j] + shots)
+                errors = fit.std_errors(trial)
+            else:
+                # a point not fitted yet counts with the rate the fit predicts
+                total = shots_of(point) + shots
+                rate = fit.predicted_rate(point["distance"], point["p"], point["rounds"])
+                extra = (design_rows(point["distance"], point["p"]),
+                         log_rate_variance(rate*total, total, point["rounds"]))
+                errors = fit.std_errors(variances, extra)
+            gain = (current - self.objective(errors)) / (shots * self.cost(point))
+            if gain > best_gain:
+                best, best_gain = (point, shots), gain
+        return best
+
+    def report(self, totals):
+        # {target: (value, lower, upper)} of the current fit, back from logs.
+        _, fit = self.fitted(totals)
+        if fit.coefficients is None:
+            return {}
+        values, errors = fit.values(), fit.std_errors()
+        return {name: (float(np.exp(values[name])), float(np.exp(values[name] - self.z*errors[name])),
+                       float(np.exp(values[name] + self.z*errors[name]))) for name in TARGETS}
+
+
+def run_adaptive(points, checkpoint, scheduler, workers=None, progress=print):
+    # Samples batches chosen by `scheduler` until it returns None, resuming
+    #  from `checkpoint`. Returns key -> FailureCounts.
+    totals = load_checkpoint(checkpoint)
+    in_flight = collections.Counter() # shots scheduled but not yet recorded, per key
+    workers = workers or os.cpu_count()
+
+    with open(checkpoint, "a") as f, concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = {}
+        def submit():
+            # keeps about two batches per worker in flight
+            while len(pending) < 2*workers:
+                batch = scheduler.next_batch(totals, in_flight)
+                if batch is None:
+                    return
+                point, shots = batch
+                in_flight[point_key(point)] += shots
+                pending[pool.submit(run_batch, point, shots)] = (point, shots)
+
+        submit()
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                point, shots = pending.pop(future)
+                key = point_key(point)
+                counts = future.result()
+                in_flight[key] -= shots
+                append_checkpoint(f, point, counts)
+                totals[key] = totals[key] + counts if key in totals else counts
+            if progress is not None:
+                progress(format_report(scheduler.report(totals), sum(c.shots for c in totals.values())))
+            submit()
+    return totals
+
+def format_report(report, shots):
+    if not report:
+        return f"{shots} shots, not enough points with failures to fit yet"
+    return f"{shots} shots: " + ", ".join(f"{name} {value:.4g} [{lower:.4g}, {upper:.4g}]"
+                                          for name, (value, lower, upper) in report.items())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Memory-experiment sweep with adaptive shot allocation.")
+    parser.add_argument("--distances", type=int, nargs="+", default=[3, 5, 7])
+    parser.add_argument("--ps", type=float, nargs="+", default=[0.002, 0.003, 0.004, 0.005])
+    parser.add_argument("--rounds", type=int, nargs="+", default=None,
+                        help="round counts (default: 3*distance)")
+    parser.add_argument("--checkpoint", default="adaptive.jsonl")
+    parser.add_argument("--targets", nargs="+", default=list(TARGETS), choices=TARGETS)
+    parser.add_argument("--width", type=float, default=0.05,
+                        help="target relative half-width of every target's confidence interval")
+    parser.add_argument("--min-errors", type=int, default=10)
+    parser.add_argument("--max-shots", type=int, default=10**8, help="per point")
+    parser.add_argument("--pilot-shots", type=int, default=10**6,
+                        help="shots per point before points without failures wait for the fit")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    points = sweep_grid(args.distances, args.ps, args.rounds)
+    scheduler = AdaptiveScheduler(points, args.targets, args.width, min_errors=args.min_errors,
+                                  max_shots=args.max_shots, pilot_shots=args.pilot_shots,
+                                  batch_size=args.batch_size)
+    totals = run_adaptive(points, args.checkpoint, scheduler, args.workers)
+    print(format_report(scheduler.report(totals), sum(c.shots for c in totals.values())))
@@ -0,0 +1,139 @@
+# Benchmark: decoder latency on the memory circuits of surface_code.py,
+#  swept over distance, rounds and p. For every point it reports per-shot
+#  latency percentiles (p50/p99/p99.9) of decoding one shot at a time,
+#  the throughput of batch decoding, and peak memory. Every point runs in
+#  a freshly spawned process: ru_maxrss is a high-water mark that never goes
+#  down, so in a shared process every point after the largest one would
+#  report that one's peak. Results
+#  are written as JSON; with --baseline, points whose p99 latency or
+#  throughput got worse than the stored results by more than --tolerance
+#  are flagged and the exit status is 1.
+#
+# Run from the CODE directory:
+#   python -m Surface_Code_Google.bench_decoding --distances 3 5 7 --ps 0.001 0.003 --out latency.json
+#   python -m Surface_Code_Google.bench_decoding --baseline latency.json
+
+import argparse
+import concurrent.futures
+import json
+import multiprocessing
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from .evaluation import as_circuit, matcher_for
+from .surface_code import surface_code_circuit_string
+
+
+def peak_rss_mb():
+    # Peak resident set size of this process so far (Linux reports KiB).
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def isolated(fn, *args, **kwargs):
+    # Runs fn(*args, **kwargs) in a new spawned process and returns its result.
+    context = multiprocessing.get_context("spawn")
+    with concurrent.futures.ProcessPoolExecutor(1, mp_context=context) as pool:
+        return pool.submit(fn, *args, **kwargs).result()
+
+def bench_point(distance, rounds, p, initial="0", shots=2000, batch_size=10_000, decoder_factory=matcher_for):
+    # Latency and throughput of one (distance, rounds, p) point. peak_rss_mb
+    #  is only this point's peak when the process is fresh (see `isolated`);
+    #  start_rss_mb is the process's peak before the point started.
+    start_rss = peak_rss_mb()
+    circuit = as_circuit(surface_code_circuit_string(distance, 0, rounds, p, initial))
+    decoder = decoder_factory(circuit)
+    sampler = circuit.compile_detector_sampler(seed=0)
+
+    # one shot at a time
+    detection_events, _ = sampler.sample(shots, separate_observables=True)
+    latencies = np.empty(shots)
+    for i, syndrome in enumerate(detection_events):
+        start = time.perf_counter_ns()
+        decoder.decode(syndrome)
+        latencies[i] = time.perf_counter_ns() - start
+    latencies /= 1e3 # microseconds
+
+    # batches, bit-packed
+    detection_events, _ = sampler.sample(batch_size, separate_observables=True, bit_packed=True)
+    tracemalloc.start()
+    start = time.perf_counter()
+    decoder.decode_batch(detection_events, bit_packed_shots=True, bit_packed_predictions=True)
+    elapsed = time.perf_counter() - start
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    p50, p99, p999 = np.percentile(latencies, [50, 99, 99.9])
+    return {"d": distance, "rounds": rounds, "p": p, "initial": initial,
+            "num_detectors": circuit.num_detectors,
+            "p50_us": float(p50), "p99_us": float(p99), "p999_us": float(p999),
+            "mean_us": float(latencies.mean()),
+            "shots_per_s": batch_size / elapsed,
+            "batch_python_peak_mb": traced_peak / 2**20,
+            "start_rss_mb": start_rss, "peak_rss_mb": peak_rss_mb()}
+
+def bench_decoding(distances, ps, rounds=None, rounds_per_distance=3, **kwargs):
+    # One row per (distance, rounds, p), each measured in its own process.
+    #  `rounds` is a list of round counts, or None for
+    #  rounds_per_distance*distance rounds.
+    rows = []
+    for d in distances:
+        for r in (rounds if rounds is not None else [rounds_per_distance*d]):
+            for p in ps:
+                rows.append(isolated(bench_point, d, r, p, **kwargs))
+    return rows
+
+def row_key(row):
+    return (row["d"], row["rounds"], row["p"], row["initial"])
+
+def find_regressions(rows, baseline, tolerance=0.2):
+    # Messages for rows slower than the matching baseline row by more than
+    #  `tolerance` (relative) in p99 latency or throughput.
+    stored = {row_key(row): row for row in baseline}
+    messages = []
+    for row in rows:
+        old = stored.get(row_key(row))
+        if old is None:
+            continue
+        name = f"d={row['d']} rounds={row['rounds']} p={row['p']}"
+        if row["p99_us"] > old["p99_us"] * (1 + tolerance):
+            messages.append(f"{name}: p99 {old['p99_us']:.1f} -> {row['p99_us']:.1f} us")
+        if row["shots_per_s"] < old["shots_per_s"] / (1 + tolerance):
+            messages.append(f"{name}: throughput {old['shots_per_s']:.0f} -> {row['shots_per_s']:.0f} shots/s")
+    return messages
+
+def print_rows(rows):
+    print(f"{'d':>4} {'rounds':>7} {'p':>8} {'p50 (us)':>9} {'p99 (us)':>9} {'p99.9 (us)':>11} "
+          f"{'shots/s':>10} {'rss (MB)':>9} {'+point (MB)':>12}")
+    for row in rows:
+        print(f"{row['d']:>4} {row['rounds']:>7} {row['p']:>8g} {row['p50_us']:>9.1f} {row['p99_us']:>9.1f} "
+              f"{row['p999_us']:>11.1f} {row['shots_per_s']:>10.0f} {row['peak_rss_mb']:>9.1f} "
+              f"{row['peak_rss_mb'] - row['start_rss_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Decoder latency percentiles, throughput and memory.")
+    parser.add_argument("--distances", type=int, nargs="+", default=[3, 5, 7, 9])
+    parser.add_argument("--rounds", type=int, nargs="+", default=None,
+                        help="round counts (default: 3*distance)")
+    parser.add_argument("--ps", type=float, nargs="+", default=[0.001, 0.003])
+    parser.add_argument("--shots", type=int, default=2000, help="shots decoded one at a time")
+    parser.add_argument("--batch-size", type=int, default=10_000)
+    parser.add_argument("--out", default=None, help="write the results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="JSON results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    rows = bench_decoding(args.distances, args.ps, args.rounds, shots=args.shots, batch_size=args.batch_size)
+    print_rows(rows)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(rows, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = find_regressions(rows, json.load(f), args.tolerance)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,243 @@
+# Benchmark: circuit generation time versus distance, for the original text
+#  path (the f-string generator of the baseline commit + stim parsing) and
+#  the builder path (surface_code_circuit), and the per-p cost of a noise
+#  sweep from a NoiseTemplate. The original generator is read from git with
+#  `git show <commit>:./surface_code.py` when the benchmark starts; outside a
+#  git checkout the text column is left out.
+#
+# With --suite it instead times every stage of getting a decodable model:
+#  generating the circuit string, parsing it with stim, and building the
+#  decomposed detector error model. A distance sweep (d=3..51), a rounds
+#  sweep (up to 1000) and a patch sweep (1-16 patches through `idx`) record
+#  wall time, traced allocations and output size per stage. Results can be
+#  saved as a baseline and later runs compared against it.
+#
+# Run from the CODE directory:
+#   python -m Surface_Code_Google.bench_generation
+#   python -m Surface_Code_Google.bench_generation --distances 3 9 25 --repeats 3
+#   python -m Surface_Code_Google.bench_generation --baseline-commit c34f1e8
+#   python -m Surface_Code_Google.bench_generation --suite --out generation.json
+#   python -m Surface_Code_Google.bench_generation --suite --baseline generation.json
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import stim
+
+from .lattice import RegisterLayout, grid_positions, template_layout
+from .noise_template import NoiseTemplate
+from .surface_code import patch_layout, surface_code_circuit, surface_code_circuit_string
+
+
+# The commit holding the original f-string surface_code.py.
+BASELINE_COMMIT = "c34f1e8"
+
+def baseline_generator(commit=BASELINE_COMMIT):
+    # surface_code_circuit_string of surface_code.py at `commit`, or None when
+    #  git or the commit is not available.
+    try:
+        source = subprocess.run(["git", "show", f"{commit}:./surface_code.py"], capture_output=True, text=True,
+                                check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    namespace = {}
+    exec(compile(source, f"{commit}:surface_code.py", "exec"), namespace)
+    return namespace["surface_code_circuit_string"]
+
+def time_call(fn, repeats):
+    # Returns the best wall time (seconds) over `repeats` calls of fn().
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bench_generation(distances, rounds_per_distance=3, p=0.001, initial="0", repeats=3, baseline=None):
+    # Returns one row per distance with the time taken by each path. The text
+    #  path is `baseline` (see baseline_generator), not
+    #  surface_code_circuit_string, which now goes through the builder itself;
+    #  without a baseline text_s is None.
+    rows = []
+    for d in distances:
+        rounds = rounds_per_distance * d
+        text_time = None if baseline is None else time_call(
+            lambda: stim.Circuit(baseline(d, 0, rounds, p, initial)), repeats)
+        builder_time = time_call(
+            lambda: surface_code_circuit(d, 0, rounds, p, initial), repeats)
+        rows.append({"d": d, "rounds": rounds, "text_s": text_time, "builder_s": builder_time})
+    return rows
+
+def bench_register(distance, num_patches, repeats=3):
+    # Returns the time to lay out one patch from scratch and a K-patch
+    #  register shifted from the shared template.
+    def one_patch():
+        template_layout.cache_clear()
+        template_layout(distance)
+    def register():
+        template_layout.cache_clear()
+        RegisterLayout(distance, grid_positions(num_patches, int(num_patches**0.5) or 1))
+    return time_call(one_patch, repeats), time_call(register, repeats)
+
+def bench_sweep(distances, ps, rounds_per_distance=3, initial="0", repeats=3):
+    # Returns one row per distance with the per-p time of a sweep that
+    #  rebuilds every circuit, and of one that swaps probabilities in a
+    #  template compiled once (compile time reported separately).
+    rows = []
+    for d in distances:
+        rounds = rounds_per_distance * d
+        compile_time = time_call(
+            lambda: NoiseTemplate(surface_code_circuit(d, 0, rounds, ps[0], initial)), 1)
+        template = NoiseTemplate(surface_code_circuit(d, 0, rounds, ps[0], initial))
+        rebuild = time_call(lambda: [surface_code_circuit(d, 0, rounds, p, initial) for p in ps], repeats)
+        swap = time_call(lambda: [template.circuit(p) for p in ps], repeats)
+        rows.append({"d": d, "compile_s": compile_time,
+                     "rebuild_s": rebuild/len(ps), "template_s": swap/len(ps)})
+    return rows
+
+# ======================================================
+# stage suite
+
+SUITE_DISTANCES = [3, 5, 9, 15, 25, 35, 51]
+SUITE_ROUNDS = [10, 30, 100, 300, 1000]
+SUITE_PATCHES = [1, 2, 4, 8, 16]
+
+def traced_call(fn):
+    # Returns fn()'s result and the peak bytes Python allocated during it.
+    tracemalloc.start()
+    try:
+        result = fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, peak
+
+def multi_patch_string(distance, rounds, num_patches, p, initial):
+    # Circuit strings of patches idx=0..num_patches-1, concatenated.
+    return "".join(surface_code_circuit_string(distance, idx, rounds, p, initial)
+                   for idx in range(num_patches))
+
+def bench_stages(distance, rounds, num_patches=1, p=0.001, initial="0", repeats=3):
+    # Wall time, traced allocation peak and output size of each stage for
+    #  one configuration.
+    stages = {
+        "generate": (lambda: multi_patch_string(distance, rounds, num_patches, p, initial), len),
+        "parse": (lambda: stim.Circuit(text), lambda c: len(str(c))),
+        "dem": (lambda: circuit.detector_error_model(decompose_errors=True), lambda m: len(str(m))),
+    }
+    row = {"d": distance, "rounds": rounds, "patches": num_patches, "p": p, "initial": initial}
+    text = circuit = None
+    for name, (fn, size) in stages.items():
+        result, peak = traced_call(fn)
+        row[f"{name}_s"] = time_call(fn, repeats)
+        row[f"{name}_alloc_bytes"] = peak
+        row[f"{name}_size_bytes"] = size(result)
+        if name == "generate":
+            text = result
+        elif name == "parse":
+            circuit = result
+    row["num_detectors"] = circuit.num_detectors
+    return row
+
+def bench_suite(distances=SUITE_DISTANCES, rounds=SUITE_ROUNDS, patches=SUITE_PATCHES,
+                base_distance=5, p=0.001, initial="0", repeats=3):
+    # The distance sweep (rounds=3d, one patch), the rounds sweep and the
+    #  patch sweep (both at base_distance).
+    configs = [(d, 3*d, 1) for d in distances]
+    configs += [(base_distance, r, 1) for r in rounds]
+    configs += [(base_distance, 3*base_distance, k) for k in patches]
+    rows, seen = [], set()
+    for config in configs:
+        if config not in seen:
+            seen.add(config)
+            rows.append(bench_stages(*config, p=p, initial=initial, repeats=repeats))
+    return rows
+
+def suite_key(row):
+    return (row["d"], row["rounds"], row["patches"], row["p"], row["initial"])
+
+def find_regressions(rows, baseline, tolerance=0.2):
+    # Messages for stages slower than in the baseline by more than `tolerance`.
+    stored = {suite_key(row): row for row in baseline}
+    messages = []
+    for row in rows:
+        old = stored.get(suite_key(row))
+        if old is None:
+            continue
+        for stage in ("generate", "parse", "dem"):
+            new_s, old_s = row[f"{stage}_s"], old[f"{stage}_s"]
+            if new_s > old_s * (1 + tolerance):
+                messages.append(f"d={row['d']} rounds={row['rounds']} patches={row['patches']} "
+                                f"{stage}: {old_s*1e3:.2f} -> {new_s*1e3:.2f} ms")
+    return messages
+
+def print_suite(rows):
+    print(f"{'d':>4} {'rounds':>7} {'K':>3} {'generate (ms)':>14} {'parse (ms)':>11} {'dem (ms)':>10} "
+          f"{'text (kB)':>10} {'dem (kB)':>9} {'alloc (MB)':>11}")
+    for row in rows:
+        alloc = max(row[f"{stage}_alloc_bytes"] for stage in ("generate", "parse", "dem"))
+        print(f"{row['d']:>4} {row['rounds']:>7} {row['patches']:>3} {row['generate_s']*1e3:>14.2f} "
+              f"{row['parse_s']*1e3:>11.2f} {row['dem_s']*1e3:>10.2f} "
+              f"{row['generate_size_bytes']/1e3:>10.1f} {row['dem_size_bytes']/1e3:>9.1f} {alloc/2**20:>11.2f}")
+
+def print_rows(rows):
+    print(f"{'d':>4} {'rounds':>7} {'text+parse (ms)':>16} {'builder (ms)':>13} {'speedup':>8}")
+    for row in rows:
+        if row["text_s"] is None:
+            print(f"{row['d']:>4} {row['rounds']:>7} {'-':>16} {row['builder_s']*1e3:>13.2f} {'-':>8}")
+            continue
+        print(f"{row['d']:>4} {row['rounds']:>7} {row['text_s']*1e3:>16.2f} "
+              f"{row['builder_s']*1e3:>13.2f} {row['text_s']/row['builder_s']:>7.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Circuit generation time versus distance.")
+    parser.add_argument("--distances", type=int, nargs="+", default=[3, 5, 9, 15, 25, 35])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--patches", type=int, default=50)
+    parser.add_argument("--p", type=float, default=0.001)
+    parser.add_argument("--initial", default="0", choices=["0", "+"])
+    parser.add_argument("--baseline-commit", default=BASELINE_COMMIT,
+                        help="commit whose surface_code.py is timed as the text path")
+    parser.add_argument("--suite", action="store_true",
+                        help="time generation, parsing and DEM construction over the stage suite")
+    parser.add_argument("--suite-distances", type=int, nargs="+", default=SUITE_DISTANCES)
+    parser.add_argument("--suite-rounds", type=int, nargs="+", default=SUITE_ROUNDS)
+    parser.add_argument("--suite-patches", type=int, nargs="+", default=SUITE_PATCHES)
+    parser.add_argument("--out", default=None, help="write the suite results to this JSON file")
+    parser.add_argument("--baseline", default=None, help="suite results to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+    if args.suite:
+        rows = bench_suite(args.suite_distances, args.suite_rounds, args.suite_patches,
+                           p=args.p, initial=args.initial, repeats=args.repeats)
+        print_suite(rows)
+        if args.out:
+            with open(args.out, "w") as f:
+                json.dump(rows, f, indent=1)
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = find_regressions(rows, json.load(f), args.tolerance)
+            for message in regressions:
+                print(f"REGRESSION {message}")
+            if regressions:
+                sys.exit(1)
+        sys.exit(0)
+    baseline = baseline_generator(args.baseline_commit)
+    if baseline is None:
+        print(f"surface_code.py of {args.baseline_commit} is not available; timing the builder only")
+    print_rows(bench_generation(args.distances, p=args.p, initial=args.initial, repeats=args.repeats,
+                                baseline=baseline))
+    print(f"layout cache: {patch_layout.cache_info()}")
+    ps = [args.p * k for k in (1, 2, 3, 5, 8)]
+    for row in bench_sweep(args.distances, ps, initial=args.initial, repeats=args.repeats):
+        print(f"d={row['d']}: p-sweep per point, rebuild {row['rebuild_s']*1e3:.2f} ms, "
+              f"template {row['template_s']*1e3:.2f} ms (compiled once in {row['compile_s']*1e3:.2f} ms)")
+    for d in args.distances:
+        one, many = bench_register(d, args.patches, args.repeats)
+        print(f"d={d}: one patch {one*1e3:.2f} ms, {args.patches}-patch register {many*1e3:.2f} ms")
@@ -0,0 +1,185 @@
+# ============================
+# Batched BP+OSD decoding of circuit DEMs
+#
+# Connects the bposd decoder used in Toric_Code_Practice to the circuits of
+#  surface_code.py and transversal_cnot.py. The detector error model is
+#  turned once into a sparse check matrix H (detectors x error mechanisms),
+#  an observable matrix L (observables x error mechanisms) and the prior
+#  probability of every mechanism. BP+OSD works on H directly, so the
+#  hyperedges a transversal CNOT creates need no graphlike decomposition.
+#
+# BP+OSD decodes one syndrome at a time, so a batch is deduplicated (many
+#  shots share a syndrome, most often the empty one) and the distinct
+#  syndromes are split over a pool of worker processes, each of which builds
+#  its decoder once from the matrices.
+#
+#   decoder = BpOsdDecoder.from_circuit(transversal_cnot_circuit(5, 10, 5, 0.001), workers=8)
+#   evaluate(circuit, 10**5, decoder=decoder)
+#
+# Run from the CODE directory for shots/s next to pymatching:
+#   python -m Surface_Code_Google.bposd_decoding --distance 5 --shots 20000
+
+import argparse
+import concurrent.futures
+import os
+import time
+
+import numpy as np
+import scipy.sparse
+
+from .correlated_decoding import CorrelatedMatcher, correlated_dem
+from .evaluation import count_failures
+from .transversal_cnot import transversal_cnot_circuit
+
+
+def dem_matrices(dem):
+    # Returns (check_matrix, observable_matrix, priors) for `dem`. Mechanisms
+    #  with the same detectors and observables are merged into one column
+    #  with the combined probability. Suggested decompositions are ignored.
+    columns = {}
+    for instruction in dem.flattened():
+        if instruction.type != "error":
+            continue
+        p = instruction.args_copy()[0]
+        detectors, observables = set(), set()
+        for target in instruction.targets_copy():
+            if target.is_relative_detector_id():
+                detectors ^= {target.val}
+            elif target.is_logical_observable_id():
+                observables ^= {target.val}
+        key = (tuple(sorted(detectors)), tuple(sorted(observables)))
+        if not key[0]:
+            continue # undetectable, nothing to decode
+        q = columns.get(key, 0.0)
+        columns[key] = p*(1-q) + q*(1-p)
+
+    def sparse(rows_per_column, num_rows):
+        rows = [r for rows in rows_per_column for r in rows]
+        cols = [j for j, rows in enumerate(rows_per_column) for _ in rows]
+        return scipy.sparse.csc_matrix((np.ones(len(rows), dtype=np.uint8), (rows, cols)),
+                                       shape=(num_rows, len(rows_per_column)))
+
+    keys = list(columns)
+    check_matrix = sparse([k[0] for k in keys], dem.num_detectors)
+    observable_matrix = sparse([k[1] for k in keys], dem.num_observables)
+    priors = np.array([columns[k] for k in keys])
+    return check_matrix, observable_matrix, priors
+
+# ======================================================
+# worker
+
+# The BP+OSD decoder of this worker process, built by init_worker.
+worker_decoder = None
+
+def make_bposd(check_matrix, priors, options):
+    from bposd import bposd_decoder # optional dependency, as in Toric_Code_Practice
+    return bposd_decoder(check_matrix, channel_probs=priors, **options)
+
+def init_worker(check_matrix, priors, options):
+    global worker_decoder
+    worker_decoder = make_bposd(check_matrix, priors, options)
+
+def decode_syndromes(syndromes, decoder=None):
+    # Decodes a (n, num_detectors) uint8 array, one row at a time; returns the
+    #  estimated error mechanisms, shape (n, num_mechanisms).
+    decoder = worker_decoder if decoder is None else decoder
+    return np.array([decoder.decode(s) for s in syndromes], dtype=np.uint8).reshape(len(syndromes), -1)
+
+
+class BpOsdDecoder:
+    # BP+OSD with the decode_batch interface of pymatching.Matching.
+
+    def __init__(self, dem, workers=1, max_iter=None, bp_method="ms", ms_scaling_factor=0,
+                 osd_method="osd_cs", osd_order=7):
+        # `dem` is a stim.DetectorErrorModel, or directly the
+        #  (check_matrix, observable_matrix, priors) triple of dem_matrices.
+        matrices = dem if isinstance(dem, tuple) else dem_matrices(dem)
+        self.check_matrix, self.observable_matrix, self.priors = matrices
+        self.num_detectors = self.check_matrix.shape[0]
+        self.num_observables = self.observable_matrix.shape[0]
+        self.options = {"max_iter": max_iter or self.num_detectors, "bp_method": bp_method,
+                        "ms_scaling_factor": ms_scaling_factor, "osd_method": osd_method,
+                        "osd_order": osd_order}
+        self.workers = workers
+        self.pool = None
+        self.local = None
+
+    @classmethod
+    def from_circuit(cls, circuit, **kwargs):
+        return cls(circuit.detector_error_model(decompose_errors=False), **kwargs)
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def decode_errors(self, syndromes):
+        # Estimated error mechanisms for distinct, non-empty syndromes.
+        if self.workers <= 1 or len(syndromes) < 2*self.workers:
+            if self.local is None:
+                self.local = make_bposd(self.check_matrix, self.priors, self.options)
+            return decode_syndromes(syndromes, self.local)
+        if self.pool is None:
+            self.pool = concurrent.futures.ProcessPoolExecutor(
+                self.workers, initializer=init_worker,
+                initargs=(self.check_matrix, self.priors, self.options))
+        chunks = np.array_split(syndromes, 4*self.workers)
+        return np.concatenate(list(self.pool.map(decode_syndromes, chunks)))
+
+    def decode_batch(self, shots, bit_packed_shots=False, bit_packed_predictions=False):
+        if bit_packed_shots:
+            shots = np.unpackbits(shots, axis=1, count=self.num_detectors, bitorder="little")
+        shots = np.asarray(shots, dtype=np.uint8)
+        predictions = np.zeros((len(shots), self.num_observables), dtype=np.uint8)
+        syndromes, inverse = np.unique(shots, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        nonzero = syndromes.any(axis=1)
+        if nonzero.any():
+            errors = self.decode_errors(syndromes[nonzero])
+            flips = np.zeros((len(syndromes), self.num_observables), dtype=np.uint8)
+            flips[nonzero] = (self.observable_matrix @ errors.T).T % 2
+            predictions = flips[inverse]
+        if bit_packed_predictions:
+            return np.packbits(predictions, axis=1, bitorder="little")
+        return predictions
+
+# ======================================================
+# throughput
+
+def compare_decoders(circuit, shots, workers=None, seed=None):
+    # Shots/s and failures of pymatching (one and two passes, on the
+    #  decomposed DEM) and BP+OSD (on the undecomposed DEM), all on the same
+    #  samples.
+    dem = correlated_dem(circuit)
+    detection_events, observable_flips = circuit.compile_detector_sampler(seed=seed).sample(
+        shots, separate_observables=True, bit_packed=True)
+    rows = []
+    with BpOsdDecoder.from_circuit(circuit, workers=workers or os.cpu_count()) as bposd:
+        for name, decoder in (("pymatching", CorrelatedMatcher(dem, correlated=False)),
+                              ("correlated", CorrelatedMatcher(dem)), ("bposd", bposd)):
+            start = time.perf_counter()
+            predictions = decoder.decode_batch(detection_events, bit_packed_shots=True,
+                                               bit_packed_predictions=True)
+            elapsed = time.perf_counter() - start
+            counts = count_failures(predictions, observable_flips, circuit.num_observables)
+            rows.append({"decoder": name, "shots_per_s": shots/elapsed, "errors": counts.any_errors})
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="BP+OSD versus pymatching throughput on a transversal CNOT.")
+    parser.add_argument("--distance", type=int, default=5)
+    parser.add_argument("--p", type=float, default=0.001)
+    parser.add_argument("--shots", type=int, default=20_000)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    d = args.distance
+    circuit = transversal_cnot_circuit(d, 2*d, d, args.p)
+    for row in compare_decoders(circuit, args.shots, args.workers):
+        print(f"{row['decoder']:>11}: {row['shots_per_s']:>10.0f} shots/s, {row['errors']} errors")
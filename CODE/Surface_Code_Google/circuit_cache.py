@@ -0,0 +1,189 @@
+# ============================
+# Content-addressed on-disk cache for circuits, DEMs and matchers
+#
+# Every entry is keyed on a hash of the generator parameters (generator name,
+#  distance, idx, rounds, p, initial, noise model, ...) together with a hash
+#  of the generator source, so editing surface_code.py invalidates old
+#  entries instead of serving stale circuits. An entry is a directory holding
+#  the circuit (circuit.stim), its decomposed detector error model
+#  (model.dem) and the parameters (params.json).
+#
+# The noise model is "uniform" (every channel at p, the generators' own
+#  circuits) or a dict of channel name -> probability, e.g.
+#  {"DEPOLARIZE2": 2*p, "X_ERROR": p/2}; channels it leaves out stay at p. A
+#  dict is applied through the generator's NoiseTemplate.
+#
+# pymatching.Matching objects cannot be pickled, so the matcher is stored as
+#  the DEM file and rebuilt from it in C++ with
+#  Matching.from_detector_error_model_file. Matchers are also kept in memory,
+#  so repeated calls in one notebook session or sinter worker reuse them.
+#
+# The directory is bounded by `max_bytes`; the least recently used entries
+#  (by modification time, refreshed on every hit) are evicted first.
+#
+#   cache = CircuitCache()
+#   circuit = cache.circuit(d, 0, 3*d, p, "0")
+#   sinter.Task(circuit=circuit, detector_error_model=cache.dem(d, 0, 3*d, p, "0"))
+#   cache.matcher(d, 2*d, d, p, generator="transversal_cnot")
+#   cache.dem(d, 0, 3*d, p, "0", noise={"M": 5*p})
+
+import collections
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import tempfile
+
+import pymatching
+import stim
+
+from . import compose, lattice, noise_template, surface_code, transversal_cnot
+
+DEFAULT_DIRECTORY = os.environ.get(
+    "CORRELATED_DECODING_CACHE", os.path.join(os.path.expanduser("~"), ".cache", "correlated-decoding"))
+
+# Hash of the generator sources: part of every key.
+GENERATOR_VERSION = hashlib.sha256(b"".join(
+    open(module.__file__, "rb").read()
+    for module in (surface_code, lattice, transversal_cnot, noise_template, compose)
+)).hexdigest()[:16]
+
+GENERATORS = {
+    "memory": surface_code.surface_code_circuit,
+    "transversal_cnot": transversal_cnot.transversal_cnot_circuit,
+}
+
+# Noise-parametric templates of the generators, taking every argument but p.
+TEMPLATES = {
+    "memory": noise_template.memory_template,
+    "transversal_cnot": noise_template.transversal_cnot_template,
+}
+
+
+def cache_key(generator, params, noise="uniform"):
+    # Hash of the generator name, its parameters and the noise model.
+    text = json.dumps({"generator": generator, "params": params, "noise": noise,
+                       "version": GENERATOR_VERSION}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+def generate(generator, params, noise="uniform"):
+    # Builds the circuit of `generator` for `params` under the noise model.
+    if noise == "uniform":
+        return GENERATORS[generator](**params)
+    if not isinstance(noise, dict):
+        raise ValueError(f"noise must be \"uniform\" or a dict of channel probabilities, got {noise!r}")
+    layout = {name: tuple(value) if isinstance(value, list) else value
+              for name, value in params.items() if name != "p"}
+    template = TEMPLATES[generator](**layout)
+    unknown = set(noise) - set(template.channel_names)
+    if unknown:
+        raise ValueError(f"the {generator} circuit has no noise channels {sorted(unknown)}")
+    return template.circuit(noise, default=params["p"])
+
+
+class CircuitCache:
+
+    def __init__(self, directory=DEFAULT_DIRECTORY, max_bytes=2*2**30, max_matchers=16):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_matchers = max_matchers
+        self.matchers = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(directory, exist_ok=True)
+
+    # ---- entries
+
+    def entry(self, *args, generator="memory", noise="uniform", **params):
+        # Returns the directory of the entry for these generator arguments,
+        #  building the circuit and DEM on a miss. Arguments are bound to the
+        #  generator's signature first, so positional and keyword calls share
+        #  one key.
+        bound = inspect.signature(GENERATORS[generator]).bind(*args, **params)
+        bound.apply_defaults()
+        params = dict(bound.arguments)
+        key = cache_key(generator, params, noise)
+        path = os.path.join(self.directory, key)
+        if os.path.isdir(path):
+            self.hits += 1
+            os.utime(path)
+            return path
+
+        self.misses += 1
+        circuit = generate(generator, params, noise)
+        # the transversal CNOT creates a few hyperedges that have no graphlike
+        #  decomposition; they are kept undecomposed (pymatching skips them)
+        dem = circuit.detector_error_model(decompose_errors=True, ignore_decomposition_failures=True)
+        # write into a temporary directory and rename, so concurrent sinter
+        #  workers never see a half-written entry
+        staging = tempfile.mkdtemp(dir=self.directory, prefix=".staging-")
+        circuit.to_file(os.path.join(staging, "circuit.stim"))
+        dem.to_file(os.path.join(staging, "model.dem"))
+        with open(os.path.join(staging, "params.json"), "w") as f:
+            json.dump({"generator": generator, "noise": noise, "params": params}, f, sort_keys=True)
+        try:
+            os.rename(staging, path)
+        except OSError: # another process stored it first
+            shutil.rmtree(staging, ignore_errors=True)
+        self.evict()
+        return path
+
+    def circuit(self, *args, generator="memory", noise="uniform", **params):
+        # The cached stim.Circuit, e.g. cache.circuit(distance, idx, rounds, p, initial).
+        path = self.entry(*args, generator=generator, noise=noise, **params)
+        return stim.Circuit.from_file(os.path.join(path, "circuit.stim"))
+
+    def dem(self, *args, generator="memory", noise="uniform", **params):
+        # The cached detector error model, decomposed for matching.
+        path = self.entry(*args, generator=generator, noise=noise, **params)
+        return stim.DetectorErrorModel.from_file(os.path.join(path, "model.dem"))
+
+    def matcher(self, *args, generator="memory", noise="uniform", **params):
+        # A pymatching.Matching for the cached DEM, memoized in this process.
+        path = self.entry(*args, generator=generator, noise=noise, **params)
+        key = os.path.basename(path)
+        if key in self.matchers:
+            self.matchers.move_to_end(key)
+            return self.matchers[key]
+        matching = pymatching.Matching.from_detector_error_model_file(os.path.join(path, "model.dem"))
+        self.matchers[key] = matching
+        while len(self.matchers) > self.max_matchers:
+            self.matchers.popitem(last=False)
+        return matching
+
+    # ---- size limit
+
+    def entries(self):
+        # (modification time, size in bytes, path) of every stored entry.
+        result = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(entry.stat().st_size for entry in os.scandir(path))
+            result.append((os.stat(path).st_mtime, size, path))
+        return result
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        # Removes least recently used entries until the cache fits max_bytes.
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            self.matchers.pop(os.path.basename(path), None)
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
+        self.matchers.clear()
+
+    def info(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries()),
+                "bytes": self.size(), "max_bytes": self.max_bytes}
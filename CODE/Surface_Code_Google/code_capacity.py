@@ -0,0 +1,212 @@
+# ============================
+# Code-capacity and phenomenological Monte Carlo for CSS codes
+#
+# Logical error rates of any code with hx, hz, lx, lz check and logical
+#  matrices (bposd css_code/hgp instances, or hypergraph_product.py codes)
+#  under i.i.d. X (or Z) errors of probability p:
+#
+#   - code capacity (rounds=1): one perfect syndrome measurement;
+#   - phenomenological (rounds=R > 1): data errors before each of R rounds,
+#     each syndrome bit of the first R-1 rounds read wrong with probability
+#     q, and a perfect last round.
+#
+# Both are decoded on one space-time check matrix (detectors of round t are
+#  rows t*m..t*m+m-1; data-error columns come first, then measurement-error
+#  columns), whose fault matrix maps every column to the logicals it flips,
+#  so pymatching and BP+OSD both predict logical flips directly.
+#
+# Everything per shot is bit-packed along the shots axis: an error pattern is
+#  a (rows, shots/8) uint8 array drawn by skipping geometric gaps (cost ~ p,
+#  not 1, per qubit-shot), and H @ e mod 2 is one XOR-reduceat over the CSR
+#  structure of H for all shots at once. The detection events of round t are
+#  H e_t + m_t + m_(t-1), and the logical flips L (e_0 + ... + e_(R-1)).
+#
+# (L, p) points are spread over a process pool; every worker builds its code
+#  and decoder once per point.
+#
+# Run from the CODE directory:
+#   python -m Surface_Code_Google.code_capacity --family toric --sizes 8 12 16 --ps 0.06 0.08 0.1 0.12
+#   python -m Surface_Code_Google.code_capacity --sizes 8 12 --ps 0.02 0.03 --rounds-per-size 1
+
+import argparse
+import concurrent.futures
+import os
+
+import numpy as np
+import pymatching
+import scipy.sparse
+
+from .bposd_decoding import BpOsdDecoder
+from .evaluation import FailureCounts, count_failures
+from .hypergraph_product import planar_code, toric_code
+
+CODE_FAMILIES = {"toric": toric_code, "planar": planar_code}
+
+# Elements (detector or qubit bits) per batch, bounding the unpacked arrays.
+BATCH_ELEMENTS = 2**25
+
+
+def bernoulli_packed(rng, rows, shots, p):
+    # (rows, ceil(shots/8)) uint8, every bit set with probability p. Bits past
+    #  `shots` in the last byte are also random and must be ignored.
+    width = (shots + 7) // 8
+    total = rows * width * 8
+    packed = np.zeros(rows * width, dtype=np.uint8)
+    if p <= 0 or total == 0:
+        return packed.reshape(rows, width)
+    positions = []
+    end = -1
+    while end < total:
+        expected = (total - end) * p
+        gaps = rng.geometric(p, size=int(expected + 5*np.sqrt(expected) + 16))
+        chunk = end + np.cumsum(gaps)
+        positions.append(chunk)
+        end = chunk[-1]
+    positions = np.concatenate(positions)
+    positions = positions[positions < total]
+    byte = positions >> 3
+    bits = (np.uint8(1) << (positions & 7).astype(np.uint8)).astype(np.uint8)
+    starts = np.flatnonzero(np.r_[True, byte[1:] != byte[:-1]]) if len(byte) else np.array([], dtype=np.int64)
+    if len(starts):
+        packed[byte[starts]] = np.bitwise_or.reduceat(bits, starts)
+    return packed.reshape(rows, width)
+
+def packed_product(matrix, packed):
+    # matrix @ packed mod 2 for a sparse 0/1 matrix and bit-packed (columns,
+    #  shots/8) rows: each output row is the XOR of the rows it selects.
+    matrix = scipy.sparse.csr_matrix(matrix)
+    out = np.zeros((matrix.shape[0], packed.shape[1]), dtype=np.uint8)
+    nonempty = np.flatnonzero(np.diff(matrix.indptr))
+    if len(nonempty):
+        out[nonempty] = np.bitwise_xor.reduceat(packed[matrix.indices], matrix.indptr[nonempty], axis=0)
+    return out
+
+def unpack_shots(packed, shots):
+    # (rows, shots/8) packed along shots -> (shots, rows) uint8.
+    return np.unpackbits(packed, axis=1, count=shots, bitorder="little").T
+
+
+class NoiseModel:
+    # The space-time decoding problem of one code, error type and (p, q, rounds).
+
+    def __init__(self, code, p, rounds=1, q=None, error_type="X"):
+        # X errors are seen by the Z checks and flip the Z logicals' outcomes.
+        self.checks = scipy.sparse.csr_matrix(code.hz if error_type == "X" else code.hx, dtype=np.uint8)
+        self.logicals = scipy.sparse.csr_matrix(code.lz if error_type == "X" else code.lx, dtype=np.uint8)
+        self.p = p
+        self.q = p if q is None else q
+        self.rounds = rounds
+        self.num_checks, self.num_qubits = self.checks.shape
+        self.num_logicals = self.logicals.shape[0]
+        self.num_detectors = self.num_checks * rounds
+
+        # space-time check matrix, priors and logical fault matrix
+        data = scipy.sparse.kron(scipy.sparse.identity(rounds, dtype=np.uint8), self.checks)
+        steps = scipy.sparse.diags([np.ones(rounds - 1), np.ones(rounds - 1)], [0, -1],
+                                   shape=(rounds, rounds - 1), dtype=np.uint8)
+        measurement = scipy.sparse.kron(steps, scipy.sparse.identity(self.num_checks, dtype=np.uint8))
+        self.check_matrix = scipy.sparse.csc_matrix(scipy.sparse.hstack([data, measurement]), dtype=np.uint8)
+        self.priors = np.r_[np.full(data.shape[1], self.p), np.full(measurement.shape[1], self.q)]
+        fault_data = scipy.sparse.kron(np.ones((1, rounds), dtype=np.uint8), self.logicals)
+        self.faults_matrix = scipy.sparse.csc_matrix(scipy.sparse.hstack(
+            [fault_data, scipy.sparse.csr_matrix((self.num_logicals, measurement.shape[1]), dtype=np.uint8)]),
+            dtype=np.uint8)
+
+    def batch_size(self, limit):
+        # Shots per batch keeping the unpacked arrays under BATCH_ELEMENTS.
+        per_shot = self.num_detectors + self.num_qubits
+        return int(max(8, min(limit, BATCH_ELEMENTS // per_shot)))
+
+    def sample(self, shots, rng):
+        # (detection_events, logical_flips) as (shots, num_detectors) and
+        #  (shots, num_logicals) uint8 arrays.
+        detection = []
+        total = None
+        previous = None
+        for t in range(self.rounds):
+            errors = bernoulli_packed(rng, self.num_qubits, shots, self.p)
+            total = errors if total is None else total ^ errors
+            syndrome = packed_product(self.checks, errors)
+            flips = (bernoulli_packed(rng, self.num_checks, shots, self.q) if t < self.rounds - 1
+                     else np.zeros_like(syndrome))
+            syndrome ^= flips
+            if previous is not None:
+                syndrome ^= previous
+            previous = flips
+            detection.append(syndrome)
+        return (unpack_shots(np.concatenate(detection), shots),
+                unpack_shots(packed_product(self.logicals, total), shots))
+
+    def decoder(self, name="matching", **kwargs):
+        if name == "matching":
+            return pymatching.Matching.from_check_matrix(self.check_matrix, error_probabilities=self.priors,
+                                                         faults_matrix=self.faults_matrix)
+        if name == "bposd":
+            return BpOsdDecoder((self.check_matrix, self.faults_matrix, self.priors), **kwargs)
+        raise ValueError(f"unknown decoder {name!r}")
+
+
+def simulate(model, shots, decoder=None, batch_size=100_000, max_errors=None, seed=None):
+    # FailureCounts of `shots` shots of a NoiseModel, stopping early once
+    #  `max_errors` shots failed.
+    rng = np.random.default_rng(seed)
+    decoder = decoder if decoder is not None else model.decoder()
+    batch = model.batch_size(batch_size)
+    counts = FailureCounts(0, np.zeros(model.num_logicals, dtype=np.int64), 0)
+    while counts.shots < shots and (max_errors is None or counts.any_errors < max_errors):
+        n = min(batch, shots - counts.shots)
+        detection_events, logical_flips = model.sample(n, rng)
+        predictions = decoder.decode_batch(detection_events)
+        counts = counts + count_failures(predictions, logical_flips, model.num_logicals, bit_packed=False)
+    return counts
+
+# ======================================================
+# process pool over (L, p) points
+
+# Per-process models and decoders, by point.
+worker_state = {}
+
+def point_model(point):
+    key = tuple(sorted(point.items()))
+    if key not in worker_state:
+        code = CODE_FAMILIES[point["family"]](point["size"])
+        model = NoiseModel(code, point["p"], point["rounds"], point.get("q"), point["error_type"])
+        worker_state[key] = (model, model.decoder(point["decoder"]))
+    return worker_state[key]
+
+def run_point(point, shots, max_errors, seed):
+    model, decoder = point_model(point)
+    return simulate(model, shots, decoder, max_errors=max_errors, seed=seed)
+
+def capacity_grid(family, sizes, ps, rounds_per_size=0, q=None, error_type="X", decoder="matching"):
+    # Points as dicts; rounds_per_size=0 gives code capacity (one round),
+    #  otherwise rounds_per_size*L noisy rounds plus the perfect one.
+    return [{"family": family, "size": L, "p": p, "q": q, "error_type": error_type, "decoder": decoder,
+             "rounds": rounds_per_size*L + 1 if rounds_per_size else 1}
+            for L in sizes for p in ps]
+
+def run_grid(points, shots, max_errors=None, workers=None, seed=0):
+    # FailureCounts per point, in order. Each point gets its own seed.
+    with concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        futures = [pool.submit(run_point, point, shots, max_errors, [seed, k]) for k, point in enumerate(points)]
+        return [future.result() for future in futures]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Code-capacity / phenomenological logical error rates.")
+    parser.add_argument("--family", default="toric", choices=sorted(CODE_FAMILIES))
+    parser.add_argument("--sizes", type=int, nargs="+", default=[8, 12, 16])
+    parser.add_argument("--ps", type=float, nargs="+", default=[0.06, 0.08, 0.1, 0.12])
+    parser.add_argument("--rounds-per-size", type=int, default=0,
+                        help="0 for code capacity, else rounds_per_size*L noisy rounds")
+    parser.add_argument("--q", type=float, default=None, help="measurement error rate (default: p)")
+    parser.add_argument("--decoder", default="matching", choices=["matching", "bposd"])
+    parser.add_argument("--shots", type=int, default=100_000)
+    parser.add_argument("--max-errors", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    points = capacity_grid(args.family, args.sizes, args.ps, args.rounds_per_size, args.q, decoder=args.decoder)
+    print(f"{'L':>4} {'rounds':>7} {'p':>8} {'shots':>9} {'errors':>8} {'rate':>10}")
+    for point, counts in zip(points, run_grid(points, args.shots, args.max_errors, args.workers)):
+        print(f"{point['size']:>4} {point['rounds']:>7} {point['p']:>8g} {counts.shots:>9} "
+              f"{counts.any_errors:>8} {counts.any_rate:>10.3e}")
@@ -0,0 +1,239 @@
+# ============================
+# Qubit relabelling and tiling of stim circuits
+#
+# Replacement for the notebook's shift_circuit. Circuits are processed as
+#  their program text, one instruction line at a time, so REPEAT blocks are
+#  kept (and recursed into) instead of being flattened or mangled. The qubit
+#  targets of a line are shifted as one NumPy array, QUBIT_COORDS and
+#  DETECTOR coordinates are shifted by a coordinate vector, and rec targets
+#  are rewritten whenever tiling changes the measurement record.
+#
+#   relabel(circuit, offset=17)                   # the old shift_circuit
+#   relabel(circuit, qubit_map=perm)              # arbitrary relabelling
+#   tile(circuit, 50, coord_shifts=[(6*k, 0) for k in range(50)])
+#
+# `tile` runs K copies in parallel: every instruction acts on all copies at
+#  once (copy 0's targets, then copy 1's, ...), detectors are repeated per
+#  copy and observable k of copy c becomes observable c*num_observables+k.
+
+import re
+
+import numpy as np
+import stim
+
+QUBIT_TOKEN = re.compile(r"(!?[XYZ]?)(\d+)")
+LINE = re.compile(r"^(?P<name>[A-Z_0-9]+)(?:\[(?P<tag>[^\]]*)\])?(?:\((?P<args>[^)]*)\))?\s*(?P<targets>.*)$")
+REC = re.compile(r"rec\[-(\d+)\]")
+
+COORDINATE_INSTRUCTIONS = ("QUBIT_COORDS", "DETECTOR")
+RECORD_INSTRUCTIONS = ("DETECTOR", "OBSERVABLE_INCLUDE")
+LITERAL_TARGETS = ("MPAD", "SHIFT_COORDS", "TICK")
+
+
+def parse_program(text):
+    # Splits stim program text into a nested list of items: a
+    #  (name, args, tag, targets) tuple per instruction and a
+    #  ("REPEAT", count, body_items) tuple per repeat block.
+    lines = iter(line.strip() for line in text.splitlines())
+    def block():
+        items = []
+        for line in lines:
+            if not line or line.startswith("#"):
+                continue
+            if line == "}":
+                return items
+            if line.startswith("REPEAT"):
+                count = int(line.split()[-2] if line.endswith("{") else line.split()[1])
+                items.append(("REPEAT", count, block()))
+                continue
+            match = LINE.match(line)
+            items.append((match["name"], match["args"], match["tag"], match["targets"].split()))
+        return items
+    return block()
+
+def format_instruction(name, args, tag, targets):
+    head = name
+    if tag is not None:
+        head += f"[{tag}]"
+    if args is not None:
+        head += f"({args})"
+    return f"{head} {' '.join(targets)}".rstrip()
+
+def shift_qubits(targets, qubit_map, offset):
+    # Returns the targets with every qubit index relabelled. Plain integer
+    #  targets (the common case) are shifted as one array; Pauli products
+    #  (X1*Z2), inverted results (!3) and rec/sweep targets are rewritten one
+    #  token at a time.
+    if all(t.isdigit() for t in targets):
+        qubits = np.array(targets, dtype=np.int64)
+        qubits = qubit_map[qubits] if qubit_map is not None else qubits + offset
+        return qubits.astype(str).tolist()
+    def one(part):
+        prefix, q = QUBIT_TOKEN.fullmatch(part).groups()
+        q = int(q)
+        return prefix + str(int(qubit_map[q]) if qubit_map is not None else q + offset)
+    return [t if t.startswith(("rec[", "sweep[")) else "*".join(one(part) for part in t.split("*"))
+            for t in targets]
+
+def shift_coords(args, coord_shift):
+    if args is None or not len(coord_shift):
+        return args
+    values = np.array([float(a) for a in args.split(",")])
+    n = min(len(values), len(coord_shift))
+    values[:n] += coord_shift[:n]
+    return ", ".join(str(int(v)) if v == int(v) else str(v) for v in values)
+
+def measurement_count(name, targets):
+    # Number of measurement results an instruction line adds to the record.
+    if name == "REPEAT" or not stim.gate_data(name).produces_measurements:
+        return 0
+    if name == "MPP":
+        return len(targets)
+    if stim.gate_data(name).is_two_qubit_gate:
+        return len(targets) // 2
+    return len(targets)
+
+# ======================================================
+# relabel
+
+def relabel_items(items, qubit_map, offset, coord_shift):
+    out = []
+    for item in items:
+        if item[0] == "REPEAT":
+            _, count, body = item
+            out.append(f"REPEAT {count} {{")
+            out.extend(relabel_items(body, qubit_map, offset, coord_shift))
+            out.append("}")
+            continue
+        name, args, tag, targets = item
+        if name in COORDINATE_INSTRUCTIONS:
+            args = shift_coords(args, coord_shift)
+        if name not in LITERAL_TARGETS and name not in RECORD_INSTRUCTIONS:
+            targets = shift_qubits(targets, qubit_map, offset)
+        out.append(format_instruction(name, args, tag, targets))
+    return out
+
+def relabel(circuit, offset=0, qubit_map=None, coord_shift=()):
+    # Returns a copy of `circuit` with qubit q renamed to q+offset (or to
+    #  qubit_map[q]), QUBIT_COORDS and DETECTOR coordinates shifted by
+    #  `coord_shift`, and every REPEAT block kept.
+    if qubit_map is not None:
+        qubit_map = np.asarray(qubit_map, dtype=np.int64)
+    coord_shift = np.asarray(coord_shift, dtype=float)
+    lines = relabel_items(parse_program(str(circuit)), qubit_map, offset, coord_shift)
+    return stim.Circuit("\n".join(lines))
+
+def shift_circuit(circuit, offset, coord_shift=()):
+    # Drop-in replacement for the Correlated Decoding notebook's helper.
+    return relabel(circuit, offset=offset, coord_shift=coord_shift)
+
+# ======================================================
+# tile
+
+class RecordHistory:
+    # Sizes of the most recent measurement instructions, newest last. Enough
+    #  history is kept to resolve the deepest rec target of the circuit.
+
+    def __init__(self, depth, sizes=()):
+        self.depth = depth
+        self.sizes = list(sizes)
+
+    def copy(self):
+        return RecordHistory(self.depth, self.sizes)
+
+    def extend(self, sizes):
+        self.sizes.extend(s for s in sizes if s)
+        if not self.sizes:
+            return
+        total, keep = 0, 0
+        for s in reversed(self.sizes):
+            keep += 1
+            total += s
+            if total >= self.depth:
+                break
+        del self.sizes[:len(self.sizes)-keep]
+
+    def tiled_offset(self, lookback, copy, copies):
+        # Maps rec[-lookback] of copy `copy` to its lookback in the tiled
+        #  record, where each measurement instruction of size m became one of
+        #  size copies*m laid out copy by copy.
+        after = 0
+        for m in reversed(self.sizes):
+            if lookback <= after + m:
+                q = m - (lookback - after) # position inside the instruction
+                return copies*after + copies*m - (copy*m + q)
+            after += m
+        raise ValueError(f"rec[-{lookback}] reaches before the start of the circuit")
+
+def tile_items(items, copies, stride, coord_shifts, num_observables, history):
+    # Returns the tiled lines of `items` and the (untiled) measurement sizes
+    #  they added to `history`.
+    out = []
+    added = []
+    def record(sizes):
+        history.extend(sizes)
+        added.extend(sizes)
+
+    for item in items:
+        if item[0] == "REPEAT":
+            _, count, body = item
+            entry = history.copy()
+            lines, sizes = tile_items(body, copies, stride, coord_shifts, num_observables, history)
+            added.extend(sizes)
+            if count > 1:
+                # every iteration must see the same tiled rec offsets as the first
+                steady = entry.copy()
+                steady.extend(sizes)
+                again, _ = tile_items(body, copies, stride, coord_shifts, num_observables, steady)
+                if again != lines:
+                    raise ValueError("REPEAT block reads measurements whose layout differs between "
+                                     "iterations; flatten the circuit before tiling it")
+                # later iterations only matter as far back as the deepest rec target
+                per_iteration = max(sum(sizes), 1)
+                for _ in range(min(count - 1, history.depth // per_iteration + 1)):
+                    record(sizes)
+            out.append(f"REPEAT {count} {{")
+            out.extend(lines)
+            out.append("}")
+            continue
+
+        name, args, tag, targets = item
+        if name in RECORD_INSTRUCTIONS:
+            for c in range(copies):
+                if name == "DETECTOR":
+                    new_args = shift_coords(args, coord_shifts[c])
+                else:
+                    new_args = str(int(args) + c*num_observables)
+                new_targets = [REC.sub(lambda m: f"rec[-{history.tiled_offset(int(m.group(1)), c, copies)}]", t)
+                               for t in targets]
+                out.append(format_instruction(name, new_args, tag, new_targets))
+        elif name == "QUBIT_COORDS":
+            for c in range(copies):
+                out.append(format_instruction(name, shift_coords(args, coord_shifts[c]), tag,
+                                              shift_qubits(targets, None, c*stride)))
+        elif name in LITERAL_TARGETS:
+            out.append(format_instruction(name, args, tag, targets*copies if name == "MPAD" else targets))
+            record([measurement_count(name, targets)])
+        else:
+            tiled = []
+            for c in range(copies):
+                # classically controlled gates (CX rec[-1] 1) read copy c's record
+                tiled.extend(REC.sub(lambda m: f"rec[-{history.tiled_offset(int(m.group(1)), c, copies)}]", t)
+                             for t in shift_qubits(targets, None, c*stride))
+            out.append(format_instruction(name, args, tag, tiled))
+            record([measurement_count(name, targets)])
+    return out, added
+
+def tile(circuit, copies, stride=None, coord_shifts=None):
+    # Returns one circuit running `copies` copies of `circuit` in parallel,
+    #  copy c on qubits q + c*stride (stride defaults to circuit.num_qubits)
+    #  with its coordinates shifted by coord_shifts[c]. REPEAT blocks are kept.
+    stride = circuit.num_qubits if stride is None else stride
+    if coord_shifts is None:
+        coord_shifts = np.zeros((copies, 0))
+    coord_shifts = [np.asarray(s, dtype=float) for s in coord_shifts]
+    items = parse_program(str(circuit))
+    depth = max([int(m) for m in REC.findall(str(circuit))] or [0])
+    lines, _ = tile_items(items, copies, stride, coord_shifts, circuit.num_observables,
+                          RecordHistory(depth))
+    return stim.Circuit("\n".join(lines))
@@ -0,0 +1,179 @@
+# ============================
+# Correlated (two-pass) matching for transversal-CNOT circuits
+#
+# A transversal CNOT copies X errors from the control to the target and Z
+#  errors the other way, so one fault near the gate can flip detectors in
+#  both patches. stim cannot decompose some of these faults into graphlike
+#  pieces that also occur on their own (see transversal_cnot.py), and plain
+#  matching then drops them. Here:
+#
+#   1. every undecomposed hyperedge of the joint DEM is split into edges and
+#      boundary edges, preferring edges that already exist in the matching
+#      graph, with observables that agree, and the most likely pieces;
+#   2. matching runs twice per shot: the first pass finds a matching, the
+#      edges that share a fault with a matched edge are reweighted with the
+#      conditional probability of that fault, and the second pass decodes
+#      with the new weights.
+#
+# Step 2 is pymatching's correlated matching (enable_correlations=True),
+#  which reads the joint faults from the decomposed DEM and runs both passes
+#  in C++ over the whole batch.
+#
+#   decoder = CorrelatedMatcher.from_circuit(transversal_cnot_circuit(d, 2*d, d, p))
+#   evaluate(circuit, 10**6, decoder=decoder)
+
+import math
+
+import pymatching
+import stim
+
+
+def error_components(instruction):
+    # Splits the targets of an error instruction at its "^" separators into
+    #  (detectors, observables) pairs of sorted tuples.
+    components = []
+    detectors, observables = [], []
+    for target in instruction.targets_copy():
+        if target.is_separator():
+            components.append((tuple(sorted(detectors)), tuple(sorted(observables))))
+            detectors, observables = [], []
+        elif target.is_relative_detector_id():
+            detectors.append(target.val)
+        else:
+            observables.append(target.val)
+    components.append((tuple(sorted(detectors)), tuple(sorted(observables))))
+    return components
+
+def graphlike_edges(dem):
+    # Observables and total probability of every graphlike component in the
+    #  flattened DEM, by detector tuple. As in pymatching, the observables of
+    #  the first occurrence win.
+    edges = {}
+    for instruction in dem.flattened():
+        if instruction.type != "error":
+            continue
+        p = instruction.args_copy()[0]
+        for detectors, observables in error_components(instruction):
+            if not 1 <= len(detectors) <= 2:
+                continue
+            merged = p
+            if detectors in edges:
+                observables, q = edges[detectors]
+                merged = p*(1-q) + q*(1-p)
+            edges[detectors] = (observables, merged)
+    return edges
+
+def pairings(detectors):
+    # Every way of splitting `detectors` into pairs and singletons.
+    if not detectors:
+        yield []
+        return
+    first, rest = detectors[0], detectors[1:]
+    for split in pairings(rest):
+        yield [(first,)] + split
+    for i, other in enumerate(rest):
+        for split in pairings(rest[:i] + rest[i+1:]):
+            yield [(first, other)] + split
+
+def decompose_hyperedge(detectors, observables, edges):
+    # Splits a hyperedge into graph edges, as (detectors, observables) pieces
+    #  whose observables add up to `observables`. Splits made only of
+    #  existing edges with matching observables are preferred; otherwise the
+    #  split with the fewest new edges is used, and the new edges carry the
+    #  remaining observables. Among equals the most likely split wins. If
+    #  only existing edges are available and none of their splits matches,
+    #  the best split is used with the leftover observables put on its
+    #  first piece.
+    best, best_score = None, None
+    for split in pairings(list(detectors)):
+        missing = [piece for piece in split if piece not in edges]
+        residual = set(observables)
+        for piece in split:
+            if piece in edges:
+                residual ^= set(edges[piece][0])
+        score = (bool(residual and not missing), len(missing), len(split),
+                 -sum(math.log(edges[piece][1]) for piece in split if piece in edges))
+        if best_score is None or score < best_score:
+            pieces = [(piece, edges[piece][0]) if piece in edges else (piece, ()) for piece in split]
+            if residual:
+                i = split.index(missing[0]) if missing else 0
+                pieces[i] = (pieces[i][0], tuple(sorted(set(pieces[i][1]) ^ residual)))
+            best, best_score = pieces, score
+    return best
+
+def fold_undetectable(components):
+    # Merges components without detectors (e.g. the "L0" of "D1 L0 ^ L0")
+    #  into the first component with detectors, which pymatching requires.
+    detectable = [(d, set(o)) for d, o in components if d]
+    if not detectable:
+        return []
+    for detectors, observables in components:
+        if not detectors:
+            detectable[0][1].symmetric_difference_update(observables)
+    return [(d, tuple(sorted(o))) for d, o in detectable]
+
+def error_targets(components):
+    targets = []
+    for detectors, observables in components:
+        if targets:
+            targets.append(stim.target_separator())
+        targets += [stim.target_relative_detector_id(d) for d in detectors]
+        targets += [stim.target_logical_observable_id(o) for o in observables]
+    return targets
+
+def decompose_hyperedges(dem):
+    # Returns a flattened copy of `dem` for correlated matching. Every error
+    #  with more than two detectors and no suggested decomposition is written
+    #  as a "^" separated list of graph edges (see decompose_hyperedge).
+    #  Undetectable errors are dropped, since no decoder can act on them.
+    dem = dem.flattened()
+    edges = graphlike_edges(dem)
+    out = stim.DetectorErrorModel()
+    for instruction in dem:
+        if instruction.type != "error":
+            out.append(instruction)
+            continue
+        components = fold_undetectable(error_components(instruction))
+        if not components:
+            continue
+        if len(components) == 1 and len(components[0][0]) > 2:
+            components = decompose_hyperedge(*components[0], edges)
+        out.append("error", instruction.args_copy(), error_targets(components))
+    return out
+
+def count_hyperedges(dem):
+    # Number of errors that matching cannot use: more than two detectors in
+    #  one component.
+    return sum(1 for instruction in dem.flattened() if instruction.type == "error"
+               and any(len(detectors) > 2 for detectors, _ in error_components(instruction)))
+
+def correlated_dem(circuit):
+    # The joint detector error model of `circuit`, decomposed for correlated
+    #  matching.
+    dem = circuit.detector_error_model(decompose_errors=True, ignore_decomposition_failures=True)
+    return decompose_hyperedges(dem)
+
+
+class CorrelatedMatcher:
+    # Batched two-pass matching with the decode_batch interface of
+    #  pymatching.Matching, so it drops into evaluation.evaluate and the
+    #  streaming pipeline. `correlated=False` gives plain one-pass matching on
+    #  the same graph, for comparison.
+
+    def __init__(self, dem, correlated=True):
+        self.dem = dem
+        self.correlated = correlated
+        self.matching = pymatching.Matching.from_detector_error_model(dem, enable_correlations=correlated)
+
+    @classmethod
+    def from_circuit(cls, circuit, correlated=True):
+        return cls(correlated_dem(circuit), correlated)
+
+    @property
+    def num_detectors(self):
+        return self.matching.num_detectors
+
+    def decode_batch(self, shots, bit_packed_shots=False, bit_packed_predictions=False):
+        return self.matching.decode_batch(shots, bit_packed_shots=bit_packed_shots,
+                                          bit_packed_predictions=bit_packed_predictions,
+                                          enable_correlations=self.correlated)
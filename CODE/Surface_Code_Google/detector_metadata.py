@@ -0,0 +1,87 @@
+# ============================
+# Detector metadata tables
+#
+# The generators give every detector the coordinates (x, y, t, patch): the
+#  position of its stabilizer's measure qubit, the syndrome round (advanced
+#  with SHIFT_COORDS, also inside REPEAT blocks) and the patch. The tables
+#  here carry the same information, plus the stabilizer basis and index, as
+#  a NumPy structured array with one row per detector index. They are
+#  computed from the layouts alone, without walking or flattening a
+#  circuit, so splitting detection events is a single fancy index:
+#
+#   table = memory_detector_table(d, 0, rounds, "0")
+#   events[:, table["round"] == 3]                     # one round
+#   events[:, table["basis"] == "Z"]                   # one stabilizer type
+#   split_detectors(events, table, "round")            # {round: columns}
+
+import numpy as np
+
+from .surface_code import patch_layout
+from .transversal_cnot import BASES, INITIAL_BASIS, CnotLayout
+
+DETECTOR_DTYPE = np.dtype([
+    ("patch", np.int32),
+    ("basis", "U1"), # "X" or "Z"
+    ("stabilizer", np.int32), # index among the patch's stabilizers of that basis
+    ("round", np.int32), # the t coordinate
+    ("x", np.float64),
+    ("y", np.float64),
+    ("data", np.bool_), # compares a stabilizer with the final data measurements
+])
+
+def detector_block(stabilizers, coords, patch, rounds, data=False):
+    # Rows for the same list of (basis, index) stabilizers repeated over
+    #  `rounds` (an array of round numbers), round by round.
+    k = len(stabilizers)
+    block = np.zeros(k*len(rounds), dtype=DETECTOR_DTYPE)
+    block["patch"] = np.tile(np.broadcast_to(patch, (k,)), len(rounds))
+    block["basis"] = np.tile([basis for basis, _ in stabilizers], len(rounds))
+    block["stabilizer"] = np.tile([j for _, j in stabilizers], len(rounds))
+    block["round"] = np.repeat(np.asarray(rounds), k)
+    block["x"] = np.tile([c[0] for c in coords], len(rounds))
+    block["y"] = np.tile([c[1] for c in coords], len(rounds))
+    block["data"] = data
+    return block
+
+def memory_detector_table(distance, idx, rounds, initial):
+    # Detector table of surface_code.surface_code_circuit(distance, idx,
+    #  rounds, p, initial), in detector index order.
+    layout = patch_layout(distance, idx)
+    def coords(stabilizers):
+        return [layout.stabilizer_coords[basis][j] for basis, j in stabilizers]
+    def block(stabilizers, round_numbers, data=False):
+        return detector_block(stabilizers, coords(stabilizers), idx, round_numbers, data)
+
+    final_round = max(rounds - 1, 1)
+    blocks = [block(layout.first_round_stabilizers.get(initial, []), [0]),
+              block(layout.round_stabilizers, np.arange(1, final_round)),
+              block(layout.round_stabilizers, [final_round])]
+    if initial in layout.final_data_stabilizers:
+        blocks.append(block(layout.final_data_stabilizers[initial], [final_round + 1], data=True))
+    return np.concatenate(blocks)
+
+def transversal_cnot_detector_table(distance, rounds, cnot_round, initial=("+", "0"), final_bases=("Z", "Z")):
+    # Detector table of transversal_cnot.transversal_cnot_circuit with the same
+    #  arguments; `patch` is 0 for the control and 1 for the target.
+    layout = CnotLayout(distance)
+    def block(stabilizers, round_numbers, data=False):
+        coords = [layout.measure_coords[2*k + BASES.index(basis)][j] for k, basis, j in stabilizers]
+        return detector_block([(basis, j) for _, basis, j in stabilizers], coords,
+                              np.array([k for k, _, _ in stabilizers]), round_numbers, data)
+
+    everything = layout.stabilizers()
+    first = [(k, basis, j) for k, basis, j in everything if basis == INITIAL_BASIS[initial[k]]]
+    n = layout.num_measures_per_type
+    final_data = [(k, basis, j) for k, basis in enumerate(final_bases) for j in range(n)]
+    return np.concatenate([block(first, [0]),
+                           block(everything, np.arange(1, rounds)),
+                           block(final_data, [rounds], data=True)])
+
+def detector_coordinates(table):
+    # The (x, y, t, patch) coordinates the circuit declares, shape (n, 4).
+    return np.stack([table["x"], table["y"], table["round"], table["patch"]], axis=1)
+
+def split_detectors(detection_events, table, field):
+    # Columns of a (shots, num_detectors) array grouped by a table field:
+    #  {value: detection_events[:, table[field] == value]}.
+    return {value.item(): detection_events[:, table[field] == value] for value in np.unique(table[field])}
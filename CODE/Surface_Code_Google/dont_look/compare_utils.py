@@ -1,12 +1,18 @@
 from io import BytesIO
-from cairosvg import svg2png
-from jupyter_compare_view import compare
-import matplotlib.image as mpimg
 import numpy as np
+from .circuit_diff import first_difference
 from .correct_surface_code import *
 import stim
 
+# cairosvg, jupyter_compare_view and matplotlib are only imported when a
+#  diagram or figure is actually displayed, so the structural checks below
+#  run in a plain batch job.
+
 def compare_svg_diagram(d1, d2):
+    from cairosvg import svg2png
+    from jupyter_compare_view import compare
+    import matplotlib.image as mpimg
+
     with BytesIO(svg2png(bytestring=d1._repr_svg_())) as fp:
         img = mpimg.imread(fp, format='png')
 
@@ -24,6 +30,8 @@ identical to the reference one (right).")
                  )
 
 def compare_plt_fig(fig1, filename):
+    from jupyter_compare_view import compare
+
     b1 = BytesIO()
     fig1.savefig(b1, format='png')
     b1.seek(0)
@@ -41,37 +49,47 @@ def compare_plt_fig(fig1, filename):
                  add_controls=False,
                  )
 
-def compare_circuit(circuit1, circuit2, without_noise=False, diagram_type='timeline-svg'):
+def compare_circuit(circuit1, circuit2, without_noise=False, diagram_type='timeline-svg', diagram=True):
+    # Compares the circuits instruction by instruction (see circuit_diff.py)
+    #  and prints the first difference. With diagram=False nothing is
+    #  rendered and the difference (None if there is none) is returned.
     if without_noise:
         circuit1 = circuit1.without_noise()
         circuit2 = circuit2.without_noise()
+    difference = first_difference(circuit1, circuit2)
+    if difference is None:
+        print("Your circuit IS equivalent to the reference one.")
+    else:
+        print(f"Your circuit is NOT equivalent to the reference one, first difference:\n{difference}")
+    if not diagram:
+        return difference
     d1, d2 = circuit1.diagram(diagram_type), circuit2.diagram(diagram_type)
     return compare_svg_diagram(d1, d2)
 
-def compare_lattice(circuit, distance, p, without_noise=False, diagram_type='timeline-svg'):
+def compare_lattice(circuit, distance, p, without_noise=False, diagram_type='timeline-svg', diagram=True):
     c2 = stim.Circuit(coord_circuit(distance) 
                       + lattice_with_noise(distance, p))
-    return compare_circuit(circuit, c2, without_noise, diagram_type)
+    return compare_circuit(circuit, c2, without_noise, diagram_type, diagram)
 
-def compare_stabilizers(circuit, distance, p, without_noise=False, diagram_type='timeline-svg'):
+def compare_stabilizers(circuit, distance, p, without_noise=False, diagram_type='timeline-svg', diagram=True):
     c2 = stim.Circuit(coord_circuit(distance) 
                       + stabilizers_with_noise(distance, p))
-    return compare_circuit(circuit, c2, without_noise, diagram_type)
+    return compare_circuit(circuit, c2, without_noise, diagram_type, diagram)
 
-def compare_initialization(circuit, distance, p, without_noise=False, diagram_type='timeline-svg'):
+def compare_initialization(circuit, distance, p, without_noise=False, diagram_type='timeline-svg', diagram=True):
     c2 = stim.Circuit(coord_circuit(distance) 
                       + initialization_step(distance, p))
-    return compare_circuit(circuit, c2, without_noise, diagram_type)
+    return compare_circuit(circuit, c2, without_noise, diagram_type, diagram)
 
-def compare_init_and_rounds(circuit, distance, rounds, p, without_noise=False, diagram_type='timeline-svg'):
+def compare_init_and_rounds(circuit, distance, rounds, p, without_noise=False, diagram_type='timeline-svg', diagram=True):
     c2 = stim.Circuit(coord_circuit(distance) 
                       + initialization_step(distance, p) 
                       + rounds_step(distance, rounds, p))
-    return compare_circuit(circuit, c2, without_noise, diagram_type)
+    return compare_circuit(circuit, c2, without_noise, diagram_type, diagram)
 
-def compare_surface(circuit, distance, rounds, p, without_noise=False, diagram_type='timeline-svg'):
+def compare_surface(circuit, distance, rounds, p, without_noise=False, diagram_type='timeline-svg', diagram=True):
     c2 = stim.Circuit(surface_code_circuit_string(distance, rounds, p))
-    return compare_circuit(circuit, c2, without_noise, diagram_type)
+    return compare_circuit(circuit, c2, without_noise, diagram_type, diagram)
     
 def compare_error_per_shot(fig):
     return compare_plt_fig(fig, 'dont_look/error_per_shot.png')
@@ -0,0 +1,151 @@
+# ============================
+# Vectorized shot evaluation
+#
+# Replacement for the notebooks' count_logical_errors, which compares every
+#  shot's prediction with np.array_equal in a Python loop. Here detection
+#  events and observable flips stay bit-packed (8 per byte, little-endian
+#  like stim and pymatching), the decoder works on the packed batch, and the
+#  mistakes are a single XOR of the packed predictions and flips. Failure
+#  counts are then popcounts over whole columns, so the comparison costs a
+#  couple of passes over (shots x num_observables/8) bytes.
+#
+#   counts = evaluate(circuit, 10**6)
+#   counts.any_errors, counts.per_observable, counts.any_rate
+#   count_logical_errors(circuit, 10**6)      # the notebooks' helper
+#
+# For large shot counts, stream_evaluate samples and decodes fixed-size
+#  chunks from a generator and only keeps running tallies, so memory stays
+#  at one chunk however many shots are taken, and the run stops early once
+#  `max_errors` failures were seen:
+#
+#   counts = stream_evaluate(circuit, 10**8, chunk_size=2**16, max_errors=1000)
+#
+# Any decoder with pymatching's decode_batch(shots, bit_packed_shots=True,
+#  bit_packed_predictions=True) signature can be passed in.
+
+import numpy as np
+import pymatching
+import stim
+
+DEFAULT_CHUNK_SIZE = 2**16
+
+
+class FailureCounts:
+    # Logical failures of a batch of shots: per observable, and shots where
+    #  any observable was mispredicted.
+
+    def __init__(self, shots, per_observable, any_errors):
+        self.shots = shots
+        self.per_observable = np.asarray(per_observable, dtype=np.int64)
+        self.any_errors = int(any_errors)
+
+    def __add__(self, other):
+        return FailureCounts(self.shots + other.shots, self.per_observable + other.per_observable,
+                             self.any_errors + other.any_errors)
+
+    @property
+    def any_rate(self):
+        return self.any_errors / self.shots if self.shots else 0.0
+
+    @property
+    def per_observable_rate(self):
+        return self.per_observable / self.shots if self.shots else np.zeros(len(self.per_observable))
+
+    def __repr__(self):
+        return (f"FailureCounts(shots={self.shots}, per_observable={self.per_observable.tolist()}, "
+                f"any_errors={self.any_errors})")
+
+def column_popcounts(packed, num_bits):
+    # Number of set bits in each of the first `num_bits` columns of a
+    #  little-endian bit-packed (shots, ceil(num_bits/8)) array.
+    return np.array([np.count_nonzero(packed[:, k >> 3] & np.uint8(1 << (k & 7)))
+                     for k in range(num_bits)], dtype=np.int64)
+
+def count_failures(predictions, observable_flips, num_observables, bit_packed=True):
+    # Compares predictions with observable flips, both bit-packed or both
+    #  one bool/uint8 per observable.
+    mistakes = np.bitwise_xor(predictions, observable_flips)
+    any_errors = np.count_nonzero(mistakes.any(axis=1))
+    if bit_packed:
+        per_observable = column_popcounts(mistakes, num_observables)
+    else:
+        per_observable = np.count_nonzero(mistakes, axis=0)
+    return FailureCounts(len(mistakes), per_observable, any_errors)
+
+def as_circuit(circuit):
+    # Accepts a stim.Circuit or a circuit string (e.g. from
+    #  surface_code_circuit_string).
+    return stim.Circuit(circuit) if isinstance(circuit, str) else circuit
+
+def sample_packed(circuit, shots, sampler=None, seed=None):
+    # Bit-packed detection events and observable flips.
+    if sampler is None:
+        sampler = circuit.compile_detector_sampler(seed=seed)
+    return sampler.sample(shots, separate_observables=True, bit_packed=True)
+
+def decode(decoder, detection_events, bit_packed=True):
+    if not bit_packed:
+        return decoder.decode_batch(detection_events)
+    return decoder.decode_batch(detection_events, bit_packed_shots=True, bit_packed_predictions=True)
+
+def matcher_for(circuit):
+    # The pymatching decoder the notebooks configure for a circuit. Faults
+    #  stim cannot decompose (the d>=5 transversal CNOT has some) are kept as
+    #  hyperedges, which pymatching ignores; see correlated_decoding for a
+    #  decoder that uses them.
+    dem = circuit.detector_error_model(decompose_errors=True, ignore_decomposition_failures=True)
+    return pymatching.Matching.from_detector_error_model(dem)
+
+def evaluate(circuit, shots, decoder=None, sampler=None, seed=None):
+    # Samples `shots` shots of `circuit`, decodes them as one batch and
+    #  returns their FailureCounts.
+    circuit = as_circuit(circuit)
+    decoder = matcher_for(circuit) if decoder is None else decoder
+    detection_events, observable_flips = sample_packed(circuit, shots, sampler, seed)
+    predictions = decode(decoder, detection_events)
+    return count_failures(predictions, observable_flips, circuit.num_observables)
+
+def count_logical_errors(circuit, num_shots, decoder=None):
+    # Drop-in replacement for the notebooks' helper: the number of shots with
+    #  at least one mispredicted observable.
+    return evaluate(circuit, num_shots, decoder).any_errors
+
+# ======================================================
+# streaming
+
+def sample_chunks(circuit, shots, chunk_size=DEFAULT_CHUNK_SIZE, bit_packed=True, sampler=None, seed=None):
+    # Yields (detection_events, observable_flips) for consecutive chunks of at
+    #  most `chunk_size` shots, `shots` in total. One sampler is compiled and
+    #  reused, so only the current chunk is ever held in memory.
+    if sampler is None:
+        sampler = as_circuit(circuit).compile_detector_sampler(seed=seed)
+    remaining = shots
+    while remaining > 0:
+        n = min(chunk_size, remaining)
+        yield sampler.sample(n, separate_observables=True, bit_packed=bit_packed)
+        remaining -= n
+
+def stream_failures(circuit, shots, decoder=None, chunk_size=DEFAULT_CHUNK_SIZE, bit_packed=True,
+                    max_errors=None, sampler=None, seed=None):
+    # Yields the running FailureCounts after every decoded chunk. Stops after
+    #  `shots` shots, or as soon as `max_errors` shots have failed.
+    circuit = as_circuit(circuit)
+    decoder = matcher_for(circuit) if decoder is None else decoder
+    total = FailureCounts(0, np.zeros(circuit.num_observables, dtype=np.int64), 0)
+    for detection_events, observable_flips in sample_chunks(circuit, shots, chunk_size, bit_packed,
+                                                             sampler, seed):
+        predictions = decode(decoder, detection_events, bit_packed)
+        total = total + count_failures(predictions, observable_flips, circuit.num_observables, bit_packed)
+        yield total
+        if max_errors is not None and total.any_errors >= max_errors:
+            return
+
+def stream_evaluate(circuit, shots, decoder=None, chunk_size=DEFAULT_CHUNK_SIZE, bit_packed=True,
+                    max_errors=None, sampler=None, seed=None):
+    # FailureCounts of up to `shots` shots taken chunk by chunk with flat
+    #  memory; `counts.shots` tells how many were needed to reach max_errors.
+    circuit = as_circuit(circuit)
+    total = FailureCounts(0, np.zeros(circuit.num_observables, dtype=np.int64), 0)
+    for total in stream_failures(circuit, shots, decoder, chunk_size, bit_packed, max_errors, sampler, seed):
+        pass
+    return total
@@ -0,0 +1,170 @@
+# ============================
+# Sparse hypergraph-product codes
+#
+# Sparse (CSR) version of the construction Toric_Code_Practice uses through
+#  bposd.hgp. For seed check matrices H1 (m1 x n1) and H2 (m2 x n2), with the
+#  same conventions as bposd.hgp:
+#
+#   hx = [ H1 (x) I_n2 | I_m1 (x) H2^T ]
+#   hz = [ I_n1 (x) H2 | H1^T (x) I_m2 ]
+#
+#  ring_code(L) seeds give the L x L toric code, rep_code(L) seeds the planar
+#  code. Everything stays sparse: the checks are scipy kron products, the
+#  check adjacency is hx @ hx.T, and the matching graph is built straight from
+#  the sparse matrix, so an L=100 toric code (20000 qubits) builds in well
+#  under a second.
+#
+# The logicals follow the Kunneth formula, in the canonical basis of
+#  Quintavalle and Campbell: with ker and a complement of the image of each
+#  seed (GF(2) elimination, symplectic.py, only on the small seeds),
+#
+#   lx = [ e_i (x) ker H2    | 0                 ]    e_i outside im H1^T
+#        [ 0                 | ker H1^T (x) e_j  ]    e_j outside im H2
+#   lz = [ ker H1 (x) e_j    | 0                 ]    e_j outside im H2^T
+#        [ 0                 | e_i (x) ker H2^T  ]    e_i outside im H1
+#
+#  so that hx lz^T = 0, hz lx^T = 0 and lx lz^T = I.
+#
+#   code = toric_code(100)
+#   matching = code.matching("X", weights=np.log((1-p)/p))
+#   adjacency = code.check_adjacency("X")
+
+import numpy as np
+import pymatching
+import scipy.sparse
+
+from .symplectic import nullspace, pack_rows, row_reduce, unpack_rows
+
+# ======================================================
+# seeds
+
+def ring_code(length):
+    # Cyclic repetition code: row i checks bits i and i+1 (mod length).
+    rows = np.repeat(np.arange(length), 2)
+    cols = (rows + np.tile([0, 1], length)) % length
+    return scipy.sparse.csr_matrix((np.ones(2*length, dtype=np.uint8), (rows, cols)), shape=(length, length))
+
+def rep_code(length):
+    # Open repetition code: row i checks bits i and i+1, length-1 rows.
+    rows = np.repeat(np.arange(length - 1), 2)
+    cols = rows + np.tile([0, 1], length - 1)
+    return scipy.sparse.csr_matrix((np.ones(2*(length-1), dtype=np.uint8), (rows, cols)),
+                                   shape=(length - 1, length))
+
+# ======================================================
+# GF(2) algebra on the (small) seeds
+
+def gf2_kernel(matrix):
+    # Basis of the kernel of a dense 0/1 matrix over GF(2), one vector per row.
+    matrix = np.asarray(matrix)
+    return unpack_rows(nullspace(pack_rows(matrix), matrix.shape[1]), matrix.shape[1])
+
+def image_complement(matrix):
+    # Unit vectors completing the row space of `matrix` to the full space:
+    #  the non-pivot columns of its echelon form, as rows of a 0/1 matrix.
+    matrix = np.asarray(matrix)
+    _, pivots = row_reduce(pack_rows(matrix), matrix.shape[1])
+    free = np.setdiff1d(np.arange(matrix.shape[1]), pivots)
+    return np.eye(matrix.shape[1], dtype=np.uint8)[free]
+
+def dense(matrix):
+    return matrix.toarray() if scipy.sparse.issparse(matrix) else np.asarray(matrix)
+
+def mod2(matrix):
+    # Sparse matrix with entries reduced mod 2 and explicit zeros removed.
+    matrix = scipy.sparse.csr_matrix(matrix, dtype=np.uint8)
+    matrix.data %= 2
+    matrix.eliminate_zeros()
+    return matrix
+
+# ======================================================
+# the code
+
+class HypergraphProductCode:
+    # hx, hz, lx, lz as CSR uint8 matrices; N qubits, K logical qubits.
+
+    def __init__(self, h1, h2):
+        h1 = scipy.sparse.csr_matrix(h1, dtype=np.uint8)
+        h2 = scipy.sparse.csr_matrix(h2, dtype=np.uint8)
+        m1, n1 = h1.shape
+        m2, n2 = h2.shape
+        self.h1, self.h2 = h1, h2
+        eye = lambda n: scipy.sparse.identity(n, dtype=np.uint8, format="csr")
+        self.hx = mod2(scipy.sparse.hstack([scipy.sparse.kron(h1, eye(n2)), scipy.sparse.kron(eye(m1), h2.T)]))
+        self.hz = mod2(scipy.sparse.hstack([scipy.sparse.kron(eye(n1), h2), scipy.sparse.kron(h1.T, eye(m2))]))
+        self.N = n1*n2 + m1*m2
+        self.left_size = n1*n2
+
+        d1, d2 = dense(h1), dense(h2)
+        self.lx = self.logicals(image_complement(d1), gf2_kernel(d2), gf2_kernel(d1.T), image_complement(d2.T))
+        self.lz = self.logicals(gf2_kernel(d1), image_complement(d2), image_complement(d1.T), gf2_kernel(d2.T))
+        self.K = self.lx.shape[0]
+
+    def logicals(self, a1, b1, a2, b2):
+        # Rows [a1[i] (x) b1[j] | 0] followed by [0 | a2[i] (x) b2[j]].
+        def block(a, b):
+            return scipy.sparse.kron(scipy.sparse.csr_matrix(a), scipy.sparse.csr_matrix(b), format="csr")
+        left, right = block(a1, b1), block(a2, b2)
+        return mod2(scipy.sparse.vstack([
+            scipy.sparse.hstack([left, scipy.sparse.csr_matrix((left.shape[0], self.N - self.left_size))]),
+            scipy.sparse.hstack([scipy.sparse.csr_matrix((right.shape[0], self.left_size)), right]),
+        ]))
+
+    def checks(self, basis):
+        return self.hx if basis == "X" else self.hz
+
+    def logicals_of(self, basis):
+        return self.lx if basis == "X" else self.lz
+
+    def test(self):
+        # True if the checks commute and the logicals commute with the checks
+        #  and pair up (lx lz^T = I), as bposd's css_code.test does.
+        def is_zero(matrix):
+            return mod2(matrix).nnz == 0
+        pairing = mod2(self.lx @ self.lz.T)
+        return (is_zero(self.hx @ self.hz.T) and is_zero(self.hx @ self.lz.T) and is_zero(self.hz @ self.lx.T)
+                and (pairing != scipy.sparse.identity(self.K, dtype=np.uint8)).nnz == 0)
+
+    def check_adjacency(self, basis="X"):
+        # Sparse adjacency of the checks of one type: two checks are adjacent
+        #  when they share a qubit. Diagonal removed.
+        h = self.checks(basis)
+        shared = (h @ h.T).tocoo()
+        off_diagonal = shared.row != shared.col
+        return scipy.sparse.csr_matrix((np.ones(off_diagonal.sum(), dtype=np.uint8),
+                                        (shared.row[off_diagonal], shared.col[off_diagonal])), shape=shared.shape)
+
+    def qubit_edges(self, basis="X"):
+        # The (check, check) pair every qubit connects in the matching graph
+        #  of one check type, shape (N, 2); -1 marks a boundary. Qubits in more
+        #  than two checks of that type are not graphlike and raise.
+        h = scipy.sparse.csc_matrix(self.checks(basis))
+        degrees = np.diff(h.indptr)
+        if degrees.max(initial=0) > 2:
+            raise ValueError("some qubits are in more than two checks; the code is not graphlike")
+        edges = np.full((h.shape[1], 2), -1, dtype=np.int64)
+        starts = h.indptr[:-1]
+        edges[degrees >= 1, 0] = h.indices[starts[degrees >= 1]]
+        edges[degrees == 2, 1] = h.indices[starts[degrees == 2] + 1]
+        return edges
+
+    def logical_edges(self, basis="X", k=0):
+        # The check pairs of the qubits in logical k, for drawing.
+        support = self.logicals_of(basis)[k].indices
+        return [tuple(edge) for edge in self.qubit_edges(basis)[support].tolist()]
+
+    def matching(self, basis="X", weights=None, error_probabilities=None):
+        # pymatching graph of one check type, built from the sparse matrix;
+        #  fault ids are the qubits' indices, so predictions are qubit errors.
+        return pymatching.Matching.from_check_matrix(self.checks(basis), weights=weights,
+                                                     error_probabilities=error_probabilities)
+
+
+def hypergraph_product(h1, h2):
+    return HypergraphProductCode(h1, h2)
+
+def toric_code(length):
+    return HypergraphProductCode(ring_code(length), ring_code(length))
+
+def planar_code(length):
+    return HypergraphProductCode(rep_code(length), rep_code(length))
@@ -0,0 +1,207 @@
+# ============================
+# Integer-lattice layout backend
+#
+# Qubit positions are stored as doubled integer coordinates in NumPy arrays:
+#  a data qubit at (col, row) sits at (2*col, 2*row) and a measure qubit at
+#  (col+0.5, row+0.5) sits at (2*col+1, 2*row+1). Qubit indices and
+#  stabilizer neighbourhoods are then plain integer arithmetic, with no dict
+#  lookups on float tuples, so layouts for d ~ 101 take milliseconds.
+#
+# The ordering matches surface_code.prepare_coords exactly: data qubits row by
+#  row, then X measures, then Z measures, and patch `idx` is shifted by
+#  idx*distance on both axes and by idx*(2*distance**2-1) in index.
+
+import functools
+
+import numpy as np
+
+# Diagonal neighbour offsets in doubled coordinates, in the plaquette corner
+#  order of adjacent_coords: top-left, top-right, bottom-left, bottom-right.
+CORNER_OFFSETS = np.array([(-1, -1), (1, -1), (-1, 1), (1, 1)])
+
+# Corner visited by X stabilizers in each CX layer (Z stabilizers use 0,1,2,3).
+X_CORNER_ORDER = [0, 2, 1, 3]
+
+def qubits_per_patch(distance):
+    # Number of qubits in one patch: d*d data qubits and d*d-1 measure qubits.
+    return 2*distance**2 - 1
+
+def data_coords2(distance, idx=0):
+    # Doubled coordinates of the data qubits, row by row, shape (d*d, 2).
+    rows, cols = np.meshgrid(np.arange(1, distance+1), np.arange(1, distance+1), indexing="ij")
+    coords = np.stack([2*cols.ravel(), 2*rows.ravel()], axis=1)
+    return coords + 2*idx*distance
+
+def z_measure_coords2(distance, idx=0):
+    # Doubled coordinates of the Z measure qubits, in z_measure_coords order.
+    rows, cols = np.meshgrid(np.arange(1, distance), np.arange(1, distance+1, 2), indexing="ij")
+    shift = np.where(rows % 2 == 1, -1, 1) # odd rows sit left of the column, even rows right
+    coords = np.stack([(2*cols + shift).ravel(), (2*rows + 1).ravel()], axis=1)
+    return coords + 2*idx*distance
+
+def x_measure_coords2(distance, idx=0):
+    # Doubled coordinates of the X measure qubits, in x_measure_coords order.
+    rows, cols = np.meshgrid(np.arange(1, distance+2), np.arange(2, distance, 2), indexing="ij")
+    shift = np.where(rows % 2 == 1, 1, -1) # odd rows sit right of the column, even rows left
+    coords = np.stack([(2*cols + shift).ravel(), (2*rows - 1).ravel()], axis=1)
+    return coords + 2*idx*distance
+
+def data_index(coords2, distance, idx=0):
+    # Returns the qubit index of the data qubit at each doubled coordinate,
+    #  or -1 where there is no data qubit of this patch.
+    coords2 = np.asarray(coords2)
+    local = coords2 - 2*idx*distance
+    col, row = local[..., 0] // 2, local[..., 1] // 2
+    valid = ((local[..., 0] % 2 == 0) & (local[..., 1] % 2 == 0)
+             & (col >= 1) & (col <= distance) & (row >= 1) & (row <= distance))
+    index = (row-1)*distance + (col-1) + idx*qubits_per_patch(distance)
+    return np.where(valid, index, -1)
+
+def corner_neighbours(measure_coords2, distance, idx=0):
+    # Returns the data qubit index at each of the four corners of every
+    #  measure qubit, shape (n, 4), with -1 for corners off the patch.
+    corners = np.asarray(measure_coords2)[:, None, :] + CORNER_OFFSETS[None, :, :]
+    return data_index(corners, distance, idx)
+
+def halve(values):
+    # Converts doubled coordinates back to the tuple API's numbers: ints for
+    #  whole values (data qubits), floats for half values (measure qubits).
+    return [v//2 if v % 2 == 0 else v/2 for v in values.tolist()]
+
+def coords_view(coords2):
+    # Returns doubled coordinates as the list of (col, row) tuples used by
+    #  surface_code.prepare_coords.
+    return list(zip(halve(coords2[:, 0]), halve(coords2[:, 1])))
+
+
+class LatticeLayout:
+    # Integer index arrays and CX schedule for one patch, computed with
+    #  vectorized arithmetic on doubled coordinates.
+
+    def __init__(self, distance, idx=0):
+        self.distance = distance
+        self.idx = idx
+        self.offset = idx*qubits_per_patch(distance)
+
+        self.data2 = data_coords2(distance, idx)
+        self.x2 = x_measure_coords2(distance, idx)
+        self.z2 = z_measure_coords2(distance, idx)
+        self.coords2 = np.concatenate([self.data2, self.x2, self.z2])
+
+        num_datas, num_x = len(self.data2), len(self.x2)
+        self.data_idx = np.arange(num_datas) + self.offset
+        self.x_idx = np.arange(num_datas, num_datas+num_x) + self.offset
+        self.z_idx = np.arange(num_datas+num_x, len(self.coords2)) + self.offset
+        self.all_idx = np.arange(len(self.coords2)) + self.offset
+
+        self.x_neighbours = corner_neighbours(self.x2, distance, idx)
+        self.z_neighbours = corner_neighbours(self.z2, distance, idx)
+
+        # CX layers as flat (control, target, ...) arrays: Z measures are
+        #  targets of their data corners, X measures control theirs.
+        self.cx_layers = []
+        self.idle_layers = []
+        for i in range(4):
+            z_data = self.z_neighbours[:, i]
+            z_keep = z_data >= 0
+            x_data = self.x_neighbours[:, X_CORNER_ORDER[i]]
+            x_keep = x_data >= 0
+            pairs = np.concatenate([
+                np.stack([z_data[z_keep], self.z_idx[z_keep]], axis=1).ravel(),
+                np.stack([self.x_idx[x_keep], x_data[x_keep]], axis=1).ravel(),
+            ])
+            busy = np.zeros(len(self.all_idx), dtype=bool)
+            busy[pairs - self.offset] = True
+            self.cx_layers.append(pairs)
+            self.idle_layers.append(self.all_idx[~busy])
+
+    def shifted(self, coord_shift2, index_shift):
+        # Returns a copy of this layout moved by `coord_shift2` (doubled
+        #  coordinates) and renumbered by `index_shift`, using only array adds.
+        layout = object.__new__(LatticeLayout)
+        layout.distance = self.distance
+        layout.idx = None
+        layout.offset = self.offset + index_shift
+        for name in ("data2", "x2", "z2", "coords2"):
+            setattr(layout, name, getattr(self, name) + coord_shift2)
+        for name in ("data_idx", "x_idx", "z_idx", "all_idx"):
+            setattr(layout, name, getattr(self, name) + index_shift)
+        for name in ("x_neighbours", "z_neighbours"):
+            neighbours = getattr(self, name)
+            setattr(layout, name, np.where(neighbours >= 0, neighbours + index_shift, -1))
+        layout.cx_layers = [layer + index_shift for layer in self.cx_layers]
+        layout.idle_layers = [layer + index_shift for layer in self.idle_layers]
+        return layout
+
+    def stabilizer_records(self, basis):
+        # Record offsets of each stabilizer of `basis` ("X" or "Z") and its data
+        #  corners, for a final measurement of every qubit of the patch in
+        #  index order. Returns a list of offset lists (ragged at the boundary).
+        measure_idx, neighbours = ((self.x_idx, self.x_neighbours) if basis == "X"
+                                   else (self.z_idx, self.z_neighbours))
+        shift = self.offset + len(self.all_idx)
+        measure_recs = (measure_idx - shift).tolist()
+        corner_recs = np.where(neighbours >= 0, neighbours - shift, 0).tolist()
+        return [[m] + [r for r in corners if r != 0]
+                for m, corners in zip(measure_recs, corner_recs)]
+
+
+@functools.lru_cache(maxsize=64)
+def template_layout(distance):
+    # The patch-0 layout every other patch of the same distance is shifted from.
+    return LatticeLayout(distance, 0)
+
+def patch_lattice(distance, idx):
+    # LatticeLayout of legacy patch `idx`, shifted from the shared template
+    #  instead of being recomputed.
+    layout = template_layout(distance).shifted(2*idx*distance, idx*qubits_per_patch(distance))
+    layout.idx = idx
+    return layout
+
+def grid_positions(num_patches, num_cols):
+    # Row-major (col, row) grid cells for `num_patches` patches.
+    cells = np.arange(num_patches)
+    return np.stack([cells % num_cols, cells // num_cols], axis=1)
+
+
+class RegisterLayout:
+    # K patches of the same distance placed on grid cells `positions`
+    #  ((col, row) pairs). All patches share one template LatticeLayout; patch k
+    #  is moved by spacing*position[k] data-qubit units and renumbered by
+    #  k*(2*distance**2-1), both applied as broadcast array adds.
+    #
+    # The default spacing of distance+1 keeps neighbouring patches' boundary
+    #  measure qubits apart. The legacy `idx` placement is positions (i, i)
+    #  with spacing=distance.
+
+    def __init__(self, distance, positions, spacing=None):
+        self.distance = distance
+        self.spacing = distance+1 if spacing is None else spacing
+        self.positions = np.asarray(positions, dtype=np.int64).reshape(-1, 2)
+        self.num_patches = len(self.positions)
+        self.template = template = template_layout(distance)
+        self.qubits_per_patch = qubits_per_patch(distance)
+
+        self.coord_shifts2 = 2*self.spacing*self.positions
+        self.index_shifts = np.arange(self.num_patches) * self.qubits_per_patch
+        shifts = self.index_shifts[:, None]
+
+        # per-patch arrays, shape (K, ...)
+        self.coords2 = template.coords2[None, :, :] + self.coord_shifts2[:, None, :]
+        self.data_idx = template.data_idx[None, :] + shifts
+        self.x_idx = template.x_idx[None, :] + shifts
+        self.z_idx = template.z_idx[None, :] + shifts
+        self.all_idx = template.all_idx[None, :] + shifts
+
+        # flat arrays covering every patch at once, ready to be used as the
+        #  targets of a single instruction
+        self.cx_layers = [(layer[None, :] + shifts).ravel() for layer in template.cx_layers]
+        self.idle_layers = [(layer[None, :] + shifts).ravel() for layer in template.idle_layers]
+
+    @property
+    def num_qubits(self):
+        return self.num_patches * self.qubits_per_patch
+
+    def patch(self, k):
+        # The LatticeLayout of patch k on its own.
+        return self.template.shifted(self.coord_shifts2[k], self.index_shifts[k])
@@ -0,0 +1,117 @@
+# ============================
+# Noise-parametric circuit templates
+#
+# A p-sweep only changes the probabilities of the noise channels; the gates,
+#  detectors and REPEAT structure are the same for every p. A NoiseTemplate
+#  is compiled once from one circuit: its program text is split around the
+#  argument of every single-parameter noise channel (DEPOLARIZE1,
+#  DEPOLARIZE2, X_ERROR, Z_ERROR, ...). A circuit for any noise strength is
+#  then one str.join of the fixed text chunks with the new probabilities,
+#  parsed by stim in C++, instead of a rebuild of the whole layout.
+#
+#   template = memory_template(d, 0, 3*d, "0")
+#   for p in ps:
+#       circuit = template.circuit(p)
+#   template.circuit({"DEPOLARIZE2": 2*p, "X_ERROR": p/2}, default=p)
+#
+# Templates are kept in an LRU cache per (distance, idx, rounds, initial), so
+#  every p of a sweep shares one compiled template.
+
+import functools
+
+import stim
+
+from .compose import format_instruction, parse_program
+from .surface_code import surface_code_circuit
+from .transversal_cnot import transversal_cnot_circuit
+
+# Probability the template circuits are generated with. Any value works; it
+#  only has to be a valid probability so that the generators accept it.
+TEMPLATE_P = 0.001
+
+
+def is_noise_slot(name, args):
+    # True for noise channels whose single argument is the error probability.
+    return (args is not None and "," not in args and name != "REPEAT"
+            and stim.gate_data(name).is_noisy_gate)
+
+def split_items(items, chunks, channels, current):
+    # Walks parsed program items, appending the text before every noise
+    #  argument to `chunks` and the channel name to `channels`. `current`
+    #  collects the text since the last argument and is returned.
+    for item in items:
+        if item[0] == "REPEAT":
+            _, count, body = item
+            current.append(f"REPEAT {count} {{\n")
+            current = split_items(body, chunks, channels, current)
+            current.append("}\n")
+            continue
+        name, args, tag, targets = item
+        if not is_noise_slot(name, args):
+            current.append(format_instruction(name, args, tag, targets) + "\n")
+            continue
+        head = name if tag is None else f"{name}[{tag}]"
+        current.append(f"{head}(")
+        chunks.append("".join(current))
+        channels.append(name)
+        current = [f") {' '.join(targets)}\n"]
+    return current
+
+
+class NoiseTemplate:
+    # The program text of a circuit with its noise probabilities left open.
+    #  `chunks` has one more entry than `channels`: chunk i is followed by the
+    #  probability of noise channel `channels[i]`.
+
+    def __init__(self, circuit):
+        self.chunks = []
+        self.channels = []
+        tail = split_items(parse_program(str(circuit)), self.chunks, self.channels, [])
+        self.chunks.append("".join(tail))
+        self.channel_names = sorted(set(self.channels))
+        self.num_qubits = circuit.num_qubits
+        self.num_detectors = circuit.num_detectors
+        self.num_observables = circuit.num_observables
+
+    def text(self, p, default=None):
+        # Program text with every noise channel set to `p`, or, for a dict
+        #  `p`, channel name -> probability with `default` for the rest.
+        if not isinstance(p, dict):
+            return repr(float(p)).join(self.chunks)
+        values = {}
+        for name in self.channel_names:
+            value = p.get(name, default)
+            if value is None:
+                raise ValueError(f"no probability given for {name}")
+            values[name] = repr(float(value))
+        parts = [self.chunks[0]]
+        for name, chunk in zip(self.channels, self.chunks[1:]):
+            parts.append(values[name])
+            parts.append(chunk)
+        return "".join(parts)
+
+    def circuit(self, p, default=None):
+        return stim.Circuit(self.text(p, default))
+
+    def circuits(self, ps, default=None):
+        # One circuit per noise strength of a sweep.
+        for p in ps:
+            yield self.circuit(p, default)
+
+
+@functools.lru_cache(maxsize=64)
+def memory_template(distance, idx, rounds, initial):
+    # Template of surface_code.surface_code_circuit for one (distance, idx,
+    #  rounds, initial).
+    return NoiseTemplate(surface_code_circuit(distance, idx, rounds, TEMPLATE_P, initial))
+
+@functools.lru_cache(maxsize=64)
+def transversal_cnot_template(distance, rounds, cnot_round, initial=("+", "0"), final_bases=("Z", "Z")):
+    # Template of transversal_cnot.transversal_cnot_circuit.
+    return NoiseTemplate(transversal_cnot_circuit(distance, rounds, cnot_round, TEMPLATE_P,
+                                                  tuple(initial), tuple(final_bases)))
+
+def memory_circuit(distance, idx, rounds, p, initial):
+    # Same circuit as surface_code_circuit(distance, idx, rounds, p, initial),
+    #  from the cached template.
+    return memory_template(distance, idx, rounds, initial).circuit(p)
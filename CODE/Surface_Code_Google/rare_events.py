@@ -0,0 +1,415 @@
+# ============================
+# Fault-weight-stratified estimator for rare logical errors
+#
+# At p = 1e-4 and d = 9 a memory experiment fails far too rarely for direct
+#  sampling. Here the shots are split by their number of faults K, the
+#  number of error mechanisms of the DEM that fired:
+#
+#   P_L(p) = sum_k P_p(K = k) f_k(p),   f_k(p) = P_p(fail | K = k)
+#
+#  P_p(K = k) is computed exactly (a Poisson-binomial distribution over the
+#  DEM's probabilities), and each f_k is estimated by sampling exactly k
+#  faults and decoding them. The strata that matter at low p (k a little
+#  above half the circuit distance) fail often enough to be measured with
+#  ~10^5-10^7 shots, even when P_L itself is 10^-12.
+#
+# Given K = k, the set of faults S has probability proportional to the
+#  product of w_i = p_i/(1-p_i) over S. It is sampled exactly by drawing k
+#  mechanisms independently with probabilities proportional to w_i and
+#  rejecting draws that repeat a mechanism. Detection events and observable
+#  flips are then the XOR of the k mechanisms' bit-packed rows.
+#
+# One set of samples serves a whole ladder of p values: the faults are drawn
+#  at a reference p_0 (by default the largest p) and every sample is
+#  reweighted to each p of the ladder by the exact ratio of conditional
+#  probabilities,
+#
+#   r(S) = prod_(i in S) w_i(p)/w_i(p_0) * E_k(p_0)/E_k(p),
+#
+#  (E_k the k-th elementary symmetric polynomial of the w_i), and decoded
+#  with the matcher of that p. Every f_k(p) estimate, and so every P_L(p),
+#  is unbiased.
+#
+# What is not sampled:
+#   - strata below `min_faults`, taken as never failing. The default is half
+#     the graphlike circuit distance (rounded up), below which matching
+#     corrects every fault set; pass min_faults=1 to sample them too.
+#   - strata above the point where P_p(K > k) drops below `tail` for every p.
+#     That tail mass is added to the upper confidence limit.
+#
+# Shots are spread over the strata by Neyman allocation (shots proportional
+#  to P_p(K = k) times the standard deviation of the stratum, summed in
+#  relative terms over the ladder, over the square root of the cost of a
+#  shot, which grows with k) and re-planned after every round. Strata
+#  with no failure yet count with a Laplace-smoothed variance, and add their
+#  one-sided zero-failure bound to the upper confidence limit. The rest of
+#  the interval is a normal approximation, to be trusted once the strata
+#  that dominate an estimate have seen about ten failures each.
+#
+#   estimator = StratifiedEstimator(memory_ladder(9, 0, 27, [1e-4, 2e-4, 5e-4], "0"))
+#   estimator.run(10**7, target_relative_width=0.2, max_seconds=600)
+#   for estimate in estimator.estimates():
+#       print(estimate)
+#
+# Run from the CODE directory:
+#   python -m Surface_Code_Google.rare_events --distance 9 --ps 0.0001 0.0002 0.0005 --max-seconds 600
+
+import argparse
+import concurrent.futures
+import hashlib
+import math
+import os
+import time
+
+import numpy as np
+import pymatching
+import scipy.stats
+import stim
+
+from .evaluation import decode
+from .noise_template import memory_circuit
+
+# Bytes of gathered mechanism rows per batch, bounding the (shots, k, bytes)
+#  array the detection events are reduced from.
+BATCH_BYTES = 2**26
+# Pilot shots of the lightest strata.
+MIN_PILOT_SHOTS = 20
+
+
+def memory_ladder(distance, idx, rounds, ps, initial):
+    # {p: circuit} of surface_code_circuit_string's memory circuits.
+    return {p: memory_circuit(distance, idx, rounds, p, initial) for p in ps}
+
+def mechanism_table(dem):
+    # (probabilities, detector rows, observable rows) of the error mechanisms
+    #  of a DEM: rows are bit-packed (little-endian) and hold the XOR of the
+    #  mechanism's components.
+    probabilities, detectors, observables = [], [], []
+    for instruction in dem.flattened():
+        if instruction.type != "error":
+            continue
+        row = len(probabilities)
+        probabilities.append(instruction.args_copy()[0])
+        for target in instruction.targets_copy():
+            if target.is_relative_detector_id():
+                detectors.append((row, target.val))
+            elif target.is_logical_observable_id():
+                observables.append((row, target.val))
+
+    def packed(pairs, num_bits):
+        packed = np.zeros((len(probabilities), (num_bits + 7) // 8), dtype=np.uint8)
+        if pairs:
+            rows, columns = np.array(pairs).T
+            np.bitwise_xor.at(packed, (rows, columns >> 3), (1 << (columns & 7)).astype(np.uint8))
+        return packed
+    return (np.array(probabilities), packed(detectors, dem.num_detectors),
+            packed(observables, dem.num_observables))
+
+def fault_count_distribution(probabilities, kmax):
+    # P(K = k) for k = 0..kmax, K the number of independent mechanisms that
+    #  fire. Mechanisms with equal probability are convolved as binomials.
+    distribution = np.zeros(kmax + 1)
+    distribution[0] = 1.0
+    values, counts = np.unique(probabilities, return_counts=True)
+    for value, count in zip(values, counts):
+        pmf = scipy.stats.binom.pmf(np.arange(min(count, kmax) + 1), count, value)
+        distribution = np.convolve(distribution, pmf)[:kmax + 1]
+    return distribution
+
+def log_weights(probabilities):
+    with np.errstate(divide="ignore"):
+        return np.log(probabilities) - np.log1p(-probabilities)
+
+
+class LadderModel:
+    # The DEMs, matchers and fault statistics of one circuit at every p of a
+    #  ladder; the circuits must differ only in their noise probabilities.
+
+    def __init__(self, circuits, reference=None):
+        self.ps = sorted(circuits)
+        self.reference = self.ps[-1] if reference is None else reference
+        dems = [circuits[p].detector_error_model(decompose_errors=True) for p in self.ps]
+        self.matchers = [pymatching.Matching.from_detector_error_model(dem) for dem in dems]
+        tables = [mechanism_table(dem) for dem in dems]
+        _, self.detector_rows, self.observable_rows = tables[self.ps.index(self.reference)]
+        for _, detector_rows, observable_rows in tables:
+            if not (np.array_equal(detector_rows, self.detector_rows)
+                    and np.array_equal(observable_rows, self.observable_rows)):
+                raise ValueError("the circuits of the ladder do not have the same error mechanisms")
+        self.probabilities = np.array([table[0] for table in tables]) # (len(ps), mechanisms)
+        self.num_observables = dems[0].num_observables
+
+        reference_probabilities = self.probabilities[self.ps.index(self.reference)]
+        if not np.all(reference_probabilities > 0):
+            raise ValueError("every error mechanism needs a nonzero probability at the reference p")
+        self.log_ratios = log_weights(self.probabilities) - log_weights(reference_probabilities)
+        weights = np.exp(log_weights(reference_probabilities))
+        self.cumulative = np.cumsum(weights / weights.sum())
+        self.log_survival = np.log1p(-self.probabilities).sum(axis=1)
+        self.graphlike_distance = len(circuits[self.reference].shortest_graphlike_error())
+
+    def fault_counts(self, kmax):
+        # (len(ps), kmax+1) array of P_p(K = k).
+        return np.array([fault_count_distribution(probabilities, kmax) for probabilities in self.probabilities])
+
+    def sample_faults(self, rng, k, shots):
+        # (shots, k) distinct mechanism indices, from the conditional
+        #  distribution given K = k at the reference p.
+        faults = np.empty((shots, k), dtype=np.int64)
+        todo = np.arange(shots)
+        while len(todo):
+            draw = np.searchsorted(self.cumulative, rng.random((len(todo), k)), side="right")
+            draw = np.minimum(draw, len(self.cumulative) - 1)
+            draw.sort(axis=1)
+            distinct = np.all(draw[:, 1:] != draw[:, :-1], axis=1)
+            faults[todo[distinct]] = draw[distinct]
+            todo = todo[~distinct]
+        return faults
+
+    def batch(self, k, shots, rng, log_normalizers):
+        # StratumTally of `shots` samples with exactly k faults.
+        tally = StratumTally(len(self.ps))
+        per_batch = max(1, BATCH_BYTES // max(1, k*self.detector_rows.shape[1]))
+        while tally.shots < shots:
+            n = min(per_batch, shots - tally.shots)
+            faults = self.sample_faults(rng, k, n)
+            detection_events = np.bitwise_xor.reduce(self.detector_rows[faults], axis=1)
+            observable_flips = np.bitwise_xor.reduce(self.observable_rows[faults], axis=1)
+            ratios = np.exp(self.log_ratios[:, faults].sum(axis=2) + log_normalizers[:, None])
+            failures = np.array([(decode(matcher, detection_events) ^ observable_flips).any(axis=1)
+                                 for matcher in self.matchers])
+            tally = tally + StratumTally.from_samples(ratios, failures)
+        return tally
+
+
+class StratumTally:
+    # Running sums of one stratum for every p of the ladder: samples,
+    #  failing samples, sum of r*fail, of (r*fail)^2 and of r^2, largest r.
+
+    def __init__(self, num_ps, shots=0, failures=None, sums=None, squares=None, ratio_squares=None,
+                 max_ratio=None):
+        zeros = np.zeros(num_ps)
+        self.shots = shots
+        self.failures = zeros.copy() if failures is None else failures
+        self.sums = zeros.copy() if sums is None else sums
+        self.squares = zeros.copy() if squares is None else squares
+        self.ratio_squares = zeros.copy() if ratio_squares is None else ratio_squares
+        self.max_ratio = zeros.copy() if max_ratio is None else max_ratio
+
+    @classmethod
+    def from_samples(cls, ratios, failures):
+        # ratios and failures as (len(ps), shots) arrays.
+        weighted = ratios * failures
+        return cls(len(ratios), ratios.shape[1], failures.sum(axis=1).astype(float), weighted.sum(axis=1),
+                   (weighted**2).sum(axis=1), (ratios**2).sum(axis=1), ratios.max(axis=1, initial=0.0))
+
+    def __add__(self, other):
+        return StratumTally(len(self.sums), self.shots + other.shots, self.failures + other.failures,
+                            self.sums + other.sums, self.squares + other.squares,
+                            self.ratio_squares + other.ratio_squares, np.maximum(self.max_ratio, other.max_ratio))
+
+    def mean(self):
+        return self.sums / self.shots if self.shots else np.zeros(len(self.sums))
+
+    def variance(self):
+        # Sample variance of r*fail, and a Laplace-smoothed stand-in while a
+        #  stratum has no failure, so that allocation keeps sampling it.
+        if self.shots < 2:
+            return self.ratio_squares / max(self.shots, 1) if self.shots else np.ones(len(self.sums))
+        sample = (self.squares - self.sums**2 / self.shots) / (self.shots - 1)
+        smoothed = self.ratio_squares / self.shots / (self.shots + 2)
+        return np.where(self.failures > 0, sample, smoothed)
+
+
+class RareEventEstimate:
+    # P_L at one p: estimate, standard error, confidence interval and the
+    #  unsampled tail mass included in `upper`.
+
+    def __init__(self, p, estimate, std_error, lower, upper, tail, shots):
+        self.p = p
+        self.estimate = estimate
+        self.std_error = std_error
+        self.lower = lower
+        self.upper = upper
+        self.tail = tail
+        self.shots = shots
+
+    @property
+    def relative_width(self):
+        return (self.upper - self.lower) / (2*self.estimate) if self.estimate > 0 else math.inf
+
+    def __repr__(self):
+        return (f"RareEventEstimate(p={self.p:g}, estimate={self.estimate:.3e}, "
+                f"interval=[{self.lower:.3e}, {self.upper:.3e}], shots={self.shots})")
+
+# ======================================================
+# worker
+
+# Per-process ladder models, by a hash of the circuits and reference.
+worker_state = {}
+
+def ladder_key(texts, reference):
+    return hashlib.sha256(repr((sorted(texts.items()), reference)).encode()).hexdigest()
+
+def worker_model(texts, reference):
+    key = ladder_key(texts, reference)
+    if key not in worker_state:
+        worker_state[key] = LadderModel({p: stim.Circuit(text) for p, text in texts.items()}, reference)
+    return worker_state[key]
+
+def run_batch(texts, reference, k, shots, log_normalizers, seed):
+    return worker_model(texts, reference).batch(k, shots, np.random.default_rng(seed), log_normalizers)
+
+
+class StratifiedEstimator:
+    # Stratified estimates of P_L over a ladder {p: circuit}.
+
+    def __init__(self, circuits, reference=None, min_faults=None, tail=1e-15, seed=0):
+        self.texts = {p: str(circuit) for p, circuit in circuits.items()}
+        self.model = LadderModel(circuits, reference)
+        self.ps = self.model.ps
+        self.seed = seed
+        self.batches_run = 0
+        self.min_faults = (self.model.graphlike_distance + 1) // 2 if min_faults is None else max(1, min_faults)
+
+        # strata min_faults..kmax, kmax the first k with P_p(K > k) <= tail at every p
+        means = self.model.probabilities.sum(axis=1)
+        bound = int(means.max() + 20*np.sqrt(means.max()) + 50)
+        counts = self.model.fault_counts(bound)
+        survival = 1 - np.cumsum(counts, axis=1)
+        kmax = max(self.min_faults, int(np.argmax(np.all(survival <= tail, axis=0))) or bound)
+        self.tail = np.clip(survival[:, kmax], 0, None)
+        self.strata = np.arange(self.min_faults, kmax + 1)
+        self.fault_probabilities = counts[:, self.strata] # (len(ps), strata)
+
+        # log E_k(p_0) - log E_k(p), with E_k(p) = P_p(K = k) / prod(1 - p_i)
+        with np.errstate(divide="ignore"):
+            log_elementary = np.log(self.fault_probabilities) - self.model.log_survival[:, None]
+        reference_row = log_elementary[self.ps.index(self.model.reference)]
+        self.log_normalizers = np.where(np.isfinite(log_elementary), reference_row - log_elementary, -np.inf)
+        self.tallies = [StratumTally(len(self.ps)) for _ in self.strata]
+
+    def add(self, index, tally):
+        self.tallies[index] = self.tallies[index] + tally
+
+    def estimates(self, confidence=0.95):
+        # One RareEventEstimate per p of the ladder.
+        z = scipy.stats.norm.ppf(0.5 + confidence/2)
+        log_alpha = -math.log(1 - confidence)
+        results = []
+        for j, p in enumerate(self.ps):
+            weights = self.fault_probabilities[j]
+            estimate, variance, unseen = 0.0, 0.0, self.tail[j]
+            for weight, tally in zip(weights, self.tallies):
+                if weight == 0:
+                    continue
+                if tally.shots == 0:
+                    unseen += weight
+                    continue
+                estimate += weight * tally.mean()[j]
+                if tally.failures[j] > 0:
+                    variance += weight**2 * tally.variance()[j] / tally.shots
+                else: # one-sided bound for a stratum without failures
+                    unseen += weight * min(1.0, tally.max_ratio[j] * log_alpha / tally.shots)
+            std_error = math.sqrt(variance)
+            results.append(RareEventEstimate(p, estimate, std_error, max(0.0, estimate - z*std_error),
+                                             estimate + z*std_error + unseen, self.tail[j],
+                                             sum(tally.shots for tally in self.tallies)))
+        return results
+
+    def pilot(self, shots):
+        # First-round shots per stratum, in proportion to its largest weight
+        #  relative to the heaviest stratum of the same p.
+        relative = (self.fault_probabilities / self.fault_probabilities.max(axis=1, keepdims=True)).max(axis=0)
+        return np.maximum(MIN_PILOT_SHOTS, np.ceil(shots * relative)).astype(np.int64)
+
+    def allocation(self, shots):
+        # Shots per stratum for the next round: Neyman allocation (with a
+        #  per-shot cost of k) of the total so far plus `shots`, minimizing
+        #  the summed relative variance over the ladder, minus what each
+        #  stratum already has.
+        estimates = np.array([max(e.estimate, e.upper * 1e-3, 1e-300) for e in self.estimates()])
+        deviations = np.sqrt(np.array([tally.variance() for tally in self.tallies]).T) # (len(ps), strata)
+        scores = np.sqrt((((self.fault_probabilities * deviations) / estimates[:, None])**2).sum(axis=0))
+        scores /= np.sqrt(self.strata) # decoding cost grows about linearly with k
+        done = np.array([tally.shots for tally in self.tallies])
+        if not scores.any():
+            return np.zeros(len(self.strata), dtype=np.int64)
+        wanted = np.maximum((done.sum() + shots) * scores / scores.sum() - done, 0)
+        return np.floor(shots * wanted / wanted.sum()).astype(np.int64) if wanted.any() else wanted.astype(np.int64)
+
+    def run(self, shots, round_shots=None, pilot_shots=1000, target_relative_width=None, max_seconds=None,
+            workers=1, progress=print):
+        # Samples up to `shots` shots in rounds of `round_shots` after a pilot
+        #  round, stopping early once every p has a relative half-width of at
+        #  most `target_relative_width` or after `max_seconds`. Returns the
+        #  estimates.
+        start = time.time()
+        round_shots = round_shots or max(10 * pilot_shots, shots // 20)
+        pool = concurrent.futures.ProcessPoolExecutor(workers) if workers and workers > 1 else None
+        taken = sum(tally.shots for tally in self.tallies)
+        try:
+            while taken < shots:
+                if taken == 0:
+                    plan = self.pilot(pilot_shots)
+                else:
+                    plan = self.allocation(min(round_shots, shots - taken))
+                if not plan.any():
+                    break
+                taken += int(plan.sum())
+                self.run_round(plan, pool, workers)
+                estimates = self.estimates()
+                if progress is not None:
+                    progress(f"{taken} shots, {time.time() - start:.0f} s: "
+                             + ", ".join(f"p={e.p:g} {e.estimate:.2e} ±{e.relative_width:.0%}" for e in estimates))
+                if target_relative_width is not None and all(e.relative_width <= target_relative_width
+                                                              for e in estimates):
+                    break
+                if max_seconds is not None and time.time() - start > max_seconds:
+                    break
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return self.estimates()
+
+    def run_round(self, plan, pool, workers):
+        # Runs plan[i] shots of stratum i, split over the workers.
+        jobs = []
+        for index, n in enumerate(plan):
+            pieces = min(int(n), workers or 1)
+            for piece in range(pieces):
+                count = n // pieces + (piece < n % pieces)
+                self.batches_run += 1
+                jobs.append((index, int(count), [self.seed, self.batches_run]))
+        if pool is None:
+            for index, count, seed in jobs:
+                self.add(index, self.model.batch(int(self.strata[index]), count, np.random.default_rng(seed),
+                                                 self.log_normalizers[:, index]))
+            return
+        futures = {pool.submit(run_batch, self.texts, self.model.reference, int(self.strata[index]), count,
+                               self.log_normalizers[:, index], seed): index for index, count, seed in jobs}
+        for future in concurrent.futures.as_completed(futures):
+            self.add(futures[future], future.result())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fault-weight-stratified logical error rates at low p.")
+    parser.add_argument("--distance", type=int, default=9)
+    parser.add_argument("--rounds", type=int, default=None, help="default: 3*distance")
+    parser.add_argument("--ps", type=float, nargs="+", default=[0.0001, 0.0002, 0.0005])
+    parser.add_argument("--initial", default="0", choices=["0", "+"])
+    parser.add_argument("--idx", type=int, default=0)
+    parser.add_argument("--min-faults", type=int, default=None,
+                        help="smallest sampled fault count (default: half the graphlike distance)")
+    parser.add_argument("--shots", type=int, default=10**8)
+    parser.add_argument("--target-relative-width", type=float, default=0.2)
+    parser.add_argument("--max-seconds", type=float, default=600)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    ladder = memory_ladder(args.distance, args.idx, args.rounds or 3*args.distance, args.ps, args.initial)
+    estimator = StratifiedEstimator(ladder, min_faults=args.min_faults)
+    estimator.run(args.shots, target_relative_width=args.target_relative_width, max_seconds=args.max_seconds,
+                  workers=args.workers)
+    print(f"{'p':>9} {'estimate':>10} {'lower':>10} {'upper':>10} {'tail':>9}")
+    for e in estimator.estimates():
+        print(f"{e.p:>9g} {e.estimate:>10.3e} {e.lower:>10.3e} {e.upper:>10.3e} {e.tail:>9.1e}")
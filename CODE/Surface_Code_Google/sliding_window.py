@@ -0,0 +1,287 @@
+# ============================
+# Sliding-window decoding for long memory experiments
+#
+# Instead of one matching graph over every detector of the experiment, the
+#  detectors are grouped into measurement layers (one per syndrome round)
+#  and decoded in overlapping windows of `window` layers. Only the matches
+#  in the oldest `commit` layers of a window are kept:
+#
+#   - their observable flips are added to the prediction, and
+#   - the detectors they flip in later layers are toggled in the syndrome,
+#
+#  then the window slides forward by `commit` layers. The last window commits
+#  everything it contains.
+#
+# Both effects are read from one decode_batch call per window: in the
+#  window's DEM an error that would be committed carries its observables and
+#  one extra fault id per later detector it flips, and every other error
+#  carries no fault ids. Windows in the bulk of the REPEAT block have the same
+#  DEM up to a shift of detector indices, so the decoder is built from a
+#  truncated copy of the circuit that keeps only a few iterations of its
+#  longest REPEAT block: every window of the full experiment is one of the
+#  truncated circuit's windows, moved by a whole number of iterations. Set-up
+#  time, memory and per-window latency do not grow with the number of rounds.
+#
+# decode_batch takes every detector of a shot at once. For data that arrives
+#  round by round, feed one window's detectors at a time instead; only the
+#  toggles carried into later windows are kept between calls:
+#
+#   decoder = SlidingWindowDecoder(surface_code_circuit(d, 0, 1000, p, "0"), window=2*d, commit=d)
+#   stream_evaluate(circuit, 10**6, decoder=decoder)
+#
+#   state = decoder.start(num_shots)
+#   for window in decoder.windows():
+#       decoder.decode_window(state, window, shots[:, window.detectors])
+#   predictions = state.predictions
+
+import numpy as np
+import pymatching
+import stim
+
+from .correlated_decoding import error_components
+from .evaluation import as_circuit
+
+
+def detector_layers(circuit):
+    # The measurement layer of every detector: the index of the measuring
+    #  instruction that produced the newest result the detector reads. REPEAT
+    #  blocks are walked iteration by iteration, so this is only used on
+    #  truncated circuits.
+    layers = []
+    measurement_layers = []
+    next_layer = 0
+    def walk(block):
+        nonlocal next_layer
+        for instruction in block:
+            if isinstance(instruction, stim.CircuitRepeatBlock):
+                body = instruction.body_copy()
+                for _ in range(instruction.repeat_count):
+                    walk(body)
+            elif instruction.name == "DETECTOR":
+                recs = [t.value for t in instruction.targets_copy()]
+                layers.append(measurement_layers[len(measurement_layers) + max(recs)] if recs
+                              else max(next_layer - 1, 0))
+            elif instruction.num_measurements:
+                measurement_layers.extend([next_layer] * instruction.num_measurements)
+                next_layer += 1
+    walk(circuit)
+    return np.array(layers, dtype=np.int64)
+
+def dem_components(dem):
+    # The graphlike components of a decomposed DEM as (detectors,
+    #  observables, probability) with detector and observable tuples.
+    components = []
+    for instruction in dem.flattened():
+        if instruction.type != "error":
+            continue
+        p = instruction.args_copy()[0]
+        for detectors, observables in error_components(instruction):
+            if not detectors:
+                continue
+            if len(detectors) > 2:
+                raise ValueError("sliding-window decoding needs a graphlike (decomposed) DEM")
+            components.append((detectors, observables, p))
+    return components
+
+def longest_repeat(circuit):
+    # Position of the top-level REPEAT block with the most iterations, or None.
+    best = None
+    for i, instruction in enumerate(circuit):
+        if isinstance(instruction, stim.CircuitRepeatBlock) and (
+                best is None or instruction.repeat_count > circuit[best].repeat_count):
+            best = i
+    return best
+
+def with_repeat_count(circuit, position, count):
+    # `circuit` with the REPEAT block at `position` run `count` times.
+    truncated = circuit[:position]
+    truncated.append(stim.CircuitRepeatBlock(count, circuit[position].body_copy()))
+    truncated += circuit[position+1:]
+    return truncated
+
+
+class WindowPlan:
+    # One window: the detectors it decodes (circuit indices, in layer order),
+    #  the later detectors its committed matches may flip, how many of its
+    #  detectors it commits, and the key of its matching graph.
+
+    def __init__(self, detectors, flips, committed, key):
+        self.detectors = detectors
+        self.flips = flips
+        self.committed = committed
+        self.key = key
+
+    def shifted(self, offset):
+        # The same window `offset` detectors later.
+        return WindowPlan(self.detectors + offset, self.flips + offset, self.committed, self.key)
+
+
+class WindowState:
+    # What a batch of shots carries from one window to the next: the
+    #  committed observable flips and the toggles of detectors that later
+    #  windows still decode.
+
+    def __init__(self, num_shots, num_observables):
+        self.predictions = np.zeros((num_shots, num_observables), dtype=np.uint8)
+        self.carried = {}
+
+
+class SlidingWindowDecoder:
+    # Windowed matching with the decode_batch interface of pymatching.Matching.
+    #  `window` and `commit` are counted in measurement layers (syndrome
+    #  rounds for the circuits of surface_code.py). `margin` is the number of
+    #  REPEAT iterations kept between a bulk window and either end of the
+    #  truncated circuit; it must cover the reach of one error in rounds.
+
+    def __init__(self, circuit, window, commit, margin=2):
+        if not 0 < commit < window:
+            raise ValueError(f"need 0 < commit < window, got commit={commit}, window={window}")
+        circuit = as_circuit(circuit)
+        self.window = window
+        self.commit = commit
+        self.num_detectors = circuit.num_detectors
+        self.num_observables = circuit.num_observables
+
+        # keep `kept` iterations of the longest REPEAT block; iterations beyond
+        #  those move later windows by `layer_step` layers and `detector_step`
+        #  detectors each
+        position = longest_repeat(circuit)
+        self.skipped = 0
+        self.layer_step = self.detector_step = 0
+        if position is not None:
+            block = circuit[position]
+            body = block.body_copy().flattened()
+            self.layer_step = sum(1 for instruction in body if instruction.num_measurements)
+            self.detector_step = body.num_detectors
+            self.first_layer = sum(1 for instruction in circuit[:position].flattened()
+                                   if instruction.num_measurements)
+            self.margin = margin
+            if self.layer_step:
+                self.kept = 2*margin + 2 + -(-window // self.layer_step)
+                if block.repeat_count > self.kept:
+                    self.skipped = block.repeat_count - self.kept
+                    circuit = with_repeat_count(circuit, position, self.kept)
+
+        # detectors of the truncated circuit are handled in layer order
+        layers = detector_layers(circuit)
+        self.order = np.argsort(layers, kind="stable")
+        self.layers = layers[self.order]
+        rank = np.empty_like(self.order)
+        rank[self.order] = np.arange(len(self.order))
+
+        # graphlike components with detectors renumbered in layer order, sorted
+        #  by their first detector
+        rank = rank.tolist()
+        components = [(sorted(rank[d] for d in detectors), observables, p)
+                      for detectors, observables, p in dem_components(
+                          circuit.detector_error_model(decompose_errors=True))]
+        components.sort(key=lambda c: c[0][0])
+        self.components = components
+        self.component_first = np.array([c[0][0] for c in components], dtype=np.int64)
+
+        self.matchers = {}
+        self.plans = {}
+
+    @property
+    def num_layers(self):
+        truncated = int(self.layers[-1]) + 1 if len(self.layers) else 0
+        return truncated + self.skipped*self.layer_step
+
+    def windows(self):
+        # Yields the WindowPlan of every window of the full circuit in decoding
+        #  order. Each is a cached window of the truncated circuit, moved.
+        num_layers = self.num_layers
+        start = int(self.layers[0]) if len(self.layers) else 0
+        while True:
+            end = min(start + self.window, num_layers)
+            last = end == num_layers
+            commit_end = num_layers if last else start + self.commit
+            steps = self.shift(start, end)
+            moved = steps*self.layer_step
+            key = (start - moved, end - moved, commit_end - moved)
+            if key not in self.plans:
+                self.plans[key] = self.make_plan(*key)
+            yield self.plans[key].shifted(steps*self.detector_step)
+            if last:
+                return
+            start += self.commit
+
+    def shift(self, start, end):
+        # Number of skipped iterations between window [start, end) of the full
+        #  circuit and its copy in the truncated circuit.
+        if not self.skipped:
+            return 0
+        step = self.layer_step
+        bulk = self.first_layer + self.margin*step
+        if end <= self.first_layer + (self.kept - self.margin)*step:
+            return 0 # next to the start: the circuits agree there
+        if start >= bulk + self.skipped*step:
+            return self.skipped # next to the end
+        return (start - bulk) // step
+
+    def make_plan(self, start, end, commit_end):
+        lo, hi = np.searchsorted(self.layers, [start, end])
+        commit_hi = np.searchsorted(self.layers, commit_end)
+        # components starting inside the window; the ones reaching back into
+        #  earlier layers were decided (and committed) by the previous window
+        a, b = np.searchsorted(self.component_first, [lo, hi])
+        flips = {}
+        lines = []
+        for dets, obs, p in self.components[a:b]:
+            targets = [f"D{d - lo}" for d in dets if d < hi]
+            if dets[0] < commit_hi:
+                targets += [f"L{k}" for k in obs]
+                for d in dets:
+                    if d >= commit_hi:
+                        fault = flips.setdefault(d, self.num_observables + len(flips))
+                        targets.append(f"L{fault}")
+            lines.append(f"error({p!r}) {' '.join(targets)}")
+        lines.append(f"detector D{hi - lo - 1}")
+        flip_detectors = np.array(sorted(flips, key=flips.get), dtype=np.int64)
+        key = ("\n".join(lines), tuple((flip_detectors - lo).tolist()))
+        if key not in self.matchers:
+            self.matchers[key] = pymatching.Matching.from_detector_error_model(
+                stim.DetectorErrorModel(key[0]))
+        return WindowPlan(self.order[lo:hi], self.order[flip_detectors.astype(np.intp)],
+                          int(commit_hi - lo), key)
+
+    @property
+    def num_matchers(self):
+        return len(self.matchers)
+
+    def start(self, num_shots):
+        return WindowState(num_shots, self.num_observables)
+
+    def decode_window(self, state, window, events):
+        # Decodes one window of a batch. `events` holds the detection events
+        #  of window.detectors, one row per shot; the carried toggles are
+        #  applied to a copy.
+        syndrome = np.array(events, dtype=np.uint8)
+        for i, d in enumerate(window.detectors.tolist()):
+            if d in state.carried:
+                syndrome[:, i] ^= state.carried[d]
+        faults = self.matchers[window.key].decode_batch(syndrome)
+        width = self.num_observables + len(window.flips)
+        if faults.shape[1] < width:
+            faults = np.pad(faults, ((0, 0), (0, width - faults.shape[1])))
+        state.predictions ^= faults[:, :self.num_observables]
+        for k, d in enumerate(window.flips.tolist()):
+            column = faults[:, self.num_observables + k]
+            state.carried[d] = state.carried[d] ^ column if d in state.carried else column.copy()
+        # committed detectors are never decoded again
+        for d in window.detectors[:window.committed].tolist():
+            state.carried.pop(d, None)
+
+    def decode_batch(self, shots, bit_packed_shots=False, bit_packed_predictions=False):
+        # Every shot's detectors at once, read window by window.
+        shots = np.asarray(shots)
+        state = self.start(len(shots))
+        for window in self.windows():
+            if bit_packed_shots:
+                events = (shots[:, window.detectors >> 3] >> (window.detectors & 7).astype(np.uint8)) & 1
+            else:
+                events = shots[:, window.detectors]
+            self.decode_window(state, window, events)
+        if bit_packed_predictions:
+            return np.packbits(state.predictions, axis=1, bitorder="little")
+        return state.predictions
@@ -1,37 +1,26 @@
+import functools
+
+import stim
+
+from .lattice import coords_view, patch_lattice, data_coords2, x_measure_coords2, z_measure_coords2
+
 # ============================
 # Provided utility functions
 
 def data_coords(distance, idx):
     # Returns coordinate pairs from (1,1) to (distance,distance).
-    coords = []
-    for row in range(1, distance+1):
-        for col in range(1, distance+1):
-            coords.append((col+idx*distance, row+idx*distance))
-    return coords
+    # A tuple view of lattice.data_coords2, which works on doubled integers.
+    return coords_view(data_coords2(distance, idx))
 
 def z_measure_coords(distance, idx):
     # Returns coordinate pairs for Z measure qubits, offset from
     #  the data qubits by 0.5.
-    coords = []
-    for row in range(1, distance): # don't include the last row
-        for col in range(1, distance+1, 2): # only take every other qubit
-            if row%2: 
-                coords.append((col-0.5+idx*distance, row+0.5+idx*distance))
-            else:
-                coords.append((col+0.5+idx*distance, row+0.5+idx*distance))
-    return coords
+    return coords_view(z_measure_coords2(distance, idx))
 
 def x_measure_coords(distance, idx):
     # Returns coordinate pairs for X measure qubits, offset from
     #  the data qubits by 0.5 and opposite the Y measure qubits.
-    coords = []
-    for row in range(1, distance+2): # include extra for last row measures
-        for col in range(2, distance, 2): # start from second column, ignore last
-            if row%2:
-                coords.append((col+0.5+idx*distance, row-0.5+idx*distance))
-            else:
-                coords.append((col-0.5+idx*distance, row-0.5+idx*distance))
-    return coords
+    return coords_view(x_measure_coords2(distance, idx))
 
 def coords_to_index(coords, distance, idx):
     # Inverts a list of coordinates into a dict that maps the coord 
@@ -67,11 +56,9 @@ def prepare_coords(distance, idx):
 def coord_circuit(distance, idx):
     # Returns a Stim circuit string that adds a QUBIT_COORDS instruction for each
     #  qubit, based on the coordinate-to-index mapping.
-    _, _, _, c2i = prepare_coords(distance, idx)
-    stim_circuit = ""
-    for coord, index in c2i.items():
-        stim_circuit += f"QUBIT_COORDS({','.join(map(str, coord))}) {index}\n"
-    return stim_circuit # this is a string
+    circuit = stim.Circuit()
+    append_coord_circuit(circuit, distance, idx)
+    return circuit_text(circuit) # this is a string
 
 def label_indices(distance, idx):
     # Returns a Stim circuit string that labels each of the qubits with their 
@@ -101,226 +88,325 @@ def label_indices(distance, idx):
 
 # ======================================================
 # hidden answer functions
+#
+# The `append_*` builders add each step of the experiment to a stim.Circuit
+#  from the integer target tuples of a cached PatchLayout. stim's
+#  Circuit.append converts Python targets one at a time, which with stim 1.16
+#  costs tens of microseconds per target, so a step is still handed to stim
+#  as program text: the target tuples are formatted once per process
+#  (`targets_text`) and every step is parsed in a single call. The
+#  text-producing functions are thin wrappers around the builders, kept for
+#  the notebooks that concatenate circuit strings.
+
+def circuit_text(circuit):
+    # Returns a circuit as a newline-terminated string, so that fragments can
+    #  still be concatenated with `+` before being parsed by stim.Circuit.
+    return str(circuit) + "\n"
+
+def indices(coord_list, c2i):
+    # Returns the indices for each coord in a list, as stim integer targets.
+    return [c2i[coord] for coord in coord_list]
+
+@functools.lru_cache(maxsize=4096)
+def targets_text(targets):
+    # Space-separated integer targets. The layouts share their target tuples,
+    #  so each one is formatted once and then only looked up.
+    return " ".join(map(str, targets))
+
+def instruction_text(name, targets=(), arg=None):
+    # One line of program text for an instruction with integer qubit targets.
+    head = name if arg is None else f"{name}({arg})"
+    return f"{head} {targets_text(tuple(targets))}" if len(targets) else head
+
+def detector_text(recs, coords):
+    # A DETECTOR over the given (negative) measurement record offsets.
+    return f"DETECTOR({', '.join(map(str, coords))}) {' '.join(f'rec[{r}]' for r in recs)}"
+
+def append_lines(circuit, lines):
+    # Appends instruction lines to a stim.Circuit with one call to the parser.
+    circuit.append_from_stim_program_text("\n".join(lines))
+
+def append_instruction(circuit, name, targets=(), arg=None):
+    # Appends one instruction with integer qubit targets to a stim.Circuit.
+    circuit.append_from_stim_program_text(instruction_text(name, targets, arg))
+
+def append_detector(circuit, recs, coords):
+    # Appends a DETECTOR over the given (negative) measurement record offsets.
+    circuit.append_from_stim_program_text(detector_text(recs, coords))
+
+def append_observable(circuit, recs, index):
+    # Appends an OBSERVABLE_INCLUDE over the given measurement record offsets.
+    circuit.append_from_stim_program_text(
+        f"OBSERVABLE_INCLUDE({index}) {' '.join(f'rec[{r}]' for r in recs)}")
 
-def lattice_with_noise(distance, idx, p):
-    datas, x_measures, z_measures, c2i = prepare_coords(distance, idx)
-
-    stim_string = ""
-    for i in range(4):
-        cx_qubits = []
-        for measure in z_measures:
-            z_controls = adjacent_coords(measure)
-            control = z_controls[i]
-            if control in c2i:
-                cx_qubits.extend([control, measure])
-        
-        for measure in x_measures:
-            x_targets = adjacent_coords(measure)
-            index_reorder = [0, 2, 1, 3]
-            target = x_targets[index_reorder[i]]
-            if target in c2i:
-                cx_qubits.extend([measure, target]) # flipped order!
-        
-        idle_qubits = [coord for coord in c2i.keys() if coord not in cx_qubits]
-        #After constructing the CNOT gates for the current step, 
-        # the function identifies idle qubits (qubits that are not involved in CNOT gates during this step).
-        #Noise will be applied to these idle qubits to simulate realistic circuit-level errors.
-        
-        stim_string += f"""
-        CX {index_string(cx_qubits, c2i)} # give the qubit coor and return the index in c2i
-        DEPOLARIZE2({p}) {index_string(cx_qubits, c2i)} # Adds 2-qubit depolarizing noise with probability p to each pair of qubits involved in the CNOT gates.
-        DEPOLARIZE1({p}) {index_string(idle_qubits, c2i)} # Adds 1-qubit depolarizing noise with probability p to the idle qubits.
-        TICK
-        """
-
-    return stim_string
-
-
-def stabilizers_with_noise(distance, idx, p):
-    datas, x_measures, z_measures, c2i = prepare_coords(distance, idx)
-    all_measures = x_measures + z_measures
-    all_qubits = datas + all_measures
-    
-    stim_string = f"""
-    R {index_string(all_measures, c2i)}
-    X_ERROR({p}) {index_string(all_measures, c2i)}
-    DEPOLARIZE1({p}) {index_string(datas, c2i)}
-    TICK
-    H {index_string(x_measures, c2i)}
-    DEPOLARIZE1({p}) {index_string(all_qubits, c2i)}
-    TICK
-    """
-
-    stim_string += lattice_with_noise(distance, idx, p)
-
-    stim_string += f"""
-    H {index_string(x_measures, c2i)}
-    DEPOLARIZE1({p}) {index_string(all_qubits, c2i)}
-    TICK
-    X_ERROR({p}) {index_string(all_measures, c2i)}
-    DEPOLARIZE1({p}) {index_string(datas, c2i)}
-    MR {index_string(all_measures, c2i)}
-    TICK
-    """
-    
-    return stim_string
-
-def initialization_step(distance, idx, p, initial):
-    datas, x_measures, z_measures, c2i = prepare_coords(distance, idx)
-    all_measures = x_measures + z_measures #先x_stabilizer再z_stabilizer
-    all_qubits = datas + all_measures
+# ======================================================
+# precomputed patch layout
+#
+# Everything the builders need for one patch is computed once per
+#  (distance, idx) and shared through an LRU cache, so building a circuit is
+#  only a walk over the precomputed target tuples.
+
+class PatchLayout:
+    # Qubit index tuples, the four-layer CX schedule and the detector record
+    #  offsets for one surface code patch, computed from the integer-lattice
+    #  backend (lattice.patch_lattice). Instances are shared through
+    #  `patch_layout`, so treat every attribute as read-only.
+
+    def __init__(self, distance, idx):
+        lattice = patch_lattice(distance, idx)
+        self.distance = distance
+        self.idx = idx
+        self.lattice = lattice
+
+        self.data_targets = tuple(lattice.data_idx.tolist())
+        self.x_targets = tuple(lattice.x_idx.tolist())
+        self.z_targets = tuple(lattice.z_idx.tolist())
+        self.measure_targets = self.x_targets + self.z_targets #先x_stabilizer再z_stabilizer
+        self.all_targets = self.data_targets + self.measure_targets
+
+        # CX pairs (control, target, control, target, ...) and idle qubits for
+        #  each of the four layers.
+        self.cx_layers = [tuple(layer.tolist()) for layer in lattice.cx_layers]
+        self.idle_layers = [tuple(layer.tolist()) for layer in lattice.idle_layers]
+
+        n = len(self.z_targets) # number of measures per type per round
+        self.num_measures_per_type = n
+
+        # measure-qubit coordinates of each stabilizer, used as the space part
+        #  of the detector coordinates (x, y, t, patch)
+        self.stabilizer_coords = {"X": coords_view(lattice.x2), "Z": coords_view(lattice.z2)}
+
+        # first round: only the stabilizers that are deterministic for the
+        #  initial state get a detector.
+        self.first_round_recs = {
+            "0": [[-i] for i in range(1, n+1)],
+            "+": [[-i-n] for i in range(1, n+1)], # record x_measures (X stabilizer)
+        }
+        # (basis, stabilizer) of each of those detectors; rec[-i] is stabilizer n-i
+        self.first_round_stabilizers = {
+            "0": [("Z", n-i) for i in range(1, n+1)],
+            "+": [("X", n-i) for i in range(1, n+1)],
+        }
+
+        # middle and final rounds: compare each measure with the previous round,
+        #  skipping over the data measurements in the final round.
+        def previous_round_recs(gap):
+            recs = [[-i, -(i+2*n+gap)] for i in range(1, n+1)]
+            recs += [[-(i+n), -(i+3*n+gap)] for i in range(1, n+1)]
+            return recs
+        self.round_recs = previous_round_recs(0)
+        self.final_round_recs = previous_round_recs(len(self.data_targets))
+        self.round_stabilizers = ([("Z", n-i) for i in range(1, n+1)]
+                                  + [("X", n-i) for i in range(1, n+1)])
+
+        # final data measurements: each stabilizer of the measured basis with
+        #  its adjacent data qubits, plus the logical observable.
+        self.final_data_recs = {
+            "0": lattice.stabilizer_records("Z"),
+            "+": lattice.stabilizer_records("X"),
+        }
+        self.final_data_stabilizers = {
+            "0": [("Z", j) for j in range(n)],
+            "+": [("X", j) for j in range(n)],
+        }
+        self.observable_recs = {
+            "0": [-(i+2*n) for i in range(1, distance+1)], # dot product of a row
+            "+": [-(i*distance+1+2*n) for i in range(distance)], # dot product of a col of data qubit lattice
+        }
+
+    def detector_coords(self, stabilizer, t):
+        # Detector coordinates (x, y, t, patch) of a (basis, index) stabilizer.
+        basis, j = stabilizer
+        x, y = self.stabilizer_coords[basis][j]
+        return [x, y, t, self.idx]
+
+    @functools.cached_property
+    def c2i(self):
+        # Coordinate-to-index mapping of the tuple API, only built on demand.
+        return dict(zip(coords_view(self.lattice.coords2), self.all_targets))
+
+@functools.lru_cache(maxsize=64)
+def patch_layout(distance, idx):
+    # Returns the shared PatchLayout for (distance, idx). Bounded LRU cache:
+    #  `patch_layout.cache_info()` reports hits and misses across a sweep,
+    #  `patch_layout.cache_clear()` empties it.
+    return PatchLayout(distance, idx)
 
-    stim_string = f"""
-    R {index_string(all_measures, c2i)}
-    """    
+# ======================================================
+# circuit builders
+
+def append_coord_circuit(circuit, distance, idx):
+    # Appends a QUBIT_COORDS instruction for each qubit.
+    layout = patch_layout(distance, idx)
+    append_lines(circuit, (f"QUBIT_COORDS({','.join(map(str, coord))}) {index}"
+                           for coord, index in layout.c2i.items()))
+
+def cx_layer_lines(layout, p):
+    # The four noisy CX layers of any layout with `cx_layers` and
+    #  `idle_layers` (a PatchLayout or a multi-patch layout).
+    # Qubits that are not involved in CNOT gates during a step get 1-qubit
+    #  depolarizing noise to simulate realistic circuit-level errors.
+    lines = []
+    for cx_targets, idle_targets in zip(layout.cx_layers, layout.idle_layers):
+        lines += [instruction_text("CX", cx_targets),
+                  instruction_text("DEPOLARIZE2", cx_targets, p),
+                  instruction_text("DEPOLARIZE1", idle_targets, p),
+                  "TICK"]
+    return lines
+
+def syndrome_round_lines(layout, p):
+    # One noisy round of stabilizer measurements (no detectors) for any layout
+    #  with data/x/measure/all target tuples and CX layers.
+    return [
+        instruction_text("R", layout.measure_targets),
+        instruction_text("X_ERROR", layout.measure_targets, p),
+        instruction_text("DEPOLARIZE1", layout.data_targets, p),
+        "TICK",
+        instruction_text("H", layout.x_targets),
+        instruction_text("DEPOLARIZE1", layout.all_targets, p),
+        "TICK",
+        *cx_layer_lines(layout, p),
+        instruction_text("H", layout.x_targets),
+        instruction_text("DEPOLARIZE1", layout.all_targets, p),
+        "TICK",
+        instruction_text("X_ERROR", layout.measure_targets, p),
+        instruction_text("DEPOLARIZE1", layout.data_targets, p),
+        instruction_text("MR", layout.measure_targets),
+        "TICK",
+    ]
+
+def append_cx_layers(circuit, layout, p):
+    append_lines(circuit, cx_layer_lines(layout, p))
+
+def append_syndrome_round(circuit, layout, p):
+    append_lines(circuit, syndrome_round_lines(layout, p))
+
+def append_lattice_with_noise(circuit, distance, idx, p):
+    append_cx_layers(circuit, patch_layout(distance, idx), p)
+
+def append_stabilizers_with_noise(circuit, distance, idx, p):
+    append_syndrome_round(circuit, patch_layout(distance, idx), p)
+
+def append_initialization_step(circuit, distance, idx, p, initial):
+    layout = patch_layout(distance, idx)
+
+    lines = [instruction_text("R", layout.measure_targets)]
     if initial == "0":
-        stim_string += f"""
-        R {index_string(datas, c2i)} 
-        """   
+        lines.append(instruction_text("R", layout.data_targets))
     elif initial == "+":
-        stim_string += f"""
-        RX {index_string(datas, c2i)} 
-        """ 
-    stim_string += f"""
-    X_ERROR({p}) {index_string(all_qubits, c2i)} # all_qubits: different from the stabilizers_with_noise
-    TICK
-    H {index_string(x_measures, c2i)}
-    DEPOLARIZE1({p}) {index_string(all_qubits, c2i)}
-    TICK
-    """
-        
-
-
-    stim_string += lattice_with_noise(distance, idx, p)
-
-    stim_string += f"""
-    H {index_string(x_measures, c2i)}
-    DEPOLARIZE1({p}) {index_string(all_qubits, c2i)}
-    TICK
-    X_ERROR({p}) {index_string(all_measures, c2i)}
-    MR {index_string(all_measures, c2i)} # 先measure 再加error  #先x_stabilizer再z_stabilizer
-    DEPOLARIZE1({p}) {index_string(datas, c2i)} # 先measure 再加error
-    TICK
-    """
-    # if initial == "+": we should use the detector to record the X_measures and that is rec[{-i-len(z_measures)}]
+        lines.append(instruction_text("RX", layout.data_targets))
+    lines += [
+        instruction_text("X_ERROR", layout.all_targets, p), # all_qubits: different from the stabilizers_with_noise
+        "TICK",
+        instruction_text("H", layout.x_targets),
+        instruction_text("DEPOLARIZE1", layout.all_targets, p),
+        "TICK",
+        *cx_layer_lines(layout, p),
+        instruction_text("H", layout.x_targets),
+        instruction_text("DEPOLARIZE1", layout.all_targets, p),
+        "TICK",
+        instruction_text("X_ERROR", layout.measure_targets, p),
+        instruction_text("MR", layout.measure_targets), # 先measure 再加error  #先x_stabilizer再z_stabilizer
+        instruction_text("DEPOLARIZE1", layout.data_targets, p), # 先measure 再加error
+        "TICK",
+    ]
+
+    # if initial == "+": we should use the detector to record the X_measures
+    for recs, stabilizer in zip(layout.first_round_recs.get(initial, []),
+                                layout.first_round_stabilizers.get(initial, [])):
+        lines.append(detector_text(recs, layout.detector_coords(stabilizer, 0))) #rec[-1] means the lastest measurement
+    # every round advances the time coordinate of the detectors by one
+    lines.append("SHIFT_COORDS(0, 0, 1)")
+    append_lines(circuit, lines)
+
+def append_rounds_step(circuit, distance, idx, rounds, p):
+    if rounds <= 2:
+        return
+    layout = patch_layout(distance, idx)
+
+    lines = syndrome_round_lines(layout, p)
+    # offset to the previous round, then to the other type and the previous round
+    for recs, stabilizer in zip(layout.round_recs, layout.round_stabilizers):
+        lines.append(detector_text(recs, layout.detector_coords(stabilizer, 0)))
+    lines.append("SHIFT_COORDS(0, 0, 1)")
+    body = stim.Circuit()
+    append_lines(body, lines)
+
+    circuit.append(stim.CircuitRepeatBlock(rounds-2, body))
+
+def append_final_step(circuit, distance, idx, p, initial):
+    layout = patch_layout(distance, idx)
+
+    lines = [
+        instruction_text("R", layout.measure_targets),
+        instruction_text("X_ERROR", layout.measure_targets, p),
+        instruction_text("DEPOLARIZE1", layout.data_targets, p),
+        "TICK",
+        instruction_text("H", layout.x_targets),
+        instruction_text("DEPOLARIZE1", layout.all_targets, p),
+        "TICK",
+        *cx_layer_lines(layout, p),
+        instruction_text("H", layout.x_targets),
+        instruction_text("DEPOLARIZE1", layout.all_targets, p),
+        "TICK",
+        instruction_text("X_ERROR", layout.all_targets, p),
+    ]
     if initial == "0":
-        for i in range(1, len(z_measures)+1):
-            stim_string += f"DETECTOR({i}, 0) rec[{-i}]\n"  #rec[-1] means the lastest measurement
-            # DETECTPR({i},0) is the coordinate of the detector
-            
+        lines.append(instruction_text("MR", layout.all_targets))
     elif initial == "+":
-        for i in range(1, len(z_measures)+1):
-            stim_string += f"DETECTOR({i}, 0) rec[{-i-len(z_measures)}]\n" # record x_measures (X stabilizer)
-            
-    return stim_string
+        lines.append(instruction_text("MX", layout.data_targets)) #先datas再all_measures
+        lines.append(instruction_text("MR", layout.measure_targets))
+
+    # remember measure order is datas, x_measures, z_measures
+    # do previous-round detectors first
+    for recs, stabilizer in zip(layout.final_round_recs, layout.round_stabilizers):
+        lines.append(detector_text(recs, layout.detector_coords(stabilizer, 0)))
 
+    # now the confusing one: the final data measurements and their adjacent measure measurements
+    #  (one time step after the final round)
+    if initial in layout.final_data_recs:
+        for recs, stabilizer in zip(layout.final_data_recs[initial], layout.final_data_stabilizers[initial]):
+            lines.append(detector_text(recs, layout.detector_coords(stabilizer, 1)))
+        lines.append(f"OBSERVABLE_INCLUDE(0) {' '.join(f'rec[{r}]' for r in layout.observable_recs[initial])}")
+    append_lines(circuit, lines)
+
+def surface_code_circuit(distance, idx, rounds, p, initial):
+    # Returns the full memory experiment as a stim.Circuit, built step by step
+    #  from the cached layout instead of through one big concatenated string.
+    circuit = stim.Circuit()
+    append_coord_circuit(circuit, distance, idx)
+    append_initialization_step(circuit, distance, idx, p, initial)
+    append_rounds_step(circuit, distance, idx, rounds, p)
+    append_final_step(circuit, distance, idx, p, initial)
+    return circuit
 
+# ======================================================
+# text wrappers used by the notebooks
 
-def rounds_step(distance, idx, rounds, p):
-    if rounds <= 2:
-        return "\n"
-    datas, x_measures, z_measures, c2i = prepare_coords(distance, idx)
+def lattice_with_noise(distance, idx, p):
+    circuit = stim.Circuit()
+    append_lattice_with_noise(circuit, distance, idx, p)
+    return circuit_text(circuit)
 
-    stim_string = f"REPEAT {rounds-2} {{\n"
-    stim_string += stabilizers_with_noise(distance, idx, p)
+def stabilizers_with_noise(distance, idx, p):
+    circuit = stim.Circuit()
+    append_stabilizers_with_noise(circuit, distance, idx, p)
+    return circuit_text(circuit)
 
-    num_measures_per_type = len(z_measures) # number of measures per type per round
-    for i in range(1, num_measures_per_type+1): # offset to the previous round
-        stim_string += f"DETECTOR({i}, 0) rec[{-i}] rec[{-(i+2*num_measures_per_type)}]\n"
-    for i in range(1, num_measures_per_type+1): # offset to the other type and to the previous round
-        stim_string += f"DETECTOR({i}, 0) rec[{-(i+num_measures_per_type)}] rec[{-(i+3*num_measures_per_type)}]\n"
-        
-    stim_string += """
-    }
-    """ # end repeat block
+def initialization_step(distance, idx, p, initial):
+    circuit = stim.Circuit()
+    append_initialization_step(circuit, distance, idx, p, initial)
+    return circuit_text(circuit)
 
-    return stim_string
-  
+def rounds_step(distance, idx, rounds, p):
+    circuit = stim.Circuit()
+    append_rounds_step(circuit, distance, idx, rounds, p)
+    return circuit_text(circuit)
 
-  
 def final_step(distance, idx, p, initial):
-    datas, x_measures, z_measures, c2i = prepare_coords(distance, idx)
-    all_measures = x_measures + z_measures
-    all_qubits = datas + all_measures
-
-    stim_string = f"""
-    R {index_string(all_measures, c2i)}
-    X_ERROR({p}) {index_string(all_measures, c2i)}
-    DEPOLARIZE1({p}) {index_string(datas, c2i)}
-    TICK
-    H {index_string(x_measures, c2i)}
-    DEPOLARIZE1({p}) {index_string(all_qubits, c2i)}
-    TICK
-    """
-
-    stim_string += lattice_with_noise(distance, idx, p)
-
-
-    stim_string += f"""
-    H {index_string(x_measures, c2i)}   
-    DEPOLARIZE1({p}) {index_string(all_qubits, c2i)}
-    TICK
-    X_ERROR({p}) {index_string(all_qubits, c2i)}
-    """
-    if initial == "0":
-        stim_string += f"""
-        MR {index_string(all_qubits, c2i)}
-        """
-    elif initial == "+":
-        stim_string += f"""
-        MX {index_string(datas, c2i)} #先datas再all_measures
-        MR {index_string(all_measures, c2i)}
-        """
-    # remember measure order is datas, x_measures, z_measures
-    # do previous-round detectors first
-    num_measures_per_type = len(z_measures) # number of measures per type per round
-    num_datas = len(datas)
-    for i in range(1, num_measures_per_type+1): # offset to the previous round
-        stim_string += f"DETECTOR({i}, 0) rec[{-i}] rec[{-(i+2*num_measures_per_type+num_datas)}]\n"
-    for i in range(1, num_measures_per_type+1): # offset to the other type and to the previous round
-        stim_string += f"DETECTOR({i}, 0) rec[{-(i+num_measures_per_type)}] rec[{-(i+3*num_measures_per_type+num_datas)}]\n"
-    
-    # now the confusing one: the final data measurements and their adjacent measure measurements
-    # create a dict that maps each coord to the record index of the most recent measurement on it
-    if initial == "0":
-        coord_to_record_index = {coord: i-len(all_qubits) for i, coord in enumerate(all_qubits)}
-        for i, measure in enumerate(z_measures):
-            record_indices = []
-            record_indices.append(coord_to_record_index[measure])
-            adjacent_datas = adjacent_coords(measure)
-            
-            for data in adjacent_datas:
-                if data in all_qubits:
-                    record_indices.append(coord_to_record_index[data])
-            recs = [f"rec[{j}]" for j in record_indices]
-            stim_string += f"DETECTOR({i}, 0) {' '.join(recs)}\n"  # record measurements surrounding the Z stabilizer
-
-        obs_recs = [f"rec[{-(i+2*num_measures_per_type)}]" for i in range(1, distance+1)]
-        stim_string += f"OBSERVABLE_INCLUDE(0) {' '.join(obs_recs)}" #  dot product of a row
-        
-        
-    elif initial == "+":
-        coord_to_record_index = {coord: i-len(all_qubits) for i, coord in enumerate(all_qubits)}
-        for i, measure in enumerate(x_measures):
-            record_indices = []
-            record_indices.append(coord_to_record_index[measure])
-            adjacent_datas = adjacent_coords(measure)
-            
-            for data in adjacent_datas:
-                if data in all_qubits:
-                    record_indices.append(coord_to_record_index[data])
-            recs = [f"rec[{j}]" for j in record_indices]
-            stim_string += f"DETECTOR({i}, 0) {' '.join(recs)}\n" # record measurements surrounding the X stabilizer
-
-        obs_recs = [f"rec[{-(i*distance+1+2*num_measures_per_type)}]" for i in range(distance)]
-        stim_string += f"OBSERVABLE_INCLUDE(0) {' '.join(obs_recs)}" #  dot product of a col of data qubit lattice
-
-    return stim_string
+    circuit = stim.Circuit()
+    append_final_step(circuit, distance, idx, p, initial)
+    return circuit_text(circuit)
 
 def surface_code_circuit_string(distance, idx, rounds, p, initial):
-    string = coord_circuit(distance, idx)
-    string += initialization_step(distance, idx, p, initial)
-    string += rounds_step(distance, idx, rounds, p)
-    string += final_step(distance, idx, p, initial)
-    return string
-
+    return circuit_text(surface_code_circuit(distance, idx, rounds, p, initial))
@@ -0,0 +1,176 @@
+# ============================
+# Checkpointed, resumable sweep runner
+#
+# Headless replacement for the notebook's sinter threshold sweep, over the
+#  project's own memory circuits. A sweep is a grid of points
+#  (distance, rounds, p, initial, idx); every point is sampled in batches
+#  spread over a process pool. Each worker keeps the compiled sampler and
+#  matcher of every point it has seen, so a point is only compiled once per
+#  worker.
+#
+# After every finished batch one JSON line (point, shots, failures) is
+#  appended to the checkpoint file and flushed to disk. Restarting with the
+#  same checkpoint adds up the recorded batches and only schedules the
+#  shots (and errors) still missing, so an interrupted sweep resumes where
+#  it stopped and finished shots are never sampled again.
+#
+# Run from the CODE directory:
+#   python -m Surface_Code_Google.sweep --distances 3 5 7 9 --ps 0.001 0.002 0.003 \
+#       --checkpoint sweep.jsonl --max-shots 1000000 --max-errors 1000
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+
+import numpy as np
+
+from .evaluation import FailureCounts, count_failures, decode, matcher_for
+from .noise_template import memory_circuit
+
+DEFAULT_BATCH_SIZE = 10_000
+
+
+def point_key(point):
+    # Canonical string of a grid point, used as its key in the checkpoint.
+    return json.dumps(point, sort_keys=True)
+
+def sweep_grid(distances, ps, rounds=None, rounds_per_distance=3, initials=("0",), idxs=(0,)):
+    # Grid points as dicts. `rounds` is a list of round counts, or None for
+    #  rounds_per_distance*distance rounds at each distance.
+    points = []
+    for d, p, initial, idx in itertools.product(distances, ps, initials, idxs):
+        for r in (rounds if rounds is not None else [rounds_per_distance*d]):
+            points.append({"distance": d, "rounds": r, "p": p, "initial": initial, "idx": idx})
+    return points
+
+# ======================================================
+# checkpoint
+
+def load_checkpoint(path):
+    # Sums the recorded batches of every point: key -> FailureCounts. A
+    #  truncated last line (the process died while writing it) is ignored.
+    totals = {}
+    if not os.path.exists(path):
+        return totals
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            counts = FailureCounts(record["shots"], record["per_observable"], record["errors"])
+            key = point_key(record["point"])
+            totals[key] = totals[key] + counts if key in totals else counts
+    return totals
+
+def append_checkpoint(f, point, counts):
+    f.write(json.dumps({"point": point, "shots": counts.shots, "errors": counts.any_errors,
+                        "per_observable": counts.per_observable.tolist()}) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+# ======================================================
+# worker
+
+# Per-process cache of compiled samplers and matchers, by point key.
+worker_state = {}
+
+def compiled_point(point):
+    key = point_key(point)
+    if key not in worker_state:
+        circuit = memory_circuit(point["distance"], point["idx"], point["rounds"], point["p"], point["initial"])
+        worker_state[key] = (circuit.compile_detector_sampler(), matcher_for(circuit), circuit.num_observables)
+    return worker_state[key]
+
+def run_batch(point, shots):
+    # Samples and decodes one batch of a point in a worker process.
+    sampler, matcher, num_observables = compiled_point(point)
+    detection_events, observable_flips = sampler.sample(shots, separate_observables=True, bit_packed=True)
+    return count_failures(decode(matcher, detection_events), observable_flips, num_observables)
+
+# ======================================================
+# runner
+
+def remaining_shots(counts, max_shots, max_errors):
+    if counts is None:
+        return max_shots
+    if max_errors is not None and counts.any_errors >= max_errors:
+        return 0
+    return max(max_shots - counts.shots, 0)
+
+def run_sweep(points, checkpoint, max_shots, max_errors=None, batch_size=DEFAULT_BATCH_SIZE,
+              workers=None, progress=print):
+    # Samples every point until it has `max_shots` shots or `max_errors`
+    #  failing shots, resuming from `checkpoint`. Returns key -> FailureCounts.
+    totals = load_checkpoint(checkpoint)
+    in_flight = collections.Counter() # shots scheduled but not yet recorded, per key
+    workers = workers or os.cpu_count()
+
+    def next_batch(point):
+        key = point_key(point)
+        left = remaining_shots(totals.get(key), max_shots, max_errors) - in_flight[key]
+        return min(batch_size, left)
+
+    with open(checkpoint, "a") as f, concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        pending = {}
+        queue = collections.deque(points)
+        def submit():
+            # keeps about two batches per worker in flight, round-robin over points
+            while len(pending) < 2*workers and queue:
+                point = queue.popleft()
+                shots = next_batch(point)
+                if shots <= 0:
+                    continue
+                in_flight[point_key(point)] += shots
+                pending[pool.submit(run_batch, point, shots)] = (point, shots)
+                queue.append(point)
+
+        submit()
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                point, shots = pending.pop(future)
+                key = point_key(point)
+                counts = future.result()
+                in_flight[key] -= shots
+                append_checkpoint(f, point, counts)
+                totals[key] = totals[key] + counts if key in totals else counts
+                if progress is not None:
+                    total = totals[key]
+                    progress(f"d={point['distance']} rounds={point['rounds']} p={point['p']} "
+                             f"initial={point['initial']} idx={point['idx']}: "
+                             f"{total.any_errors}/{total.shots} failures")
+            submit()
+    return totals
+
+def print_summary(points, totals):
+    print(f"{'d':>4} {'rounds':>7} {'p':>9} {'init':>5} {'idx':>4} {'shots':>10} {'errors':>8} {'rate':>10}")
+    for point in points:
+        counts = totals.get(point_key(point))
+        if counts is None:
+            continue
+        print(f"{point['distance']:>4} {point['rounds']:>7} {point['p']:>9g} {point['initial']:>5} "
+              f"{point['idx']:>4} {counts.shots:>10} {counts.any_errors:>8} {counts.any_rate:>10.3e}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Checkpointed, resumable memory-experiment sweep.")
+    parser.add_argument("--distances", type=int, nargs="+", default=[3, 5, 7, 9])
+    parser.add_argument("--ps", type=float, nargs="+", default=list(np.linspace(0.001, 0.005, 5)))
+    parser.add_argument("--rounds", type=int, nargs="+", default=None,
+                        help="round counts (default: 3*distance)")
+    parser.add_argument("--initials", nargs="+", default=["0"], choices=["0", "+"])
+    parser.add_argument("--idxs", type=int, nargs="+", default=[0])
+    parser.add_argument("--checkpoint", default="sweep.jsonl")
+    parser.add_argument("--max-shots", type=int, default=1_000_000)
+    parser.add_argument("--max-errors", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+    points = sweep_grid(args.distances, [float(p) for p in args.ps], args.rounds,
+                        initials=args.initials, idxs=args.idxs)
+    totals = run_sweep(points, args.checkpoint, args.max_shots, args.max_errors, args.batch_size, args.workers)
+    print_summary(points, totals)
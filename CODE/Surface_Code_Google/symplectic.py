@@ -0,0 +1,195 @@
+# ============================
+# Bit-packed GF(2) and symplectic linear algebra
+#
+# Binary matrices are stored bit-packed: row r, column c is bit c & 63 of
+#  word c >> 6 of packed[r], a (rows, ceil(columns/64)) uint64 array. A row
+#  operation is then one XOR over a handful of words, and elimination runs
+#  column by column with whole-matrix NumPy operations.
+#
+# A Pauli operator on n qubits (up to phase) is its symplectic vector (x|z):
+#  the x bits in the first w = ceil(n/64) words and the z bits in the next
+#  w words. Two Paulis commute iff x.z' + z.x' = 0 mod 2, so questions the
+#  Steane notebook answers by enumerating the 2^r stabilizer group become
+#  rank computations:
+#
+#   stabilizers = paulis_to_symplectic(["XXXXIII", "IXXIXXI", ...])
+#   in_span(stabilizers, paulis_to_symplectic(["XXXXXXX"]))       # membership
+#   equivalent(stabilizers, log_x, log_x_times_stabilizer)        # same logical class
+#   lx, lz = logical_operators(stabilizers, 7)                    # lx[i] lz[j] anticommute iff i == j
+#
+# Signs are not tracked: membership means membership up to a phase.
+
+import numpy as np
+import stim
+
+WORD_BITS = 64
+
+# ======================================================
+# packing
+
+def num_words(num_bits):
+    return (num_bits + WORD_BITS - 1) // WORD_BITS
+
+def pack_rows(bits):
+    # (rows, columns) 0/1 array -> (rows, num_words(columns)) uint64.
+    bits = np.atleast_2d(np.asarray(bits, dtype=np.uint8))
+    width = num_words(bits.shape[1])
+    packed = np.packbits(bits, axis=1, bitorder="little")
+    packed = np.pad(packed, ((0, 0), (0, 8*width - packed.shape[1])))
+    return np.ascontiguousarray(packed).view("<u8").astype(np.uint64)
+
+def unpack_rows(packed, num_bits):
+    # Inverse of pack_rows.
+    packed = np.ascontiguousarray(packed, dtype=np.uint64).astype("<u8")
+    return np.unpackbits(packed.view(np.uint8), axis=1, count=num_bits, bitorder="little")
+
+def column_bits(packed, column):
+    # The bits of one column, as a bool array over the rows.
+    return ((packed[:, column >> 6] >> np.uint64(column & 63)) & np.uint64(1)).astype(bool)
+
+def parity(words):
+    # Parity of the set bits along the last axis.
+    return (np.bitwise_count(words).sum(axis=-1) & 1).astype(np.uint8)
+
+# ======================================================
+# GF(2) linear algebra
+
+def row_reduce(packed, num_bits=None):
+    # Reduced row echelon form over GF(2). Returns (rows, pivots): the
+    #  nonzero rows of the echelon form and the pivot column of each.
+    matrix = np.array(packed, dtype=np.uint64, copy=True)
+    num_bits = matrix.shape[1] * WORD_BITS if num_bits is None else num_bits
+    pivots = []
+    row = 0
+    for column in range(num_bits):
+        if row == len(matrix):
+            break
+        hits = np.flatnonzero(column_bits(matrix[row:], column))
+        if not len(hits):
+            continue
+        pivot = row + hits[0]
+        if pivot != row:
+            matrix[[row, pivot]] = matrix[[pivot, row]]
+        others = column_bits(matrix, column)
+        others[row] = False
+        matrix[others] ^= matrix[row]
+        pivots.append(column)
+        row += 1
+    return matrix[:row], pivots
+
+def rank(packed):
+    return len(row_reduce(packed)[1])
+
+def nullspace(packed, num_bits):
+    # Packed basis of {v : M v = 0}, one vector per row.
+    rows, pivots = row_reduce(packed, num_bits)
+    free = np.setdiff1d(np.arange(num_bits), pivots)
+    basis = np.zeros((len(free), num_bits), dtype=np.uint8)
+    basis[np.arange(len(free)), free] = 1
+    if len(pivots):
+        basis[:, pivots] = unpack_rows(rows, num_bits)[:, free].T
+    return pack_rows(basis) if len(free) else np.zeros((0, num_words(num_bits)), dtype=np.uint64)
+
+def reduce_by(rows, pivots, vectors):
+    # Remainders of `vectors` after eliminating the pivots of a row-reduced
+    #  matrix (rows, pivots): zero exactly for vectors in its span.
+    vectors = np.array(np.atleast_2d(vectors), dtype=np.uint64, copy=True)
+    for row, column in zip(rows, pivots):
+        vectors[column_bits(vectors, column)] ^= row
+    return vectors
+
+def in_span(generators, vectors):
+    # Bool per row of `vectors`: is it a sum of rows of `generators`?
+    rows, pivots = row_reduce(generators)
+    return ~reduce_by(rows, pivots, vectors).any(axis=1)
+
+# ======================================================
+# symplectic vectors and Paulis
+
+def paulis_to_symplectic(paulis, num_qubits=None):
+    # Packed (x|z) rows from stim.PauliString objects or Pauli strings.
+    paulis = [stim.PauliString(p) if isinstance(p, str) else p for p in paulis]
+    num_qubits = max(len(p) for p in paulis) if num_qubits is None else num_qubits
+    xs = np.zeros((len(paulis), num_qubits), dtype=np.uint8)
+    zs = np.zeros((len(paulis), num_qubits), dtype=np.uint8)
+    for k, pauli in enumerate(paulis):
+        x, z = pauli.to_numpy()
+        xs[k, :len(x)], zs[k, :len(z)] = x, z
+    return np.concatenate([pack_rows(xs), pack_rows(zs)], axis=1)
+
+def symplectic_to_paulis(packed, num_qubits):
+    # stim.PauliString objects (sign +) from packed (x|z) rows.
+    w = num_words(num_qubits)
+    xs = unpack_rows(packed[:, :w], num_qubits).astype(bool)
+    zs = unpack_rows(packed[:, w:], num_qubits).astype(bool)
+    return [stim.PauliString.from_numpy(xs=x, zs=z) for x, z in zip(xs, zs)]
+
+def swap_halves(packed):
+    # (x|z) -> (z|x): turns the symplectic form into the ordinary dot product.
+    w = packed.shape[1] // 2
+    return np.concatenate([packed[:, w:], packed[:, :w]], axis=1)
+
+def commutation_matrix(a, b):
+    # (len(a), len(b)) array, 1 where the Paulis anticommute.
+    w = a.shape[1] // 2
+    ax, az = a[:, None, :w], a[:, None, w:]
+    bx, bz = b[None, :, :w], b[None, :, w:]
+    return parity((ax & bz) ^ (az & bx))
+
+def commutes(a, b):
+    return not commutation_matrix(a, b).any()
+
+def packed_bits(num_qubits):
+    # Bit positions of the x and z halves inside a packed (x|z) row.
+    w = num_words(num_qubits)
+    return np.r_[np.arange(num_qubits), w*WORD_BITS + np.arange(num_qubits)]
+
+def centralizer(stabilizers, num_qubits):
+    # Packed basis of every Pauli commuting with all `stabilizers`.
+    bits = packed_bits(num_qubits)
+    w = num_words(num_qubits)
+    dense = unpack_rows(swap_halves(stabilizers), 2*w*WORD_BITS)[:, bits]
+    kernel = unpack_rows(nullspace(pack_rows(dense), 2*num_qubits), 2*num_qubits)
+    full = np.zeros((len(kernel), 2*w*WORD_BITS), dtype=np.uint8)
+    full[:, bits] = kernel
+    return pack_rows(full)
+
+def equivalent(stabilizers, a, b):
+    # Bool per row: do a and b differ by a stabilizer (up to phase)?
+    return in_span(stabilizers, np.atleast_2d(a) ^ np.atleast_2d(b))
+
+def logical_operators(stabilizers, num_qubits):
+    # (lx, lz) packed, k rows each, with lx[i] and lz[j] anticommuting iff
+    #  i == j and all of them commuting with the stabilizers: a symplectic
+    #  basis of centralizer / stabilizer group, by symplectic Gram-Schmidt.
+    if not commutes(stabilizers, stabilizers):
+        raise ValueError("the stabilizers do not commute")
+    rows, pivots = row_reduce(stabilizers)
+    extra = []
+    for vector in centralizer(stabilizers, num_qubits):
+        remainder = reduce_by(rows, pivots, vector)[0]
+        if remainder.any():
+            extra.append(remainder)
+            rows, pivots = row_reduce(np.vstack([rows, remainder[None]]))
+    pool = list(extra)
+    lx, lz = [], []
+    while pool:
+        first = pool.pop(0)
+        products = commutation_matrix(first[None], np.array(pool))[0] if pool else []
+        partner = next((i for i, anticommutes in enumerate(products) if anticommutes), None)
+        if partner is None:
+            raise ValueError("no anticommuting partner for a logical operator")
+        second = pool.pop(partner)
+        lx.append(first)
+        lz.append(second)
+        rest = []
+        for vector in pool:
+            p = commutation_matrix(vector[None], np.array([first, second]))[0]
+            rest.append(vector ^ (second if p[0] else 0) ^ (first if p[1] else 0))
+        pool = rest
+    width = stabilizers.shape[1]
+    return (np.array(lx, dtype=np.uint64).reshape(-1, width), np.array(lz, dtype=np.uint64).reshape(-1, width))
+
+def code_parameters(stabilizers, num_qubits):
+    # (n, k) of the stabilizer code; k = n - rank.
+    return num_qubits, num_qubits - rank(stabilizers)
@@ -0,0 +1,137 @@
+# ============================
+# Syndrome statistics from bit-packed detection events
+#
+# Accumulates, chunk by chunk, the statistics used to check a noise model
+#  against samples (or against hardware data):
+#
+#   - detection fractions <x_i>, per detector, and grouped per round or basis
+#     with the tables of detector_metadata.py;
+#   - the number of detection events per shot (its histogram);
+#   - the pairwise coincidences <x_i x_j> and from them the p_ij matrix, the
+#     probability of an independent error mechanism flipping exactly the
+#     detectors i and j:
+#
+#       p_ij = 1/2 - 1/2 sqrt(1 - 4 (<x_i x_j> - <x_i><x_j>) / (1 - 2<x_i> - 2<x_j> + 4<x_i x_j>))
+#
+# Detection fractions use bit-plane sums over the packed bytes, per-shot
+#  weights use popcount, and <x_i x_j> is one float32 matrix product per
+#  chunk (exact, since a chunk holds fewer than 2**24 shots), so the work
+#  per shot is a BLAS call rather than Python. The p_ij of the model itself
+#  come from its DEM (dem_pair_probabilities), for comparison.
+#
+#   stats = collect_statistics(surface_code_circuit(11, 0, 11, 0.001, "0"), 10**6)
+#   group_fractions(stats.detection_fractions(), memory_detector_table(11, 0, 11, "0"), "round")
+#   stats.pij_matrix()
+
+import numpy as np
+
+from .correlated_decoding import error_components
+from .evaluation import DEFAULT_CHUNK_SIZE, as_circuit, sample_chunks
+
+
+def packed_column_counts(packed, num_bits):
+    # Number of set bits in each of the first `num_bits` columns of a
+    #  little-endian bit-packed array, one vectorized sum per bit plane.
+    counts = np.empty((packed.shape[1], 8), dtype=np.int64)
+    for bit in range(8):
+        counts[:, bit] = np.count_nonzero(packed & np.uint8(1 << bit), axis=0)
+    return counts.reshape(-1)[:num_bits]
+
+def pij_from_fractions(fractions, coincidences):
+    # The p_ij matrix from <x_i> (n,) and <x_i x_j> (n, n). The diagonal and
+    #  pairs without enough statistics to fit are 0.
+    xi = fractions[:, None]
+    xj = fractions[None, :]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = 4*(coincidences - xi*xj) / (1 - 2*xi - 2*xj + 4*coincidences)
+        pij = 0.5 - 0.5*np.sqrt(1 - ratio)
+    pij = np.nan_to_num(pij, nan=0.0)
+    np.fill_diagonal(pij, 0.0)
+    return pij
+
+def dem_pair_probabilities(dem):
+    # The p_ij the DEM predicts: the combined probability of the graphlike
+    #  components that flip exactly detectors i and j. Suggested
+    #  decompositions are used when present, like the matcher does.
+    pij = np.zeros((dem.num_detectors, dem.num_detectors))
+    for instruction in dem.flattened():
+        if instruction.type != "error":
+            continue
+        p = instruction.args_copy()[0]
+        for detectors, _ in error_components(instruction):
+            if len(detectors) == 2:
+                i, j = detectors
+                q = pij[i, j]
+                pij[i, j] = pij[j, i] = p*(1-q) + q*(1-p)
+    return pij
+
+
+class SyndromeStatistics:
+    # Running sums over bit-packed (shots, ceil(num_detectors/8)) chunks of
+    #  detection events. `detectors` restricts the pairwise statistics to a
+    #  subset (an index array), since their cost grows with its square.
+
+    def __init__(self, num_detectors, detectors=None, correlations=True):
+        self.num_detectors = num_detectors
+        self.detectors = np.arange(num_detectors) if detectors is None else np.asarray(detectors)
+        self.correlations = correlations
+        self.shots = 0
+        self.counts = np.zeros(num_detectors, dtype=np.int64)
+        self.weight_counts = np.zeros(num_detectors + 1, dtype=np.int64)
+        n = len(self.detectors) if correlations else 0
+        self.pair_counts = np.zeros((n, n), dtype=np.int64)
+
+    def add(self, detection_events):
+        # Adds one bit-packed chunk.
+        self.shots += len(detection_events)
+        self.counts += packed_column_counts(detection_events, self.num_detectors)
+        weights = np.bitwise_count(detection_events).sum(axis=1, dtype=np.int64)
+        self.weight_counts += np.bincount(weights, minlength=self.num_detectors + 1)
+        if self.correlations:
+            events = np.unpackbits(detection_events, axis=1, count=self.num_detectors, bitorder="little")
+            events = events[:, self.detectors].astype(np.float32)
+            self.pair_counts += (events.T @ events).astype(np.int64)
+        return self
+
+    def __add__(self, other):
+        total = SyndromeStatistics(self.num_detectors, self.detectors, self.correlations)
+        total.shots = self.shots + other.shots
+        total.counts = self.counts + other.counts
+        total.weight_counts = self.weight_counts + other.weight_counts
+        total.pair_counts = self.pair_counts + other.pair_counts
+        return total
+
+    def detection_fractions(self):
+        return self.counts / max(self.shots, 1)
+
+    def weight_histogram(self):
+        # Fraction of shots with w detection events, for w = 0..num_detectors.
+        return self.weight_counts / max(self.shots, 1)
+
+    def coincidences(self):
+        # <x_i x_j> over self.detectors.
+        if not self.correlations:
+            raise ValueError("pairwise statistics were not collected (correlations=False)")
+        return self.pair_counts / max(self.shots, 1)
+
+    def pij_matrix(self):
+        # p_ij over self.detectors.
+        return pij_from_fractions(self.detection_fractions()[self.detectors], self.coincidences())
+
+
+def group_fractions(fractions, table, field):
+    # Mean detection fraction per value of a detector table field, e.g.
+    #  "round" for the detection fraction per round: {value: fraction}.
+    values, inverse = np.unique(table[field], return_inverse=True)
+    sums = np.bincount(inverse, weights=fractions, minlength=len(values))
+    sizes = np.bincount(inverse, minlength=len(values))
+    return {value.item(): total / size for value, total, size in zip(values, sums, sizes)}
+
+def collect_statistics(circuit, shots, chunk_size=DEFAULT_CHUNK_SIZE, detectors=None, correlations=True,
+                       sampler=None, seed=None):
+    # Samples `circuit` in chunks and accumulates its SyndromeStatistics.
+    circuit = as_circuit(circuit)
+    stats = SyndromeStatistics(circuit.num_detectors, detectors, correlations)
+    for detection_events, _ in sample_chunks(circuit, shots, chunk_size, sampler=sampler, seed=seed):
+        stats.add(detection_events)
+    return stats
@@ -0,0 +1,251 @@
+# ============================
+# Transversal CNOT between two surface code patches
+#
+# Two patches of the same distance sit side by side (RegisterLayout cells
+#  (0,0) and (1,0)): patch 0 is the control, patch 1 the target. Both run
+#  noisy syndrome rounds in lockstep, and right after round `cnot_round` a
+#  physical CX is applied between every pair of matching data qubits.
+#
+# The gate maps the stabilizers X_c -> X_c X_t and Z_t -> Z_c Z_t, so in the
+#  first round after it an X stabilizer of the control is compared with the
+#  product of its own and the target's previous measurement, and a Z
+#  stabilizer of the target with its own and the control's. Logical
+#  observables are traced back through the gate the same way. The rounds
+#  before and after the gate are kept in REPEAT blocks.
+#
+# Measurement record of one syndrome round: control X, control Z, target X,
+#  target Z measures. Final measurement: control data, target data, then the
+#  measure qubits in the same order as a round.
+
+import numpy as np
+import stim
+
+from .lattice import RegisterLayout, coords_view
+from .surface_code import (append_cx_layers, append_detector, append_instruction,
+                           append_observable, append_syndrome_round, circuit_text)
+
+BASES = ("X", "Z")
+INITIAL_BASIS = {"0": "Z", "+": "X"}
+
+
+class CnotLayout:
+    # Joint target tuples for the control/target pair, with the same attribute
+    #  names as surface_code.PatchLayout so the shared round builders accept it.
+
+    def __init__(self, distance):
+        register = RegisterLayout(distance, [(0, 0), (1, 0)])
+        self.distance = distance
+        self.register = register
+        # coordinates in all_targets order: data of both patches, then each
+        #  patch's X and Z measures
+        patches = [register.patch(k) for k in range(2)]
+        self.coords = coords_view(np.concatenate(
+            [patch.data2 for patch in patches] + [block for patch in patches for block in (patch.x2, patch.z2)]))
+
+        self.patch_data = [tuple(register.data_idx[k].tolist()) for k in range(2)]
+        self.data_targets = self.patch_data[0] + self.patch_data[1]
+        self.x_targets = tuple(register.x_idx.ravel().tolist())
+        self.measure_targets = tuple(
+            q for k in range(2) for q in register.x_idx[k].tolist() + register.z_idx[k].tolist())
+        self.all_targets = self.data_targets + self.measure_targets
+        self.cx_layers = [tuple(layer.tolist()) for layer in register.cx_layers]
+        self.idle_layers = [tuple(layer.tolist()) for layer in register.idle_layers]
+
+        self.num_measures_per_type = n = register.x_idx.shape[1]
+        self.round_size = 4*n
+        self.num_datas = distance**2
+
+        # half-unit coordinates of each measure qubit, in record order
+        template = register.template
+        self.measure_coords = [
+            coords_view(register.patch(k).x2) if basis == "X" else coords_view(register.patch(k).z2)
+            for k in range(2) for basis in BASES]
+        # data-qubit corners of each stabilizer as local data indices (-1 if missing)
+        self.corners = {"X": (template.x_neighbours - template.offset).tolist(),
+                        "Z": (template.z_neighbours - template.offset).tolist()}
+
+        # logical operators as local data indices: Z along the last row, X along
+        #  the last column (the same choice as surface_code.final_step)
+        self.logical_data = {"Z": list(range(self.num_datas - distance, self.num_datas)),
+                             "X": list(range(distance - 1, self.num_datas, distance))}
+
+    def position(self, patch, basis, j):
+        # Position of stabilizer j of `basis` on `patch` within one round's record.
+        return patch*2*self.num_measures_per_type + BASES.index(basis)*self.num_measures_per_type + j
+
+    def stabilizers(self):
+        # (patch, basis, j) for every stabilizer, in record order.
+        n = self.num_measures_per_type
+        return [(k, basis, j) for k in range(2) for basis in BASES for j in range(n)]
+
+def propagated_partner(patch, basis):
+    # The patch whose stabilizer joins (patch, basis) when traced back through
+    #  the transversal CNOT, or None if the stabilizer passes unchanged.
+    if patch == 0 and basis == "X":
+        return 1
+    if patch == 1 and basis == "Z":
+        return 0
+    return None
+
+def deterministic_observables(initial, final_bases):
+    # Independent products of the measured logicals (control, target) that are
+    #  deterministic given the initial states, as (include_control,
+    #  include_target) pairs.
+    # A Pauli on the two logical qubits is tracked as bits (x_c, z_c, x_t, z_t);
+    #  conjugating by CNOT sets x_t ^= x_c and z_c ^= z_t.
+    deterministic = []
+    for use in ((1, 0), (0, 1), (1, 1)):
+        x_c = use[0] and final_bases[0] == "X"
+        z_c = use[0] and final_bases[0] == "Z"
+        x_t = use[1] and final_bases[1] == "X"
+        z_t = use[1] and final_bases[1] == "Z"
+        x_t ^= x_c
+        z_c ^= z_t
+        ok_c = not (x_c if INITIAL_BASIS[initial[0]] == "Z" else z_c)
+        ok_t = not (x_t if INITIAL_BASIS[initial[1]] == "Z" else z_t)
+        if ok_c and ok_t:
+            deterministic.append(use)
+    if len(deterministic) == 3:
+        return deterministic[:2] # the product is redundant
+    return deterministic
+
+def append_round_detectors(circuit, layout, gap=0, across_cnot=False):
+    # Detectors comparing every stabilizer with the previous round. `gap` is
+    #  the number of measurements between the two rounds' measure records (the
+    #  final data measurements). With `across_cnot`, stabilizers that the gate
+    #  mixes also include their partner's previous measurement.
+    size = layout.round_size
+    for patch, basis, j in layout.stabilizers():
+        pos = layout.position(patch, basis, j)
+        recs = [pos - size, pos - 2*size - gap]
+        partner = propagated_partner(patch, basis) if across_cnot else None
+        if partner is not None:
+            recs.append(layout.position(partner, basis, j) - 2*size - gap)
+        x, y = layout.measure_coords[2*patch + BASES.index(basis)][j]
+        append_detector(circuit, recs, [x, y, 0, patch])
+
+def append_joint_initialization(circuit, layout, p, initial):
+    for k, state in enumerate(initial):
+        reset = "R" if state == "0" else "RX"
+        append_instruction(circuit, reset, layout.patch_data[k])
+    append_instruction(circuit, "R", layout.measure_targets)
+    for k, state in enumerate(initial):
+        append_instruction(circuit, "X_ERROR" if state == "0" else "Z_ERROR", layout.patch_data[k], p)
+    append_instruction(circuit, "X_ERROR", layout.measure_targets, p)
+    append_instruction(circuit, "TICK")
+    append_instruction(circuit, "H", layout.x_targets)
+    append_instruction(circuit, "DEPOLARIZE1", layout.all_targets, p)
+    append_instruction(circuit, "TICK")
+
+    append_cx_layers(circuit, layout, p)
+
+    append_instruction(circuit, "H", layout.x_targets)
+    append_instruction(circuit, "DEPOLARIZE1", layout.all_targets, p)
+    append_instruction(circuit, "TICK")
+    append_instruction(circuit, "X_ERROR", layout.measure_targets, p)
+    append_instruction(circuit, "MR", layout.measure_targets)
+    append_instruction(circuit, "DEPOLARIZE1", layout.data_targets, p)
+    append_instruction(circuit, "TICK")
+
+    # only the stabilizers of each patch's initial basis are deterministic
+    for patch, basis, j in layout.stabilizers():
+        if basis == INITIAL_BASIS[initial[patch]]:
+            x, y = layout.measure_coords[2*patch + BASES.index(basis)][j]
+            append_detector(circuit, [layout.position(patch, basis, j) - layout.round_size], [x, y, 0, patch])
+
+def append_transversal_cnot(circuit, layout, p):
+    pairs = [q for pair in zip(*layout.patch_data) for q in pair]
+    append_instruction(circuit, "CX", pairs)
+    append_instruction(circuit, "DEPOLARIZE2", pairs, p)
+    append_instruction(circuit, "DEPOLARIZE1", layout.measure_targets, p)
+    append_instruction(circuit, "TICK")
+
+def append_joint_final(circuit, layout, p, initial, final_bases, across_cnot):
+    # Last syndrome round measured together with the data qubits.
+    append_instruction(circuit, "R", layout.measure_targets)
+    append_instruction(circuit, "X_ERROR", layout.measure_targets, p)
+    append_instruction(circuit, "DEPOLARIZE1", layout.data_targets, p)
+    append_instruction(circuit, "TICK")
+    append_instruction(circuit, "H", layout.x_targets)
+    append_instruction(circuit, "DEPOLARIZE1", layout.all_targets, p)
+    append_instruction(circuit, "TICK")
+
+    append_cx_layers(circuit, layout, p)
+
+    append_instruction(circuit, "H", layout.x_targets)
+    append_instruction(circuit, "DEPOLARIZE1", layout.all_targets, p)
+    append_instruction(circuit, "TICK")
+    for k, basis in enumerate(final_bases):
+        append_instruction(circuit, "X_ERROR" if basis == "Z" else "Z_ERROR", layout.patch_data[k], p)
+    append_instruction(circuit, "X_ERROR", layout.measure_targets, p)
+    for k, basis in enumerate(final_bases):
+        append_instruction(circuit, "M" if basis == "Z" else "MX", layout.patch_data[k])
+    append_instruction(circuit, "MR", layout.measure_targets)
+
+    data_block = 2*layout.num_datas
+    append_round_detectors(circuit, layout, gap=data_block, across_cnot=across_cnot)
+
+    # data measurements: each stabilizer of the measured basis with its corners
+    size = layout.round_size
+    total = data_block + size
+    def data_rec(patch, local):
+        return patch*layout.num_datas + local - total
+    for patch, basis in enumerate(final_bases):
+        for j, corners in enumerate(layout.corners[basis]):
+            recs = [layout.position(patch, basis, j) - size]
+            recs += [data_rec(patch, q) for q in corners if q >= 0]
+            x, y = layout.measure_coords[2*patch + BASES.index(basis)][j]
+            append_detector(circuit, recs, [x, y, 1, patch])
+
+    observables = deterministic_observables(initial, final_bases)
+    if not observables:
+        raise ValueError(f"no deterministic logical observable for initial={initial} "
+                         f"and final_bases={final_bases}")
+    for index, use in enumerate(observables):
+        recs = [data_rec(patch, q) for patch in range(2) if use[patch]
+                for q in layout.logical_data[final_bases[patch]]]
+        append_observable(circuit, recs, index)
+
+def transversal_cnot_circuit(distance, rounds, cnot_round, p, initial=("+", "0"), final_bases=("Z", "Z")):
+    # Returns one stim.Circuit with a control and a target patch running
+    #  `rounds` syndrome rounds, and a transversal CNOT after round
+    #  `cnot_round` (1 <= cnot_round < rounds). `initial` gives each patch's
+    #  state ("0" or "+"), `final_bases` the basis ("Z" or "X") each patch's
+    #  data qubits are measured in at the end.
+    if not 1 <= cnot_round < rounds:
+        raise ValueError(f"need 1 <= cnot_round < rounds, got cnot_round={cnot_round}, rounds={rounds}")
+    layout = CnotLayout(distance)
+    circuit = stim.Circuit()
+    circuit.append_from_stim_program_text("\n".join(
+        f"QUBIT_COORDS({','.join(map(str, coord))}) {index}"
+        for index, coord in zip(layout.all_targets, layout.coords)))
+
+    append_joint_initialization(circuit, layout, p, initial)
+    circuit.append_from_stim_program_text("SHIFT_COORDS(0, 0, 1)")
+
+    def append_repeated_rounds(count):
+        if count <= 0:
+            return
+        body = stim.Circuit()
+        append_syndrome_round(body, layout, p)
+        append_round_detectors(body, layout)
+        body.append_from_stim_program_text("SHIFT_COORDS(0, 0, 1)")
+        circuit.append(stim.CircuitRepeatBlock(count, body))
+
+    append_repeated_rounds(cnot_round - 1)
+    append_transversal_cnot(circuit, layout, p)
+
+    if rounds - cnot_round == 1:
+        # the final round is the first one after the gate
+        append_joint_final(circuit, layout, p, initial, final_bases, across_cnot=True)
+        return circuit
+
+    append_syndrome_round(circuit, layout, p)
+    append_round_detectors(circuit, layout, across_cnot=True)
+    circuit.append_from_stim_program_text("SHIFT_COORDS(0, 0, 1)")
+    append_repeated_rounds(rounds - cnot_round - 2)
+    append_joint_final(circuit, layout, p, initial, final_bases, across_cnot=False)
+    return circuit
+
+def transversal_cnot_circuit_string(distance, rounds, cnot_round, p, initial=("+", "0"), final_bases=("Z", "Z")):
+    return circuit_text(transversal_cnot_circuit(distance, rounds, cnot_round, p, initial, final_bases))
@@ -0,0 +1,313 @@
+# ============================
+# Batch validation of the generated circuits
+#
+# Sweeps the generators over distance, rounds, initial state and idx (and
+#  the CNOT options of transversal_cnot.py) and checks every circuit:
+#
+#   - deterministic: without noise, the measured parity of every detector
+#     and observable is 0 in every shot (a wrong rec[] offset in a DETECTOR or
+#     OBSERVABLE_INCLUDE, like the one in +and0/+.py, shows up here). The
+#     parities are computed from sampled measurements, since stim's detector
+#     sampler reports them relative to a reference sample and hides a
+#     detector that is always 1;
+#   - no gauge detectors: the DEM builds with allow_gauge_detectors=False;
+#   - qubit coordinates: every qubit's QUBIT_COORDS are those of its position
+#     in the lattice layout (for the transversal CNOT, of its own patch);
+#   - detector sanity: detector coordinates are unique and every detector is
+#     flipped by at least one error mechanism;
+#   - distance: the shortest graphlike logical error and the undetectable
+#     logical error search both find the code distance d.
+#
+# The memory and transversal-CNOT circuits do not reach d yet: with the CX
+#  order of lattice_with_noise, one two-qubit error in the middle of a
+#  stabilizer's CX layers (a hook error) flips two data qubits along a
+#  logical. These cases are listed in validation_known.json with the exact
+#  result of every check they fail. They are reported as known failures
+#  under their own heading; a case that fails in any other way (a different
+#  distance, another check) is a new failure and fails the run. After a
+#  deliberate change, --update-known rewrites the list from the current run.
+#
+# Cases run in a process pool. Results are appended to a JSONL file keyed by
+#  a hash of the circuit text (and the validator's source), so a re-run only
+#  validates circuits that changed.
+#
+# Run from the CODE directory:
+#   python -m Surface_Code_Google.validation --distances 3 5 7 --rounds 1 2 3 6
+#   python -m Surface_Code_Google.validation --results validation.jsonl --workers 8
+
+import argparse
+import concurrent.futures
+import hashlib
+import itertools
+import json
+import os
+
+import numpy as np
+import stim
+
+from .circuit_cache import DEFAULT_DIRECTORY, GENERATORS
+from .lattice import RegisterLayout, coords_view, patch_lattice
+from .transversal_cnot import deterministic_observables
+
+VALIDATION_P = 0.001
+DEFAULT_RESULTS = os.path.join(DEFAULT_DIRECTORY, "validation.jsonl")
+NOISELESS_SHOTS = 256
+
+# Hash of this file: part of every result key, so changing a check
+#  re-validates everything.
+VALIDATOR_VERSION = hashlib.sha256(open(__file__, "rb").read()).hexdigest()[:16]
+
+
+KNOWN_FAILURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "validation_known.json")
+
+def validation_cases(distances, rounds, initials=("0", "+"), idxs=(0,), transversal=True):
+    # Cases as {"generator", "params"} dicts. Transversal-CNOT cases use the
+    #  middle round for the gate and every combination of initial states and
+    #  final bases that has a deterministic observable.
+    cases = []
+    for d, r, initial, idx in itertools.product(distances, rounds, initials, idxs):
+        cases.append({"generator": "memory",
+                      "params": {"distance": d, "idx": idx, "rounds": r, "p": VALIDATION_P, "initial": initial}})
+    if transversal:
+        states = list(itertools.product(initials, repeat=2))
+        bases = list(itertools.product(("X", "Z"), repeat=2))
+        for d, r, initial, final_bases in itertools.product(distances, rounds, states, bases):
+            if r < 2 or not deterministic_observables(initial, final_bases):
+                continue
+            cases.append({"generator": "transversal_cnot",
+                          "params": {"distance": d, "rounds": r, "cnot_round": r // 2, "p": VALIDATION_P,
+                                     "initial": list(initial), "final_bases": list(final_bases)}})
+    return cases
+
+def case_circuit(case):
+    params = dict(case["params"])
+    for name in ("initial", "final_bases"):
+        if isinstance(params.get(name), list):
+            params[name] = tuple(params[name])
+    return GENERATORS[case["generator"]](**params)
+
+def layout_coords(case):
+    # {qubit: (col, row)} of every qubit of the case's lattice layout.
+    params = case["params"]
+    if case["generator"] == "memory":
+        patches = [patch_lattice(params["distance"], params["idx"])]
+    else:
+        register = RegisterLayout(params["distance"], [(0, 0), (1, 0)])
+        patches = [register.patch(k) for k in range(register.num_patches)]
+    return {q: coord for patch in patches
+            for q, coord in zip(patch.all_idx.tolist(), coords_view(patch.coords2))}
+
+def circuit_hash(circuit_text, code_distance, coords):
+    text = json.dumps({"circuit": circuit_text, "distance": code_distance, "coords": sorted(coords.items()),
+                       "version": VALIDATOR_VERSION})
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+def case_name(case):
+    return f"{case['generator']} " + " ".join(f"{k}={v}" for k, v in case["params"].items() if k != "p")
+
+# ======================================================
+# checks (run in the workers)
+
+def record_parities(circuit, measurements):
+    # Parity of the records of every detector, then every observable, for
+    #  each row of raw measurement results.
+    detectors = []
+    observables = np.zeros((len(measurements), circuit.num_observables), dtype=bool)
+    measured = 0
+    for instruction in circuit.flattened():
+        if instruction.name in ("DETECTOR", "OBSERVABLE_INCLUDE"):
+            recs = [measured + t.value for t in instruction.targets_copy() if t.is_measurement_record_target]
+            parity = (np.bitwise_xor.reduce(measurements[:, recs], axis=1) if recs
+                      else np.zeros(len(measurements), dtype=bool))
+            if instruction.name == "DETECTOR":
+                detectors.append(parity)
+            else:
+                observables[:, int(instruction.gate_args_copy()[0])] ^= parity
+        measured += instruction.num_measurements
+    detectors = np.stack(detectors, axis=1) if detectors else np.zeros((len(measurements), 0), dtype=bool)
+    return np.concatenate([detectors, observables], axis=1)
+
+def check_deterministic(circuit):
+    noiseless = circuit.without_noise()
+    measurements = noiseless.compile_sampler(seed=0).sample(NOISELESS_SHOTS)
+    fired = np.flatnonzero(record_parities(noiseless, measurements).any(axis=0))
+    detectors = [f"D{k}" for k in fired if k < circuit.num_detectors]
+    observables = [f"L{k - circuit.num_detectors}" for k in fired if k >= circuit.num_detectors]
+    if detectors or observables:
+        return False, "nonzero parity without noise: " + " ".join((detectors + observables)[:10])
+    return True, ""
+
+def check_gauge(circuit):
+    try:
+        circuit.detector_error_model(allow_gauge_detectors=False)
+    except ValueError as error:
+        return False, str(error).splitlines()[0]
+    return True, ""
+
+def check_qubit_coords(circuit, coords):
+    final = circuit.get_final_qubit_coordinates()
+    missing = sorted(set(coords) - set(final))
+    if missing:
+        return False, f"{len(missing)} qubits without QUBIT_COORDS, first {missing[0]}"
+    wrong = [q for q, coord in coords.items() if tuple(final[q]) != tuple(map(float, coord))]
+    if wrong:
+        q = wrong[0]
+        return False, f"{len(wrong)} qubits off their layout position, first {q} at {final[q]} not {coords[q]}"
+    return True, ""
+
+def check_detectors(circuit):
+    coords = circuit.get_detector_coordinates()
+    missing = [k for k in range(circuit.num_detectors) if not coords.get(k)]
+    if missing:
+        return False, f"{len(missing)} detectors without coordinates, first D{missing[0]}"
+    if len(set(map(tuple, coords.values()))) < circuit.num_detectors:
+        return False, "detector coordinates are not unique"
+    touched = set()
+    for instruction in circuit.detector_error_model(allow_gauge_detectors=True).flattened():
+        if instruction.type == "error":
+            touched.update(t.val for t in instruction.targets_copy() if t.is_relative_detector_id())
+    silent = sorted(set(range(circuit.num_detectors)) - touched)
+    if silent:
+        return False, f"{len(silent)} detectors that no error flips, first D{silent[0]}"
+    return True, ""
+
+def check_distance(circuit, code_distance):
+    if not circuit.num_observables:
+        return False, "no observables"
+    graphlike = len(circuit.shortest_graphlike_error(ignore_ungraphlike_errors=True))
+    undetectable = len(circuit.search_for_undetectable_logical_errors(
+        dont_explore_detection_event_sets_with_size_above=4,
+        dont_explore_edges_with_degree_above=4,
+        dont_explore_edges_increasing_symptom_degree=False))
+    ok = graphlike == undetectable == code_distance
+    return ok, f"graphlike {graphlike}, undetectable {undetectable}, expected {code_distance}"
+
+def validate_circuit(circuit_text, code_distance, coords):
+    # Runs every check; returns {check: {"ok": bool, "detail": str}}.
+    circuit = stim.Circuit(circuit_text)
+    results = {}
+    for name, check in (("deterministic", check_deterministic), ("gauge", check_gauge),
+                        ("qubit coords", lambda c: check_qubit_coords(c, coords)),
+                        ("detectors", check_detectors),
+                        ("distance", lambda c: check_distance(c, code_distance))):
+        try:
+            ok, detail = check(circuit)
+        except Exception as error: # a check that crashes is a failed check
+            ok, detail = False, f"{type(error).__name__}: {str(error).splitlines()[0] if str(error) else ''}"
+        results[name] = {"ok": ok, "detail": detail}
+        if name == "gauge" and not ok:
+            break # the remaining checks need a DEM
+    return results
+
+# ======================================================
+# runner
+
+def load_results(path):
+    # Stored results by circuit hash; a truncated last line is ignored.
+    results = {}
+    if not os.path.exists(path):
+        return results
+    with open(path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            results[record["hash"]] = record
+    return results
+
+def validate(cases, results_path=DEFAULT_RESULTS, workers=None, progress=print):
+    # Validates every case, reusing stored results of identical circuits.
+    #  Returns one record per case: {"case", "hash", "checks", "ok", "cached"}.
+    stored = load_results(results_path)
+    records = [None] * len(cases)
+    todo = {}
+    for i, case in enumerate(cases):
+        text = str(case_circuit(case))
+        inputs = (case["params"]["distance"], layout_coords(case))
+        key = circuit_hash(text, *inputs)
+        if key in stored:
+            records[i] = dict(stored[key], case=case, cached=True)
+        else:
+            todo.setdefault(key, (text, inputs, []))[2].append(i)
+
+    directory = os.path.dirname(results_path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(results_path, "a") as f, concurrent.futures.ProcessPoolExecutor(workers or os.cpu_count()) as pool:
+        futures = {pool.submit(validate_circuit, text, *inputs): key for key, (text, inputs, _) in todo.items()}
+        for future in concurrent.futures.as_completed(futures):
+            key = futures[future]
+            checks = future.result()
+            ok = all(check["ok"] for check in checks.values())
+            indices = todo[key][2]
+            record = {"hash": key, "case": cases[indices[0]], "checks": checks, "ok": ok}
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            for i in indices:
+                records[i] = dict(record, case=cases[i], cached=False)
+            if progress is not None:
+                progress(f"{'ok  ' if ok else 'FAIL'} {case_name(cases[indices[0]])}")
+    return records
+
+def failed_checks(record):
+    return {name: check["detail"] for name, check in record["checks"].items() if not check["ok"]}
+
+def load_known(path=KNOWN_FAILURES):
+    # Known failures: {"reason": str, "cases": {case name: {check: detail}}}.
+    if not os.path.exists(path):
+        return {"reason": "", "cases": {}}
+    with open(path) as f:
+        return json.load(f)
+
+def update_known(records, path=KNOWN_FAILURES):
+    # Rewrites the known failures from the failing records of this run.
+    known = load_known(path)
+    known["cases"] = {case_name(record["case"]): failed_checks(record) for record in records if not record["ok"]}
+    with open(path, "w") as f:
+        json.dump(known, f, indent=1, sort_keys=True)
+        f.write("\n")
+
+def print_failures(records, known=None):
+    # Prints the known failures, the cases that left the known list and the
+    #  new failures; returns the new failures.
+    known = load_known() if known is None else known
+    expected = [record for record in records
+                if not record["ok"] and known["cases"].get(case_name(record["case"])) == failed_checks(record)]
+    failures = [record for record in records if not record["ok"] and record not in expected]
+    fixed = [record for record in records if record["ok"] and case_name(record["case"]) in known["cases"]]
+    cached = sum(record["cached"] for record in records)
+    print(f"{len(records)} cases, {cached} from cache, {len(failures)} failing, {len(expected)} known failures")
+    if expected:
+        print(f"KNOWN FAILURES ({known['reason']})")
+        for record in expected:
+            details = "; ".join(f"{name}: {detail}" for name, detail in failed_checks(record).items())
+            print(f"  {case_name(record['case'])}: {details}")
+    for record in fixed:
+        print(f"now passing, remove from the known failures: {case_name(record['case'])}")
+    for record in failures:
+        print(case_name(record["case"]))
+        for name, detail in failed_checks(record).items():
+            print(f"  {name}: {detail}")
+            if case_name(record["case"]) in known["cases"]:
+                print(f"  known failure was: {known['cases'][case_name(record['case'])]}")
+    return failures
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Validate generated circuits in a process pool.")
+    parser.add_argument("--distances", type=int, nargs="+", default=[3, 5, 7])
+    parser.add_argument("--rounds", type=int, nargs="+", default=[1, 2, 3, 6])
+    parser.add_argument("--initials", nargs="+", default=["0", "+"], choices=["0", "+"])
+    parser.add_argument("--idxs", type=int, nargs="+", default=[0, 1])
+    parser.add_argument("--no-transversal", action="store_true", help="only the memory circuits")
+    parser.add_argument("--results", default=DEFAULT_RESULTS, help="JSONL file of stored results")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--update-known", action="store_true",
+                        help="record this run's failures as the known failures")
+    args = parser.parse_args()
+    cases = validation_cases(args.distances, args.rounds, args.initials, args.idxs, not args.no_transversal)
+    records = validate(cases, args.results, args.workers, progress=None)
+    if args.update_known:
+        update_known(records)
+    if print_failures(records):
+        raise SystemExit(1)